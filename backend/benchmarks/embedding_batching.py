@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Benchmark: query encode throughput under concurrent chats, with and without micro-batching
+
+Simulates --chats concurrent chat requests, each encoding its expanded RAG
+queries (--queries-per-chat unique sentences, so the LRU cache never hits)
+--rounds times in a row. Two modes are compared on the same embedder:
+
+- per-request: every chat runs its own encode() on a thread pool sized like
+  the RAG pool (RAG_MAX_WORKERS), as before micro-batching
+- micro-batch: every chat awaits MicroBatchEmbedder.encode_async(), which
+  merges concurrent requests into one forward pass
+
+Reports sentences/sec, per-chat encode latency and the batch sizes formed.
+No MongoDB or vector store is needed.
+
+Usage (from backend/):
+    python -m benchmarks.embedding_batching --chats 50 --rounds 20
+    EMBEDDING_BATCH_MAX_WAIT_MS=5 python -m benchmarks.embedding_batching
+"""
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from embedder_service import (
+    EMBEDDING_BATCH_MAX_SIZE,
+    EMBEDDING_BATCH_MAX_WAIT_MS,
+    MicroBatchEmbedder,
+    get_embedder
+)
+from rag_service import RAG_MAX_WORKERS
+
+QUERY_TEMPLATES = [
+    "How much did I spend on food in week {n}?",
+    "current budget and spending for month {n}",
+    "upcoming bills and expenses #{n}",
+    "Can I afford a trip costing {n} thousand?",
+    "monthly expenditure report {n}",
+    "available balance after payment {n}",
+]
+
+
+def chat_queries(chat: int, round_: int, count: int):
+    base = (chat * 1000 + round_) * count
+    return [QUERY_TEMPLATES[i % len(QUERY_TEMPLATES)].format(n=base + i) for i in range(count)]
+
+
+async def run_chats(encode, chats: int, rounds: int, queries_per_chat: int):
+    """Every chat encodes its queries rounds times; returns (seconds, per-encode latencies in ms)"""
+    latencies = []
+
+    async def chat(chat_id: int):
+        for round_ in range(rounds):
+            queries = chat_queries(chat_id, round_, queries_per_chat)
+            started = time.perf_counter()
+            embeddings = await encode(queries)
+            latencies.append((time.perf_counter() - started) * 1000)
+            assert len(embeddings) == len(queries)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(chat(chat_id) for chat_id in range(chats)))
+    return time.perf_counter() - started, sorted(latencies)
+
+
+def report(label: str, sentences: int, seconds: float, latencies, extra: str = ""):
+    p50 = latencies[len(latencies) // 2]
+    p95 = latencies[int(len(latencies) * 0.95)]
+    print(f"  {label:<12} {sentences / seconds:>9.1f} sentences/s  "
+          f"encode p50 {p50:>8.1f} ms  p95 {p95:>8.1f} ms{extra}")
+
+
+async def benchmark(args):
+    embedder = get_embedder()
+    embedder.encode(["warm-up sentence"])
+    sentences = args.chats * args.rounds * args.queries_per_chat
+    print(f"{embedder.model_name}: {args.chats} concurrent chats x {args.rounds} rounds x "
+          f"{args.queries_per_chat} queries = {sentences} sentences\n")
+
+    executor = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="rag")
+    loop = asyncio.get_running_loop()
+
+    async def per_request(queries):
+        return await loop.run_in_executor(executor, embedder.encode, queries)
+
+    seconds, latencies = await run_chats(per_request, args.chats, args.rounds, args.queries_per_chat)
+    report("per-request", sentences, seconds, latencies, f"  ({args.workers} threads)")
+    executor.shutdown()
+
+    batcher = MicroBatchEmbedder(embedder, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+    seconds, latencies = await run_chats(batcher.encode_async, args.chats, args.rounds, args.queries_per_chat)
+    stats = batcher.get_stats()
+    report("micro-batch", sentences, seconds, latencies,
+           f"  (avg batch {stats['avg_batch']}, max {stats['max_batch']}, {stats['batches']} batches)")
+    batcher.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--queries-per-chat", type=int, default=6)
+    parser.add_argument("--workers", type=int, default=RAG_MAX_WORKERS, help="threads for per-request encodes")
+    parser.add_argument("--max-batch-size", type=int, default=EMBEDDING_BATCH_MAX_SIZE)
+    parser.add_argument("--max-wait-ms", type=float, default=EMBEDDING_BATCH_MAX_WAIT_MS)
+    args = parser.parse_args()
+    asyncio.run(benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Benchmark: ONNX int8 embedder vs sentence-transformers all-MiniLM-L6-v2
+
+1. Equivalence: embeds chunk-style documents and chat queries with both
+   encoders and compares per-text cosine similarity, the query x document
+   similarity matrices and the top-3 documents each query retrieves. Exits
+   non-zero if the ONNX model drifts past the thresholds. The same check
+   runs under pytest as tests/test_onnx_embedder.py.
+2. Cold start and resident memory: constructs each embedder in a fresh
+   subprocess (after importing embedder_service) and reports load time and
+   RSS growth.
+3. Throughput: sentences/sec at batch size 1 (chat queries) and 64 (bulk
+   re-embedding).
+
+Usage (from backend/), after python export_onnx_embedder.py:
+    python -m benchmarks.onnx_embedder --sentences 2000
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+DOCUMENTS = [
+    "Transaction: Lunch - ₹450.00 (expense) in Food category at Zomato",
+    "Transaction: Monthly salary - ₹85,000.00 (income) in Salary category at Acme Corp",
+    "Transaction: Cab to airport - ₹1,250.00 (expense) in Travel category at Uber",
+    "Transaction: Electricity bill - ₹2,310.50 (expense) in Bills category at BESCOM",
+    "Transaction: Netflix subscription - ₹649.00 (expense) in Entertainment category at Netflix",
+    "Account Balance: ₹1,24,500.00 in HDFC Bank savings account",
+    "Financial Goal: Goa Trip - Target ₹60,000, Saved ₹22,000 (36.7% complete), deadline 2026-12-01",
+    "Financial Goal: Emergency Fund - Target ₹3,00,000, Saved ₹1,80,000 (60.0% complete)",
+    "Stock Holding: INFY - 25 shares @ ₹1,540.00, P&L ₹3,200.00",
+    "Mutual Fund: Parag Parikh Flexi Cap - 120.5 units, current value ₹78,400.00, SIP ₹5,000 monthly",
+    "Other Investment: Fixed Deposit - ₹1,00,000 invested at 7.1% interest",
+    "Insight: Food spending is 32% higher than last month",
+    "User Profile: Priya, age 28, salaried, moderate risk appetite",
+    "Transactions Summary: 142 transactions this month, total expense ₹48,230.00",
+]
+
+QUERIES = [
+    "Can I afford a trip to Goa?",
+    "How much did I spend on food?",
+    "What is my account balance?",
+    "How are my mutual fund SIPs doing?",
+    "Am I on track for my emergency fund?",
+    "How much do I pay for subscriptions?",
+    "What is my salary?",
+    "Should I invest more in stocks?",
+]
+
+
+def load_embedder(backend: str):
+    from embedder_service import OnnxEmbedder, SentenceTransformerEmbedder
+    return OnnxEmbedder() if backend == "onnx" else SentenceTransformerEmbedder()
+
+
+def rss_mb() -> float:
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def child(backend: str):
+    """Runs in a fresh interpreter: time and memory to get from import to a first embedding"""
+    import embedder_service  # noqa: F401  (shared cost, excluded from the numbers)
+    baseline = rss_mb()
+    started = time.perf_counter()
+    embedder = load_embedder(backend)
+    embedder.encode(["warm-up sentence"])
+    print(json.dumps({"cold_start_s": time.perf_counter() - started, "rss_mb": rss_mb() - baseline}))
+
+
+def cold_start(backend: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.onnx_embedder", "--child", backend],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def equivalence(reference, candidate, min_cosine: float, max_similarity_delta: float) -> bool:
+    texts = DOCUMENTS + QUERIES
+    ref = np.asarray(reference.encode(texts), dtype=np.float32)
+    cand = np.asarray(candidate.encode(texts), dtype=np.float32)
+
+    per_text = np.einsum("ij,ij->i", ref, cand) / (np.linalg.norm(ref, axis=1) * np.linalg.norm(cand, axis=1))
+    docs = slice(0, len(DOCUMENTS))
+    queries = slice(len(DOCUMENTS), len(texts))
+    ref_sim = ref[queries] @ ref[docs].T
+    cand_sim = cand[queries] @ cand[docs].T
+    delta = np.abs(ref_sim - cand_sim)
+    ref_top = np.argsort(-ref_sim, axis=1)[:, :3]
+    cand_top = np.argsort(-cand_sim, axis=1)[:, :3]
+    overlap = np.mean([len(set(a) & set(b)) / 3 for a, b in zip(ref_top, cand_top)])
+
+    print("Equivalence (sentence-transformers vs ONNX int8)")
+    print(f"  cosine(original, onnx) per text  min {per_text.min():.4f}  mean {per_text.mean():.4f}")
+    print(f"  query x document similarity      max |delta| {delta.max():.4f}  mean |delta| {delta.mean():.4f}")
+    print(f"  top-3 retrieval overlap          {overlap:.3f}")
+
+    passed = per_text.min() >= min_cosine and delta.max() <= max_similarity_delta
+    print(f"  {'PASS' if passed else 'FAIL'} (min cosine >= {min_cosine}, max |delta| <= {max_similarity_delta})\n")
+    return passed
+
+
+def throughput(embedder, sentences: int, batch_size: int) -> float:
+    texts = [f"{DOCUMENTS[i % len(DOCUMENTS)]} #{i}" for i in range(sentences)]
+    started = time.perf_counter()
+    for start in range(0, sentences, batch_size):
+        embedder.encode(texts[start:start + batch_size])
+    return sentences / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sentences", type=int, default=2000)
+    parser.add_argument("--min-cosine", type=float, default=0.98)
+    parser.add_argument("--max-similarity-delta", type=float, default=0.05)
+    parser.add_argument("--child", choices=["onnx", "torch"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+        return
+
+    original = load_embedder("torch")
+    onnx = load_embedder("onnx")
+    passed = equivalence(original, onnx, args.min_cosine, args.max_similarity_delta)
+
+    print("Cold start and memory (fresh process, excluding embedder_service imports)")
+    for backend in ("torch", "onnx"):
+        result = cold_start(backend)
+        print(f"  {backend:<6} {result['cold_start_s']:>7.2f} s  +{result['rss_mb']:>7.1f} MiB RSS")
+
+    print(f"\nThroughput ({args.sentences} sentences)")
+    for batch_size in (1, 64):
+        for backend, embedder in (("torch", original), ("onnx", onnx)):
+            rate = throughput(embedder, args.sentences, batch_size)
+            print(f"  {backend:<6} batch {batch_size:>3}  {rate:>9.1f} sentences/s")
+
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
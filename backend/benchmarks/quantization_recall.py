@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Evaluation: recall@k and footprint of quantized vector storage
+
+Embeds the real chunks of up to --users users from the configured MongoDB
+(profile, account, transactions, goals, investments, insights) with the
+active embedder, writes them into throwaway NumPy vector stores in each
+quantization mode, and runs the RAG query set (every query expansion phrase
+plus sample chat questions) against each user. The float32 store is the
+reference: recall@k is the share of its top k that a quantized store also
+returns, overall and by chunk type of the reference hit.
+
+Usage (from backend/):
+    python -m benchmarks.quantization_recall --users 200 --k 3 5 10
+"""
+import argparse
+import asyncio
+import shutil
+import tempfile
+from collections import defaultdict
+from pathlib import Path
+
+from embedder_service import EmbedderAgent, NumpyVectorStore
+from rag_service import RAGService
+
+MODES = ["none", "float16", "int8"]
+
+SAMPLE_QUESTIONS = [
+    "Can I afford a trip to Goa?",
+    "How much did I spend on food?",
+    "How are my mutual fund SIPs doing?",
+    "Am I on track for my savings goal?",
+    "What is my account balance?",
+    "Should I invest more in stocks?",
+    "Where did my money go last month?",
+    "How much do I pay for subscriptions?",
+]
+
+
+async def embed_users(agent: EmbedderAgent, limit: int):
+    """[(user_id, chunks, embeddings)] for users that produce at least one chunk"""
+    users = []
+    async for user in agent.db.users.find({}, {"_id": 1}).limit(limit):
+        user_id = str(user["_id"])
+        data = await agent.fetch_user_data(user_id)
+        chunks = agent.create_embedding_chunks(user_id, data)
+        if not chunks:
+            continue
+        embeddings = await asyncio.to_thread(agent.model.encode, [chunk["text"] for chunk in chunks])
+        users.append((user_id, chunks, embeddings))
+    return users
+
+
+def directory_mb(path: Path) -> float:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file()) / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--k", type=int, nargs="+", default=[3, 5, 10])
+    parser.add_argument("--rescore-factor", type=int, default=4)
+    args = parser.parse_args()
+
+    agent = EmbedderAgent()
+    if not agent.is_rag_enabled():
+        raise SystemExit("No embedding backend available")
+
+    loop = asyncio.new_event_loop()
+    try:
+        users = loop.run_until_complete(embed_users(agent, args.users))
+        loop.run_until_complete(agent.close())
+    finally:
+        loop.close()
+    if not users:
+        raise SystemExit("No users with chunks to evaluate")
+
+    queries = RAGService.all_expansion_phrases() + SAMPLE_QUESTIONS
+    query_embeddings = agent.model.encode(queries)
+    total_chunks = sum(len(chunks) for _, chunks, _ in users)
+    print(f"{len(users)} users, {total_chunks} chunks, {len(queries)} queries, "
+          f"embedder {agent.model.model_name}\n")
+
+    workdirs = {mode: Path(tempfile.mkdtemp(prefix=f"quant_{mode}_")) for mode in MODES}
+    try:
+        stores = {
+            mode: NumpyVectorStore(workdirs[mode], quantization=mode, rescore_factor=args.rescore_factor)
+            for mode in MODES
+        }
+        for store in stores.values():
+            for user_id, chunks, embeddings in users:
+                store.upsert(
+                    [chunk["id"] for chunk in chunks],
+                    embeddings,
+                    [chunk["text"] for chunk in chunks],
+                    [chunk["metadata"] for chunk in chunks]
+                )
+
+        max_k = max(args.k)
+        results = {
+            mode: {user_id: store.query(query_embeddings, n_results=max_k, user_id=user_id) for user_id, _, _ in users}
+            for mode, store in stores.items()
+        }
+
+        print(f"{'mode':<8} {'disk MiB':>9} {'vs f32':>7}  " + "  ".join(f"{'recall@' + str(k):>10}" for k in args.k))
+        baseline_mb = directory_mb(workdirs["none"])
+        by_type = {}
+        for mode in MODES:
+            recalls = []
+            type_hits = defaultdict(lambda: [0, 0])
+            for k in args.k:
+                found = expected = 0
+                for user_id, _, _ in users:
+                    reference, candidate = results["none"][user_id], results[mode][user_id]
+                    for ref_ids, ref_meta, ids in zip(reference["ids"], reference["metadatas"], candidate["ids"]):
+                        returned = set(ids[:k])
+                        for chunk_id, metadata in zip(ref_ids[:k], ref_meta[:k]):
+                            expected += 1
+                            found += chunk_id in returned
+                            if k == max_k:
+                                counts = type_hits[metadata.get("chunk_type", "unknown")]
+                                counts[0] += chunk_id in returned
+                                counts[1] += 1
+                recalls.append(found / expected if expected else 1.0)
+            by_type[mode] = type_hits
+            disk_mb = directory_mb(workdirs[mode])
+            print(f"{mode:<8} {disk_mb:>9.2f} {baseline_mb / disk_mb if disk_mb else 0:>6.2f}x  "
+                  + "  ".join(f"{recall:>10.4f}" for recall in recalls))
+
+        print(f"\nrecall@{max_k} by chunk type of the reference hit")
+        chunk_types = sorted(by_type["none"])
+        print(f"{'chunk_type':<24} {'hits':>6}  " + "  ".join(f"{mode:>8}" for mode in MODES[1:]))
+        for chunk_type in chunk_types:
+            total = by_type["none"][chunk_type][1]
+            print(f"{chunk_type:<24} {total:>6}  " + "  ".join(
+                f"{by_type[mode][chunk_type][0] / total:>8.4f}" for mode in MODES[1:]
+            ))
+    finally:
+        for workdir in workdirs.values():
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Benchmark: event-loop lag while RAG context is retrieved under concurrent chats
+
+Runs N concurrent RAG lookups twice, first calling the blocking
+get_rag_context_sync directly on the loop (the old behaviour) and then through
+the executor-backed async get_rag_context. A ticker coroutine measures how late
+the loop wakes it up. That lateness is what every other request on the worker
+(dashboard, transactions, ...) waits.
+
+Usage (from backend/):
+    python -m benchmarks.rag_loop_lag --user-id <id> --concurrency 20
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from embedder_service import EmbedderAgent
+from rag_service import RAGService
+
+QUERIES = [
+    "Can I afford a trip to Goa?",
+    "How much did I spend this month?",
+    "How are my mutual fund SIPs doing?",
+    "Am I on track for my savings goal?",
+]
+
+TICK_SECONDS = 0.005
+
+
+async def ticker(lags: list, stop: asyncio.Event):
+    """Sleep in small steps and record how late each wake-up is"""
+    while not stop.is_set():
+        expected = time.perf_counter() + TICK_SECONDS
+        await asyncio.sleep(TICK_SECONDS)
+        lags.append(max(0.0, time.perf_counter() - expected) * 1000)
+
+
+async def run_load(rag: RAGService, user_id: str, concurrency: int, use_executor: bool):
+    async def one_chat(idx: int):
+        query = QUERIES[idx % len(QUERIES)]
+        if use_executor:
+            await rag.get_rag_context(user_id, query)
+        else:
+            rag.get_rag_context_sync(user_id, query)
+
+    lags = []
+    stop = asyncio.Event()
+    tick_task = asyncio.create_task(ticker(lags, stop))
+    await asyncio.sleep(TICK_SECONDS * 2)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one_chat(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await tick_task
+
+    lags.sort()
+    p99 = lags[int(len(lags) * 0.99) - 1] if lags else 0.0
+    label = "executor" if use_executor else "on-loop"
+    print(
+        f"{label:<9} wall {elapsed * 1000:>8.1f} ms | loop lag "
+        f"mean {statistics.mean(lags) if lags else 0:>7.2f} ms  "
+        f"p99 {p99:>7.2f} ms  max {lags[-1] if lags else 0:>7.2f} ms  ({len(lags)} ticks)"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user-id", default="693d2626a878e575aaf43c0a")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=None, help="RAG thread pool size")
+    args = parser.parse_args()
+
+    agent = EmbedderAgent()
+    rag = RAGService(agent, max_workers=args.workers)
+    print(f"Embedder: {type(agent.model).__name__}, pool workers: {rag.max_workers}, concurrency: {args.concurrency}\n")
+
+    try:
+        # Warm the model once so neither run pays first-call costs
+        rag.get_rag_context_sync(args.user_id, QUERIES[0])
+
+        await run_load(rag, args.user_id, args.concurrency, use_executor=False)
+        await run_load(rag, args.user_id, args.concurrency, use_executor=True)
+    finally:
+        rag.close()
+        await agent.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
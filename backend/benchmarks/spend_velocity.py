@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Benchmark: /analytics/spend-velocity bytes on the wire and latency
+
+Compares the old find()+Python implementation (capped at 1000 documents per
+month, plus an uncapped variant for a like-for-like total) against
+get_spend_velocity, both before the user's rollups are built (projected
+$group on raw transactions) and after (daily rollups). Seeds a throwaway user
+in the configured MongoDB and removes it afterwards.
+
+Usage (from backend/):
+    python -m benchmarks.spend_velocity --per-month 10000 --runs 10
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import bson
+from pymongo import monitoring
+
+
+class ReplyBytesCounter(monitoring.CommandListener):
+    """Sums the BSON size of every reply MongoDB sends back"""
+
+    def __init__(self):
+        self.bytes = 0
+        self.commands = 0
+
+    def started(self, event):
+        self.commands += 1
+
+    def succeeded(self, event):
+        self.bytes += len(bson.encode(event.reply))
+
+    def failed(self, event):
+        pass
+
+    def reset(self):
+        self.bytes = 0
+        self.commands = 0
+
+
+# Listeners must be registered before server.py creates its Motor client
+counter = ReplyBytesCounter()
+monitoring.register(counter)
+
+import server  # noqa: E402
+
+
+async def legacy_spend_velocity(user_id: str, cap=1000):
+    """The previous implementation: fetch full expense documents and sum per day in Python"""
+    now = datetime.utcnow()
+    current_month_start = datetime(now.year, now.month, 1)
+    last_month_start = current_month_start - timedelta(days=30)
+
+    current_month = await server.db.transactions.find({
+        "user_id": user_id,
+        "transaction_type": "expense",
+        "date": {"$gte": current_month_start}
+    }).to_list(cap)
+    last_month = await server.db.transactions.find({
+        "user_id": user_id,
+        "transaction_type": "expense",
+        "date": {"$gte": last_month_start, "$lt": current_month_start}
+    }).to_list(cap)
+
+    current_by_day = {}
+    for txn in current_month:
+        current_by_day[txn["date"].day] = current_by_day.get(txn["date"].day, 0) + txn["amount"]
+    last_by_day = {}
+    for txn in last_month:
+        last_by_day[txn["date"].day] = last_by_day.get(txn["date"].day, 0) + txn["amount"]
+
+    return {
+        "current_total": sum(current_by_day.values()),
+        "last_total": sum(last_by_day.values())
+    }
+
+
+async def seed_transactions(user_id: str, per_month: int):
+    """per_month expenses spread over the elapsed part of this month and over last month"""
+    now = datetime.utcnow()
+    current_month_start = datetime(now.year, now.month, 1)
+    last_month_start = current_month_start - timedelta(days=30)
+    windows = [(current_month_start, now), (last_month_start, current_month_start)]
+
+    docs = []
+    for window_start, window_end in windows:
+        span = max(1, int((window_end - window_start).total_seconds()))
+        for _ in range(per_month):
+            docs.append({
+                "user_id": user_id,
+                "account_id": "bench",
+                "amount": round(random.uniform(50, 5000), 2),
+                "category": random.choice(["Food", "Travel", "Shopping", "Bills"]),
+                "merchant": random.choice(["Zomato", "Uber", "Amazon", "Airtel"]),
+                "description": "Benchmark transaction with a realistically sized description",
+                "transaction_type": "expense",
+                "date": window_start + timedelta(seconds=random.randrange(span))
+            })
+    await server.db.transactions.insert_many(docs)
+
+
+async def measure(label: str, func, runs: int):
+    counter.reset()
+    started = time.perf_counter()
+    for _ in range(runs):
+        result = await func()
+    elapsed_ms = (time.perf_counter() - started) * 1000 / runs
+    kib = counter.bytes / runs / 1024
+    commands = counter.commands / runs
+    print(f"  {label:<22} {commands:>5.1f} commands  {kib:>10.1f} KiB/call  {elapsed_ms:>8.2f} ms/call"
+          f"  current_total={result['current_total']:.2f}  last_total={result['last_total']:.2f}")
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--per-month", type=int, default=10000)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    user_id = f"bench_{uuid.uuid4().hex[:12]}"
+    await server.spending_rollups.ensure_indexes()
+    await seed_transactions(user_id, args.per_month)
+    print(f"Seeded {args.per_month} expenses per month for {user_id}\n")
+
+    try:
+        await measure("legacy (capped 1000)", lambda: legacy_spend_velocity(user_id), args.runs)
+        await measure("legacy (uncapped)", lambda: legacy_spend_velocity(user_id, cap=None), args.runs)
+        await measure("aggregation (raw)", lambda: server.get_spend_velocity(user_id), args.runs)
+        await server.spending_rollups.rebuild_user(user_id)
+        await measure("aggregation (rollups)", lambda: server.get_spend_velocity(user_id), args.runs)
+    finally:
+        await server.db.transactions.delete_many({"user_id": user_id})
+        await server.spending_rollups.clear_user(user_id)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
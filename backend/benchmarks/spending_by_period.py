@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Benchmark: /analytics/spending-by-period round-trips and latency
+
+Compares the old one-aggregation-per-bar loop against the single bucketed
+aggregation used by get_spending_by_period. Seeds a throwaway user in the
+configured MongoDB and removes it afterwards.
+
+Usage (from backend/):
+    python -m benchmarks.spending_by_period --transactions 5000 --runs 20
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo import monitoring
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Counts commands sent to MongoDB, keyed by command name"""
+
+    def __init__(self):
+        self.counts = {}
+
+    def started(self, event):
+        self.counts[event.command_name] = self.counts.get(event.command_name, 0) + 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def reset(self):
+        self.counts = {}
+
+
+# Listeners must be registered before server.py creates its Motor client
+counter = CommandCounter()
+monitoring.register(counter)
+
+import server  # noqa: E402
+
+
+async def legacy_spending_by_period(user_id: str, period: str):
+    """The previous implementation: one $match/$group round-trip per bar"""
+    results = []
+    for bar_start, bar_end, fields in server.build_spending_period_bars(period, datetime.utcnow()):
+        pipeline = [
+            {"$match": {
+                "user_id": user_id,
+                "transaction_type": "expense",
+                "date": {"$gte": bar_start, "$lt": bar_end}
+            }},
+            {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
+        ]
+        result = await server.db.transactions.aggregate(pipeline).to_list(1)
+        fields["amount"] = result[0]["total"] if result else 0
+        results.append(fields)
+    return results
+
+
+async def seed_transactions(user_id: str, count: int):
+    now = datetime.utcnow()
+    docs = [
+        {
+            "user_id": user_id,
+            "account_id": "bench",
+            "amount": round(random.uniform(50, 5000), 2),
+            "category": random.choice(["Food", "Travel", "Shopping", "Bills"]),
+            "merchant": random.choice(["Zomato", "Uber", "Amazon", "Airtel"]),
+            "transaction_type": random.choice(["expense", "expense", "expense", "income"]),
+            "date": now - timedelta(minutes=random.randint(0, 60 * 24 * 400))
+        }
+        for _ in range(count)
+    ]
+    await server.db.transactions.insert_many(docs)
+
+
+async def measure(label: str, func, user_id: str, period: str, runs: int):
+    counter.reset()
+    started = time.perf_counter()
+    for _ in range(runs):
+        result = await func(user_id, period)
+    elapsed_ms = (time.perf_counter() - started) * 1000 / runs
+    round_trips = counter.counts.get("aggregate", 0) / runs
+    print(f"  {label:<10} {round_trips:>6.1f} round-trips  {elapsed_ms:>8.2f} ms/call")
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transactions", type=int, default=5000)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    user_id = f"bench_{uuid.uuid4().hex[:12]}"
+    await seed_transactions(user_id, args.transactions)
+    print(f"Seeded {args.transactions} transactions for {user_id}\n")
+
+    try:
+        for period in ["1wk", "1mnth", "6mnth", "1yr"]:
+            print(f"period={period}")
+            old = await measure("per-bar", legacy_spending_by_period, user_id, period, args.runs)
+            new = await measure("bucketed", server.get_spending_by_period, user_id, period, args.runs)
+            same = [round(o["amount"], 2) for o in old] == [round(n["amount"], 2) for n in new]
+            print(f"  identical amounts: {same}\n")
+    finally:
+        await server.db.transactions.delete_many({"user_id": user_id})
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Benchmark: time from process start to first served request, and to a warm embedder
+
+Starts uvicorn server:app in a subprocess and polls GET /api/ (a non-chat
+route) until it answers, then GET /api/ready?require_embedder=true until the
+embedding model has finished loading. Run once per EMBEDDER_WARMUP mode to
+compare, e.g.:
+
+Usage (from backend/):
+    EMBEDDER_WARMUP=background python -m benchmarks.startup_time
+    EMBEDDER_WARMUP=eager python -m benchmarks.startup_time
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+
+def wait_for(url: str, started: float, timeout: float) -> float:
+    """Seconds since started until url returns 200"""
+    while time.perf_counter() - started < timeout:
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return time.perf_counter() - started
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.05)
+    raise TimeoutError(f"{url} not ready after {timeout:.0f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=180.0)
+    args = parser.parse_args()
+
+    base = f"http://127.0.0.1:{args.port}/api"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(args.port), "--log-level", "warning"],
+        env=os.environ.copy()
+    )
+    try:
+        first_request = wait_for(f"{base}/", started, args.timeout)
+        embedder_ready = wait_for(f"{base}/ready?require_embedder=true", started, args.timeout)
+        state = httpx.get(f"{base}/ready").json()
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+    print(f"warm-up mode          {state['warmup_mode']}")
+    print(f"first non-chat reply  {first_request:>7.2f} s after launch")
+    print(f"embedder ready        {embedder_ready:>7.2f} s after launch")
+    print(f"embedder              {state['embedder']}")
+
+
+if __name__ == "__main__":
+    main()
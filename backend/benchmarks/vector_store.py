@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Benchmark: per-user RAG vector search, ChromaDB vs the NumPy vector store
+
+Fills a throwaway store of each backend with synthetic unit vectors
+(--users users x --chunks chunks, MiniLM-sized by default) and then times
+RAG-shaped lookups: one query() per chat with the 6 expanded query
+embeddings, top 3 each, restricted to one random user. Reports load time,
+on-disk size and lookup latency percentiles. Nothing touches the real
+chroma_db/ or vector_store/ directories.
+
+Usage (from backend/):
+    python -m benchmarks.vector_store --users 10000 --chunks 100 --lookups 2000
+"""
+import argparse
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from embedder_service import ChromaVectorStore, NumpyVectorStore
+
+QUERIES_PER_LOOKUP = 6
+RESULTS_PER_QUERY = 3
+
+
+def unit_vectors(rng: np.random.Generator, count: int, dimensions: int) -> np.ndarray:
+    vectors = rng.standard_normal((count, dimensions)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def load_store(store, users: int, chunks: int, dimensions: int, seed: int, users_per_write: int = 100):
+    """Upsert every synthetic user's chunks, users_per_write users per call"""
+    rng = np.random.default_rng(seed)
+    for first in range(0, users, users_per_write):
+        batch_users = range(first, min(users, first + users_per_write))
+        ids, documents, metadatas = [], [], []
+        for user in batch_users:
+            for chunk in range(chunks):
+                ids.append(f"user{user}_chunk{chunk}")
+                documents.append(f"Transaction: Benchmark chunk {chunk} - ₹{chunk * 10:,.2f} (expense) in Food category at Zomato")
+                metadatas.append({"user_id": f"user{user}", "chunk_type": "transaction"})
+        embeddings = unit_vectors(rng, len(ids), dimensions)
+        store.upsert(ids, embeddings.tolist(), documents, metadatas)
+
+
+def directory_mb(path: Path) -> float:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file()) / (1024 * 1024)
+
+
+def time_lookups(store, users: int, lookups: int, dimensions: int, seed: int):
+    rng = np.random.default_rng(seed + 1)
+    picker = random.Random(seed)
+    latencies = []
+    for _ in range(lookups):
+        user_id = f"user{picker.randrange(users)}"
+        queries = unit_vectors(rng, QUERIES_PER_LOOKUP, dimensions).tolist()
+        started = time.perf_counter()
+        results = store.query(queries, n_results=RESULTS_PER_QUERY, user_id=user_id)
+        latencies.append((time.perf_counter() - started) * 1000)
+        assert all(len(ids) == RESULTS_PER_QUERY for ids in results["ids"])
+    latencies.sort()
+    return latencies
+
+
+def report(label: str, load_seconds: float, disk_mb: float, latencies):
+    p50 = latencies[len(latencies) // 2]
+    p95 = latencies[int(len(latencies) * 0.95)]
+    p99 = latencies[int(len(latencies) * 0.99)]
+    print(f"  {label:<8} load {load_seconds:>8.1f} s  disk {disk_mb:>9.1f} MiB  "
+          f"lookup mean {statistics.mean(latencies):>7.2f} ms  p50 {p50:>7.2f}  p95 {p95:>7.2f}  p99 {p99:>7.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--chunks", type=int, default=100, help="vectors per user")
+    parser.add_argument("--dimensions", type=int, default=384)
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--backends", nargs="+", default=["numpy", "chroma"], choices=["numpy", "chroma"])
+    parser.add_argument("--quantization", default="none", choices=["none", "float16", "int8"],
+                        help="row storage of the numpy backend")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"{args.users} users x {args.chunks} vectors x {args.dimensions}d, "
+          f"{args.lookups} lookups of {QUERIES_PER_LOOKUP} queries (top {RESULTS_PER_QUERY})\n")
+
+    stores = {
+        "numpy": lambda path: NumpyVectorStore(path, quantization=args.quantization),
+        "chroma": ChromaVectorStore
+    }
+    for backend in args.backends:
+        workdir = Path(tempfile.mkdtemp(prefix=f"bench_{backend}_"))
+        try:
+            store = stores[backend](workdir)
+            started = time.perf_counter()
+            load_store(store, args.users, args.chunks, args.dimensions, args.seed)
+            load_seconds = time.perf_counter() - started
+
+            # A fresh store reads from disk, as a restarted worker would
+            store = stores[backend](workdir)
+            latencies = time_lookups(store, args.users, args.lookups, args.dimensions, args.seed)
+            report(backend, load_seconds, directory_mb(workdir), latencies)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
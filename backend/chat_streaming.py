@@ -0,0 +1,140 @@
+"""
+Chat Streaming
+Incremental extraction of the chat summary from streamed LLM tokens
+
+The chat prompt asks for a JSON object whose "summary" field is what users
+read, so SummaryStreamExtractor decodes that string as its characters arrive
+and lets /chat/message/stream forward text before the JSON is complete.
+Replies that aren't JSON are streamed as plain text up to the "OPTIONS:"
+marker, mirroring the non-streaming fallback parser.
+"""
+import json
+import re
+from typing import Dict, Optional
+
+OPTIONS_MARKER = "OPTIONS:"
+_SUMMARY_KEY = re.compile(r'"summary"\s*:\s*"')
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+_HEX_DIGITS = set("0123456789abcdefABCDEF")
+_REPLACEMENT_CHAR = "\ufffd"
+
+
+def _hex4(text: str) -> Optional[int]:
+    """Value of a 4-digit \\u escape body, None if it isn't one"""
+    if len(text) != 4 or not set(text) <= _HEX_DIGITS:
+        return None
+    return int(text, 16)
+
+
+def _could_be_unicode_escape(text: str) -> bool:
+    """Whether text is a (possibly partial) \\uXXXX escape"""
+    return "\\uXXXX".startswith(text[:2]) and set(text[2:6]) <= _HEX_DIGITS
+
+
+def sse_event(event: str, data: Dict) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class SummaryStreamExtractor:
+    """Feed raw LLM tokens, get back the newly readable part of the summary"""
+
+    def __init__(self):
+        self.buffer = ""
+        self.mode: Optional[str] = None  # "json" or "text" once the first character arrives
+        self._pos = 0  # next unread character of the summary string (json) or of the text
+        self._done = False
+
+    def feed(self, token: str) -> str:
+        self.buffer += token
+        if self.mode is None:
+            stripped = self.buffer.lstrip()
+            if not stripped:
+                return ""
+            # A fenced ```json block is still JSON for extraction purposes
+            self.mode = "json" if stripped[0] in "{`" else "text"
+        if self._done:
+            return ""
+        return self._feed_json() if self.mode == "json" else self._feed_text()
+
+    def flush(self) -> str:
+        """Text held back at the end of a plain-text reply that turned out not to be a marker"""
+        if self.mode != "text" or self._done:
+            return ""
+        self._done = True
+        return self.buffer[self._pos:]
+
+    def _feed_text(self) -> str:
+        marker = self.buffer.find(OPTIONS_MARKER, self._pos)
+        if marker != -1:
+            self._done = True
+            end = marker
+        else:
+            # Hold back a possible partial marker at the end of the buffer
+            end = max(self._pos, len(self.buffer) - len(OPTIONS_MARKER) + 1)
+        text = self.buffer[self._pos:end]
+        self._pos = end
+        return text
+
+    def _feed_json(self) -> str:
+        if self._pos == 0:
+            match = _SUMMARY_KEY.search(self.buffer)
+            if not match:
+                return ""
+            self._pos = match.end()
+
+        out = []
+        i = self._pos
+        while i < len(self.buffer):
+            char = self.buffer[i]
+            if char == '"':
+                self._done = True
+                i += 1
+                break
+            if char != '\\':
+                out.append(char)
+                i += 1
+                continue
+            # Escape sequence: wait until it is complete
+            if i + 1 >= len(self.buffer):
+                break
+            code = self.buffer[i + 1]
+            if code == 'u':
+                if i + 6 > len(self.buffer):
+                    break
+                decoded = self._decode_unicode_escape(i)
+                if decoded is None:
+                    break
+                text, i = decoded
+                out.append(text)
+            else:
+                out.append(_ESCAPES.get(code, code))
+                i += 2
+        self._pos = i
+        return "".join(out)
+
+    def _decode_unicode_escape(self, i: int):
+        """
+        (text, next index) for the \\u escape at buffer[i], None to wait for more
+
+        Characters outside the BMP arrive as a surrogate pair of escapes
+        (\\ud83d\\udcca), which are combined into one character; a lone
+        surrogate can't be UTF-8 encoded and becomes U+FFFD. An escape with
+        invalid hex is kept as literal text.
+        """
+        value = _hex4(self.buffer[i + 2:i + 6])
+        if value is None:
+            return self.buffer[i:i + 2], i + 2
+        if 0xDC00 <= value <= 0xDFFF:
+            return _REPLACEMENT_CHAR, i + 6
+        if not 0xD800 <= value <= 0xDBFF:
+            return chr(value), i + 6
+
+        low_escape = self.buffer[i + 6:i + 12]
+        if len(low_escape) < 6 and _could_be_unicode_escape(low_escape):
+            return None
+        low = _hex4(low_escape[2:]) if low_escape.startswith("\\u") else None
+        if low is None or not 0xDC00 <= low <= 0xDFFF:
+            return _REPLACEMENT_CHAR, i + 6
+        return chr(0x10000 + ((value - 0xD800) << 10) + (low - 0xDC00)), i + 12
+
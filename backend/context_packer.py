@@ -0,0 +1,243 @@
+"""
+Context Packer
+Fits retrieved chunks into a token budget before they reach the LLM prompt
+
+Chunks are ranked by vector distance plus a per-type penalty (profile and
+account facts first, loosely related "other" chunks last) and added greedily
+while the rendered context stays under RAG_CONTEXT_TOKEN_BUDGET. Transaction
+chunks are rendered as one compact table, with repeats of the same merchant,
+category and type collapsed into a single row with a count and total.
+Every pack reports the tokens the old one-bullet-per-chunk layout would have
+used, so the savings show up in the logs and in /chat/cache-stats.
+"""
+import os
+import re
+import logging
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Token budget for the retrieved-context block of a chat prompt
+RAG_CONTEXT_TOKEN_BUDGET = int(os.environ.get("RAG_CONTEXT_TOKEN_BUDGET", "700"))
+# Distance penalty per priority step; cosine distances of useful chunks sit roughly in 0.3-1.2
+RAG_CHUNK_TYPE_WEIGHT = float(os.environ.get("RAG_CHUNK_TYPE_WEIGHT", "0.1"))
+
+# Lower packs first at equal distance
+CHUNK_TYPE_PRIORITY = {
+    "profile": 0,
+    "account": 0,
+    "goals": 1,
+    "budget": 1,
+    "investments": 2,
+    "transactions": 2,
+    "other": 3
+}
+
+# (group, header) in the order sections appear in the context
+SECTIONS = [
+    ("profile", "USER PROFILE:"),
+    ("account", "ACCOUNT INFORMATION:"),
+    ("goals", "FINANCIAL GOALS:"),
+    ("budget", "BUDGET:"),
+    ("transactions", "RECENT TRANSACTIONS:"),
+    ("investments", "INVESTMENT PORTFOLIO:"),
+    ("other", "OTHER RELEVANT INFORMATION:")
+]
+
+CONTEXT_HEADER = "=== RETRIEVED USER CONTEXT ===\n"
+CONTEXT_FOOTER = "=== END OF RETRIEVED CONTEXT ===\n"
+TRANSACTION_TABLE_HEADER = "RECENT TRANSACTIONS (merchant | category | type | description | count | total):"
+
+# Matches the transaction chunk text written by EmbedderAgent.create_embedding_chunks
+_TRANSACTION_LINE = re.compile(
+    r"^Transaction: (?P<description>.*) - ₹(?P<amount>-?[\d,]+(?:\.\d+)?) "
+    r"\((?P<type>[^)]*)\) in (?P<category>.*) category at (?P<merchant>.*)$"
+)
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    """tiktoken's cl100k_base if it can be loaded, else None (character estimate)"""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            # Not installed, or the BPE file can't be downloaded
+            logger.info(f"tiktoken unavailable, estimating tokens from length: {str(e)}")
+    return _encoding
+
+
+def estimate_tokens(text: str) -> int:
+    """Token count of text; about 4 characters per token when tiktoken is unavailable"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def parse_transaction_line(text: str) -> Optional[Dict]:
+    """Fields of a transaction chunk, or None if its text isn't in the expected format"""
+    match = _TRANSACTION_LINE.match(text)
+    if not match:
+        return None
+    try:
+        amount = float(match.group("amount").replace(",", ""))
+    except ValueError:
+        return None
+    return {
+        "description": match.group("description"),
+        "amount": amount,
+        "type": match.group("type"),
+        "category": match.group("category"),
+        "merchant": match.group("merchant")
+    }
+
+
+def transaction_table_rows(chunks: List[Dict]) -> List[str]:
+    """
+    Transaction chunks as compact table rows
+
+    Rows sharing merchant, category and type collapse into one with a count
+    and total; chunks that don't parse are kept as plain bullets.
+    """
+    rows: Dict[Tuple[str, str, str], Dict] = {}
+    unparsed = []
+    for chunk in chunks:
+        fields = parse_transaction_line(chunk["text"])
+        if fields is None:
+            unparsed.append(f"- {chunk['text']}")
+            continue
+        key = (fields["merchant"], fields["category"], fields["type"])
+        row = rows.setdefault(key, {"count": 0, "total": 0.0, "descriptions": set()})
+        row["count"] += 1
+        row["total"] += fields["amount"]
+        row["descriptions"].add(fields["description"])
+
+    lines = []
+    for (merchant, category, txn_type), row in rows.items():
+        description = next(iter(row["descriptions"])) if len(row["descriptions"]) == 1 else "various"
+        lines.append(f"- {merchant} | {category} | {txn_type} | {description} | {row['count']} | ₹{row['total']:,.2f}")
+    return lines + unparsed
+
+
+class ContextPacker:
+    """Greedy, priority-ordered packing of retrieved chunks under a token budget"""
+
+    def __init__(
+        self,
+        token_budget: int = RAG_CONTEXT_TOKEN_BUDGET,
+        type_weight: float = RAG_CHUNK_TYPE_WEIGHT
+    ):
+        self.token_budget = token_budget
+        self.type_weight = type_weight
+        self.stats = {
+            "packs": 0,
+            "chunks_in": 0,
+            "chunks_packed": 0,
+            "tokens_unpacked": 0,
+            "tokens_packed": 0,
+            "tokens_saved": 0
+        }
+
+    def score(self, group: str, chunk: Dict) -> float:
+        """Lower is better: vector distance plus the chunk type's penalty"""
+        priority = CHUNK_TYPE_PRIORITY.get(group, CHUNK_TYPE_PRIORITY["other"])
+        return chunk.get("distance", 0.0) + self.type_weight * priority
+
+    def render(self, grouped: Dict[str, List[Dict]], compact: bool = True) -> str:
+        """Sectioned context string; compact renders transactions as a table"""
+        parts = [CONTEXT_HEADER]
+        for group, header in SECTIONS:
+            chunks = grouped.get(group)
+            if not chunks:
+                continue
+            if group == "transactions" and compact:
+                parts.append(TRANSACTION_TABLE_HEADER)
+                parts.extend(transaction_table_rows(chunks))
+            else:
+                parts.append(header)
+                parts.extend(f"- {chunk['text']}" for chunk in chunks)
+            parts.append("")
+        parts.append(CONTEXT_FOOTER)
+        return "\n".join(parts)
+
+    def pack(self, grouped: Dict[str, List[Dict]], token_budget: Optional[int] = None) -> Tuple[str, Dict]:
+        """
+        Render the best chunks that fit the budget
+
+        Args:
+            grouped: Chunks by section, as returned by RAGService.group_chunks_by_type
+            token_budget: Overrides the packer's budget for this call
+
+        Returns:
+            (context string, report with token counts before and after packing)
+        """
+        budget = token_budget or self.token_budget
+        candidates = sorted(
+            ((self.score(group, chunk), group, chunk) for group, chunks in grouped.items() for chunk in chunks),
+            key=lambda candidate: candidate[0]
+        )
+
+        # Fixed cost: header, footer and the blank lines between them
+        used = estimate_tokens(CONTEXT_HEADER) + estimate_tokens(CONTEXT_FOOTER)
+        packed: Dict[str, List[Dict]] = {}
+        table_tokens = 0
+        for _, group, chunk in candidates:
+            if group == "transactions":
+                # Marginal cost of the table: a repeat of an existing row only bumps its count and total
+                rows = transaction_table_rows(packed.get("transactions", []) + [chunk])
+                new_table_tokens = estimate_tokens("\n".join(rows)) + len(rows)
+                cost = new_table_tokens - table_tokens
+                header = TRANSACTION_TABLE_HEADER
+            else:
+                cost = estimate_tokens(f"- {chunk['text']}") + 1
+                header = dict(SECTIONS).get(group, "")
+            if group not in packed:
+                cost += estimate_tokens(header) + 2
+
+            # The best-ranked chunk always goes in, so the context is never empty
+            if packed and used + cost > budget:
+                continue
+            packed.setdefault(group, []).append(chunk)
+            used += cost
+            if group == "transactions":
+                table_tokens = new_table_tokens
+
+        # Keep retrieval order within each section
+        for group, chunks in packed.items():
+            order = {id(chunk): i for i, chunk in enumerate(grouped[group])}
+            chunks.sort(key=lambda chunk: order[id(chunk)])
+
+        context = self.render(packed)
+        report = {
+            "chunks_in": len(candidates),
+            "chunks_packed": sum(len(chunks) for chunks in packed.values()),
+            "tokens_unpacked": estimate_tokens(self.render(grouped, compact=False)),
+            "tokens_packed": estimate_tokens(context),
+            "token_budget": budget
+        }
+        report["tokens_saved"] = max(0, report["tokens_unpacked"] - report["tokens_packed"])
+
+        self.stats["packs"] += 1
+        for key in ("chunks_in", "chunks_packed", "tokens_unpacked", "tokens_packed", "tokens_saved"):
+            self.stats[key] += report[key]
+        logger.info(
+            f"Packed {report['chunks_packed']}/{report['chunks_in']} chunks into "
+            f"{report['tokens_packed']} tokens (budget {budget}, saved {report['tokens_saved']})"
+        )
+        return context, report
+
+    def get_stats(self) -> Dict:
+        packs = self.stats["packs"]
+        return {
+            "token_budget": self.token_budget,
+            **self.stats,
+            "avg_tokens_saved": round(self.stats["tokens_saved"] / packs, 1) if packs else 0.0
+        }
@@ -1,17 +1,33 @@
 """
 Embedder Agent Service
-Fetches user data from MongoDB and updates embeddings in ChromaDB
+Fetches user data from MongoDB and updates embeddings in the vector store
 Supports multiple embedding backends with graceful fallback
+
+Vectors live in a VectorStore: the global ChromaDB collection by default, or
+per-user NumPy matrices (VECTOR_STORE_BACKEND=numpy). Switching backends
+starts from an empty store; the next bulk update re-embeds every user.
 """
 import os
+import argparse
 import asyncio
+import hashlib
+import json
 import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, List, Optional
 from pathlib import Path
 
-import chromadb
-from chromadb.config import Settings
+import numpy as np
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process write lock for the numpy vector store
+    fcntl = None
 from motor.motor_asyncio import AsyncIOMotorClient
 from bson import ObjectId
 from dotenv import load_dotenv
@@ -23,10 +39,44 @@ load_dotenv(ROOT_DIR / '.env')
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+# Max query embeddings kept in the in-process LRU cache
+EMBEDDING_CACHE_SIZE = int(os.environ.get("EMBEDDING_CACHE_SIZE", "2048"))
+
+# Bulk re-embedding: users fetched from Mongo at once, and chunk texts per encode() call
+BULK_FETCH_CONCURRENCY = int(os.environ.get("BULK_FETCH_CONCURRENCY", "16"))
+BULK_ENCODE_BATCH_SIZE = int(os.environ.get("BULK_ENCODE_BATCH_SIZE", "512"))
+# Max records per Chroma upsert/delete call
+CHROMA_WRITE_BATCH_SIZE = int(os.environ.get("CHROMA_WRITE_BATCH_SIZE", "1000"))
+
+# ONNX int8 embedder built by export_onnx_embedder.py; tried before sentence-transformers
+ONNX_EMBEDDER_DIR = Path(os.environ.get("ONNX_EMBEDDER_DIR", str(ROOT_DIR / "models" / "all-MiniLM-L6-v2-onnx")))
+ONNX_MODEL_FILE = "model_int8.onnx"
+ONNX_MAX_SEQ_LENGTH = 256  # all-MiniLM-L6-v2's max_seq_length
+ONNX_BATCH_SIZE = int(os.environ.get("ONNX_BATCH_SIZE", "64"))
+# onnxruntime intra-op threads; 0 lets onnxruntime use every core
+ONNX_EMBEDDER_THREADS = int(os.environ.get("ONNX_EMBEDDER_THREADS", "0"))
+
+# Vector storage: "chroma" (one global collection) or "numpy" (per-user mmap'd matrices)
+VECTOR_STORE_BACKEND = os.environ.get("VECTOR_STORE_BACKEND", "chroma").lower()
+# Users whose matrices and metadata the numpy backend keeps open
+VECTOR_STORE_CACHE_USERS = int(os.environ.get("VECTOR_STORE_CACHE_USERS", "2048"))
+# numpy backend row storage: "none" (float32), "float16" or "int8" (per-vector scale, rescored)
+VECTOR_STORE_QUANTIZATION = os.environ.get("VECTOR_STORE_QUANTIZATION", "none").lower()
+# int8 candidates rescored per requested result
+VECTOR_STORE_RESCORE_FACTOR = int(os.environ.get("VECTOR_STORE_RESCORE_FACTOR", "4"))
+QUANTIZATION_DTYPES = {"none": np.float32, "float16": np.float16, "int8": np.int8}
+
+# Query encodes from concurrent requests are micro-batched: at most this many texts per
+# forward pass, waiting at most this long for more requests to join a batch
+EMBEDDING_BATCH_MAX_SIZE = int(os.environ.get("EMBEDDING_BATCH_MAX_SIZE", "64"))
+EMBEDDING_BATCH_MAX_WAIT_MS = float(os.environ.get("EMBEDDING_BATCH_MAX_WAIT_MS", "3"))
+
 
 class BaseEmbedder:
     """Base class for embedders"""
     
+    model_name = "unknown"
+    
     def encode(self, texts: List[str], show_progress_bar: bool = False) -> List[List[float]]:
         raise NotImplementedError
 
@@ -36,13 +86,76 @@ class SentenceTransformerEmbedder(BaseEmbedder):
     
     def __init__(self):
         from sentence_transformers import SentenceTransformer
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        self.model_name = 'all-MiniLM-L6-v2'
+        self.model = SentenceTransformer(self.model_name)
         self.dimensions = 384
     
     def encode(self, texts: List[str], show_progress_bar: bool = False) -> List[List[float]]:
         return self.model.encode(texts, show_progress_bar=show_progress_bar).tolist()
 
 
+class OnnxEmbedder(BaseEmbedder):
+    """
+    all-MiniLM-L6-v2 exported to ONNX with int8 dynamic quantization
+    
+    Runs on onnxruntime with the fast (Rust) tokenizer, so neither torch nor
+    sentence-transformers is imported. Mean pooling and L2 normalization
+    match the sentence-transformers pipeline. Build the model directory with
+    export_onnx_embedder.py.
+    """
+    
+    def __init__(self, model_dir: Path = ONNX_EMBEDDER_DIR):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+        
+        model_path = Path(model_dir) / ONNX_MODEL_FILE
+        tokenizer_path = Path(model_dir) / "tokenizer.json"
+        if not model_path.exists() or not tokenizer_path.exists():
+            raise FileNotFoundError(f"No exported ONNX embedder in {model_dir}")
+        
+        self.tokenizer = Tokenizer.from_file(str(tokenizer_path))
+        self.tokenizer.enable_truncation(max_length=ONNX_MAX_SEQ_LENGTH)
+        self.tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+        
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if ONNX_EMBEDDER_THREADS:
+            options.intra_op_num_threads = ONNX_EMBEDDER_THREADS
+        self.session = ort.InferenceSession(str(model_path), sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        
+        self.model_name = "all-MiniLM-L6-v2-onnx-int8"
+        self.dimensions = 384
+    
+    def encode(self, texts: List[str], show_progress_bar: bool = False) -> List[List[float]]:
+        if not texts:
+            return []
+        
+        # Batch texts of similar length together so little of each batch is padding
+        order = sorted(range(len(texts)), key=lambda idx: len(texts[idx]))
+        embeddings = np.empty((len(texts), self.dimensions), dtype=np.float32)
+        for start in range(0, len(order), ONNX_BATCH_SIZE):
+            batch = order[start:start + ONNX_BATCH_SIZE]
+            encodings = self.tokenizer.encode_batch([texts[idx] for idx in batch])
+            attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+            feeds = {
+                "input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+                "attention_mask": attention_mask
+            }
+            if "token_type_ids" in self.input_names:
+                feeds["token_type_ids"] = np.array([encoding.type_ids for encoding in encodings], dtype=np.int64)
+            
+            token_embeddings = self.session.run(None, feeds)[0]
+            
+            # Mean pooling over real tokens, then L2 normalization
+            mask = attention_mask[..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            embeddings[batch] = pooled
+        
+        return embeddings.tolist()
+
+
 class OpenAIEmbedder(BaseEmbedder):
     """OpenAI Embeddings wrapper (requires valid OpenAI API key)"""
     
@@ -74,6 +187,7 @@ class NoOpEmbedder(BaseEmbedder):
     """Fallback embedder that returns empty - used when no embedding backend is available"""
     
     def __init__(self):
+        self.model_name = "noop"
         self.dimensions = 384
         logger.warning("Using NoOp embedder - RAG will not work but chat will still function")
     
@@ -82,15 +196,735 @@ class NoOpEmbedder(BaseEmbedder):
         return [[0.0] * self.dimensions for _ in texts]
 
 
+class EmbeddingCache:
+    """
+    Thread-safe in-process LRU of embeddings keyed by (model name, text)
+    
+    Evicts the least recently used entry once max_size is reached and counts
+    hits/misses so callers can confirm repeat queries never reach the model.
+    """
+    
+    def __init__(self, max_size: int = EMBEDDING_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[tuple, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, model_name: str, text: str) -> Optional[List[float]]:
+        key = (model_name, text)
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+    
+    def put(self, model_name: str, text: str, embedding: List[float]):
+        key = (model_name, text)
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+class CachedEmbedder(BaseEmbedder):
+    """Wraps any embedder with an EmbeddingCache; only cache misses reach the model"""
+    
+    def __init__(self, embedder: BaseEmbedder, cache: EmbeddingCache):
+        self.embedder = embedder
+        self.cache = cache
+        self.model_name = embedder.model_name
+        self.dimensions = embedder.dimensions
+    
+    def encode(self, texts: List[str], show_progress_bar: bool = False) -> List[List[float]]:
+        embeddings = [self.cache.get(self.model_name, text) for text in texts]
+        missing = [idx for idx, embedding in enumerate(embeddings) if embedding is None]
+        
+        if missing:
+            # Encode all misses in one batch, once per distinct text
+            missing_texts = list(dict.fromkeys(texts[idx] for idx in missing))
+            encoded = self.embedder.encode(missing_texts, show_progress_bar=show_progress_bar)
+            by_text = {}
+            for text, embedding in zip(missing_texts, encoded):
+                embedding = embedding.tolist() if hasattr(embedding, 'tolist') else embedding
+                self.cache.put(self.model_name, text, embedding)
+                by_text[text] = embedding
+            for idx in missing:
+                embeddings[idx] = by_text[texts[idx]]
+        
+        return embeddings
+    
+    async def encode_async(self, texts: List[str]) -> List[List[float]]:
+        """encode() for the event loop: misses go through the wrapped embedder's micro-batcher if it has one"""
+        embeddings = [self.cache.get(self.model_name, text) for text in texts]
+        missing = [idx for idx, embedding in enumerate(embeddings) if embedding is None]
+        
+        if missing:
+            missing_texts = list(dict.fromkeys(texts[idx] for idx in missing))
+            if hasattr(self.embedder, "encode_async"):
+                encoded = await self.embedder.encode_async(missing_texts)
+            else:
+                encoded = await asyncio.to_thread(self.embedder.encode, missing_texts)
+            by_text = {}
+            for text, embedding in zip(missing_texts, encoded):
+                embedding = embedding.tolist() if hasattr(embedding, 'tolist') else embedding
+                self.cache.put(self.model_name, text, embedding)
+                by_text[text] = embedding
+            for idx in missing:
+                embeddings[idx] = by_text[texts[idx]]
+        
+        return embeddings
+    
+    def warm(self, texts: Iterable[str]) -> int:
+        """Pre-compute embeddings for texts; returns how many were newly encoded"""
+        misses_before = self.cache.misses
+        self.encode(list(dict.fromkeys(texts)))
+        return self.cache.misses - misses_before
+
+
+class MicroBatchEmbedder(BaseEmbedder):
+    """
+    Async micro-batching in front of any embedder
+    
+    encode_async() calls arriving within max_wait_ms of each other (up to
+    max_batch_size texts) are encoded in one forward pass on a dedicated
+    thread, and each caller gets its own slice back. While a batch runs, new
+    requests queue up and form the next batch, so batches grow with load.
+    The synchronous encode() bypasses the queue (bulk re-embedding is
+    already batched).
+    """
+    
+    def __init__(
+        self,
+        embedder: BaseEmbedder,
+        max_batch_size: int = EMBEDDING_BATCH_MAX_SIZE,
+        max_wait_ms: float = EMBEDDING_BATCH_MAX_WAIT_MS
+    ):
+        self.embedder = embedder
+        self.model_name = embedder.model_name
+        self.dimensions = embedder.dimensions
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        # One encoding thread: concurrent forward passes would only contend for the same cores
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed-batch")
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop = None
+        self.stats = {"requests": 0, "texts": 0, "batches": 0, "max_batch": 0}
+    
+    def encode(self, texts: List[str], show_progress_bar: bool = False) -> List[List[float]]:
+        return self.embedder.encode(texts, show_progress_bar=show_progress_bar)
+    
+    async def encode_async(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # First call, or a new event loop (scripts calling asyncio.run more than once)
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = None
+        if self._worker is None or self._worker.done():
+            # A worker that stopped leaves the queue in place for its replacement
+            self._worker = loop.create_task(self._run())
+        
+        future = loop.create_future()
+        self.stats["requests"] += 1
+        self._queue.put_nowait((list(texts), future))
+        return await future
+    
+    @staticmethod
+    def _fail(items, error: BaseException):
+        for _, future in items:
+            if not future.done():
+                future.set_exception(error)
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        queue = self._queue
+        carry = None
+        while True:
+            pending = []
+            try:
+                # A request that would have overflowed the previous batch starts this one
+                pending = [carry or await queue.get()]
+                carry = None
+                size = len(pending[0][0])
+                deadline = loop.time() + self.max_wait
+                while size < self.max_batch_size:
+                    try:
+                        item = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        timeout = deadline - loop.time()
+                        if timeout <= 0:
+                            break
+                        try:
+                            item = await asyncio.wait_for(queue.get(), timeout)
+                        except asyncio.TimeoutError:
+                            break
+                    if size + len(item[0]) > self.max_batch_size:
+                        carry = item
+                        break
+                    pending.append(item)
+                    size += len(item[0])
+                
+                texts = [text for item_texts, _ in pending for text in item_texts]
+                embeddings = await loop.run_in_executor(self.executor, self.embedder.encode, texts)
+                if len(embeddings) != len(texts):
+                    raise RuntimeError(f"Embedder returned {len(embeddings)} embeddings for {len(texts)} texts")
+                
+                self.stats["batches"] += 1
+                self.stats["texts"] += len(texts)
+                self.stats["max_batch"] = max(self.stats["max_batch"], len(texts))
+                offset = 0
+                for item_texts, future in pending:
+                    if not future.done():
+                        future.set_result(embeddings[offset:offset + len(item_texts)])
+                    offset += len(item_texts)
+            except asyncio.CancelledError:
+                # close(): nobody will serve what is queued, so fail it rather than leave callers waiting
+                stranded = pending + ([carry] if carry else [])
+                while not queue.empty():
+                    stranded.append(queue.get_nowait())
+                self._fail(stranded, RuntimeError("Embedding batcher closed"))
+                raise
+            except Exception as e:
+                # Only this batch fails; the worker keeps serving the queue
+                logger.error(f"Embedding batch of {len(pending)} requests failed: {str(e)}")
+                self._fail(pending, e)
+    
+    def get_stats(self) -> Dict:
+        batches = self.stats["batches"]
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            **self.stats,
+            "avg_batch": round(self.stats["texts"] / batches, 2) if batches else 0.0
+        }
+    
+    def close(self):
+        if self._worker:
+            self._worker.cancel()
+        self.executor.shutdown(wait=False)
+
+
+# Keys of fetch_user_data's result, each backed by one MongoDB collection
+DATA_SECTIONS = [
+    "user", "account", "transactions", "goals",
+    "holdings", "mutual_funds", "other_investments", "insights"
+]
+
+# chunk_type -> data section it is built from
+CHUNK_TYPE_SECTIONS = {
+    "profile": "user",
+    "account": "account",
+    "transactions_summary": "transactions",
+    "transaction": "transactions",
+    "goal": "goals",
+    "investments_holdings": "holdings",
+    "stock": "holdings",
+    "mutual_funds": "mutual_funds",
+    "mutual_fund": "mutual_funds",
+    "other_investments": "other_investments",
+    "insight": "insights"
+}
+
+
+def chunk_section(chunk_type: Optional[str]) -> Optional[str]:
+    """Data section a chunk_type is built from (investment_<type> chunks are dynamic)"""
+    if not chunk_type:
+        return None
+    if chunk_type.startswith("investment_"):
+        return "other_investments"
+    return CHUNK_TYPE_SECTIONS.get(chunk_type)
+
+
+def chunk_content_hash(text: str) -> str:
+    """Stable hash of a chunk's text, stored in metadata to detect changed chunks"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+class VectorStore:
+    """
+    Per-user vector storage used by the embedder pipeline and RAG search
+    
+    Results use ChromaDB's shapes: query() returns one list per query
+    embedding under "ids", "documents", "metadatas" and "distances"
+    (squared L2, lower is closer), and get() returns "ids" and "metadatas".
+    """
+    
+    backend_name = "unknown"
+    location = ""
+    
+    def query(self, query_embeddings: List[List[float]], n_results: int, user_id: Optional[str] = None) -> Dict:
+        raise NotImplementedError
+    
+    def get(self, user_id: str) -> Dict:
+        raise NotImplementedError
+    
+    def upsert(self, ids: List[str], embeddings: List[List[float]], documents: List[str], metadatas: List[Dict]):
+        raise NotImplementedError
+    
+    def delete(self, user_id: str, ids: List[str]):
+        raise NotImplementedError
+    
+    def delete_user(self, user_id: str) -> int:
+        raise NotImplementedError
+    
+    def count(self) -> int:
+        raise NotImplementedError
+
+
+class ChromaVectorStore(VectorStore):
+    """The global user_financial_data collection, filtered by user_id metadata"""
+    
+    backend_name = "ChromaDB"
+    
+    def __init__(self, path: Path = ROOT_DIR / "chroma_db"):
+        import chromadb
+        from chromadb.config import Settings
+        
+        self.location = str(path)
+        self.client = chromadb.PersistentClient(
+            path=self.location,
+            settings=Settings(anonymized_telemetry=False)
+        )
+        self.collection = self.client.get_or_create_collection(
+            name="user_financial_data",
+            metadata={"description": "User financial data embeddings for Fibby"}
+        )
+    
+    def query(self, query_embeddings: List[List[float]], n_results: int, user_id: Optional[str] = None) -> Dict:
+        return self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            where={"user_id": user_id} if user_id else None
+        )
+    
+    def get(self, user_id: str) -> Dict:
+        return self.collection.get(where={"user_id": user_id}, include=["metadatas"])
+    
+    def upsert(self, ids: List[str], embeddings: List[List[float]], documents: List[str], metadatas: List[Dict]):
+        for i in range(0, len(ids), CHROMA_WRITE_BATCH_SIZE):
+            self.collection.upsert(
+                ids=ids[i:i + CHROMA_WRITE_BATCH_SIZE],
+                embeddings=embeddings[i:i + CHROMA_WRITE_BATCH_SIZE],
+                documents=documents[i:i + CHROMA_WRITE_BATCH_SIZE],
+                metadatas=metadatas[i:i + CHROMA_WRITE_BATCH_SIZE]
+            )
+    
+    def delete(self, user_id: str, ids: List[str]):
+        for i in range(0, len(ids), CHROMA_WRITE_BATCH_SIZE):
+            self.collection.delete(ids=ids[i:i + CHROMA_WRITE_BATCH_SIZE])
+    
+    def delete_user(self, user_id: str) -> int:
+        existing = self.collection.get(where={"user_id": user_id}, include=[])
+        if existing and existing["ids"]:
+            self.delete(user_id, existing["ids"])
+        return len(existing["ids"]) if existing else 0
+    
+    def count(self) -> int:
+        return self.collection.count()
+
+
+def quantize_int8(vectors: np.ndarray):
+    """Per-vector symmetric int8 quantization: (int8 codes, float32 scales)"""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    One contiguous matrix per user, searched by brute force
+    
+    Each user has <hash>.json (ids, documents, metadatas in row order) and
+    the matrix file it names, <hash>.<version>.npy (rows = chunk vectors),
+    under vector_store/<hash[:2]>/. With
+    ~50-150 chunks per user, scoring every row with a single matrix product
+    for all expanded queries beats an ANN index plus a metadata filter.
+    Matrices are opened with mmap, so only the pages touched are resident
+    and recently used users stay in an LRU. A write puts the rows in a new,
+    never-modified matrix file and then atomically replaces the JSON that
+    points to it, so a reader always pairs ids with the matrix written with
+    them; one that loses the race to the old matrix's deletion re-reads.
+    
+    Safe with several uvicorn workers sharing the directory: a cached
+    snapshot is reused only while the user's JSON file still has the same
+    inode, mtime and size (one stat per lookup), so another worker's write is
+    picked up on the next read; and read-modify-write in upsert/delete runs
+    under an exclusive flock on the user's shard, so workers can't overwrite
+    each other's rows.
+    
+    Rows are stored as float32, float16 or per-vector scaled int8
+    (VECTOR_STORE_QUANTIZATION). int8 scores every row with int8 codes, then
+    rescores the best VECTOR_STORE_RESCORE_FACTOR x n_results rows with the
+    full-precision query; squared norms of the original vectors are kept
+    alongside so distances stay on the float32 scale. Files written in
+    another mode are still readable and are converted on their next write.
+    """
+    
+    backend_name = "NumPy"
+    
+    def __init__(
+        self,
+        path: Path = ROOT_DIR / "vector_store",
+        max_cached_users: int = VECTOR_STORE_CACHE_USERS,
+        quantization: str = VECTOR_STORE_QUANTIZATION,
+        rescore_factor: int = VECTOR_STORE_RESCORE_FACTOR
+    ):
+        if quantization not in QUANTIZATION_DTYPES:
+            raise ValueError(f"Unknown VECTOR_STORE_QUANTIZATION '{quantization}', expected one of {sorted(QUANTIZATION_DTYPES)}")
+        self.path = Path(path)
+        self.location = str(self.path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_cached_users = max_cached_users
+        self.quantization = quantization
+        self.rescore_factor = max(1, rescore_factor)
+        # user_id -> snapshot {"matrix", "scales", "sq_norms", "ids", "documents", "metadatas", "stamp"}
+        self._users: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+    
+    # Attempts to read a consistent snapshot while writers replace it
+    LOAD_ATTEMPTS = 3
+    
+    def _user_paths(self, user_id: str):
+        """(directory, file stem) of a user's files"""
+        key = hashlib.sha256(user_id.encode("utf-8")).hexdigest()[:32]
+        return self.path / key[:2], key
+    
+    @staticmethod
+    def _snapshot(matrix: np.ndarray, meta: Dict) -> Dict:
+        scales = np.asarray(meta["scales"], dtype=np.float32) if meta.get("scales") is not None else None
+        if meta.get("sq_norms") is not None:
+            sq_norms = np.asarray(meta["sq_norms"], dtype=np.float32)
+        else:
+            full = matrix.astype(np.float32)
+            sq_norms = np.einsum("ij,ij->i", full, full)
+        rows = len(meta["ids"])
+        if matrix.shape[0] != rows or len(sq_norms) != rows or (scales is not None and len(scales) != rows):
+            raise ValueError(f"Vector store snapshot has {matrix.shape[0]} vectors for {rows} ids")
+        return {
+            "matrix": matrix,
+            "scales": scales,
+            "sq_norms": sq_norms,
+            "ids": meta["ids"],
+            "documents": meta["documents"],
+            "metadatas": meta["metadatas"]
+        }
+    
+    @staticmethod
+    def _dequantize(snapshot: Dict, rows=slice(None)) -> np.ndarray:
+        """float32 copy of (some of) a snapshot's vectors"""
+        vectors = np.asarray(snapshot["matrix"][rows], dtype=np.float32)
+        if snapshot["scales"] is not None:
+            vectors = vectors * snapshot["scales"][rows][..., None]
+        return vectors
+    
+    @staticmethod
+    def _stamp(stat: os.stat_result) -> tuple:
+        """Identity of one version of a JSON file; os.replace gives every write a new inode"""
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+    
+    def _load(self, user_id: str) -> Optional[Dict]:
+        directory, stem = self._user_paths(user_id)
+        meta_path = directory / f"{stem}.json"
+        try:
+            stamp = self._stamp(os.stat(meta_path))
+        except FileNotFoundError:
+            self._cache(user_id, None)
+            return None
+        
+        with self._lock:
+            snapshot = self._users.get(user_id)
+            if snapshot is not None and snapshot["stamp"] == stamp:
+                self._users.move_to_end(user_id)
+                return snapshot
+        
+        # Not cached, or rewritten since (possibly by another worker)
+        for attempt in range(self.LOAD_ATTEMPTS):
+            try:
+                with open(meta_path, encoding="utf-8") as f:
+                    stamp = self._stamp(os.fstat(f.fileno()))
+                    meta = json.load(f)
+            except FileNotFoundError:
+                self._cache(user_id, None)
+                return None
+            # Files written before versioned matrices use <stem>.npy
+            matrix_path = directory / meta.get("matrix", f"{stem}.npy")
+            try:
+                snapshot = self._snapshot(np.load(matrix_path, mmap_mode="r"), meta)
+                snapshot["stamp"] = stamp
+                break
+            except (FileNotFoundError, ValueError):
+                # A writer replaced the snapshot between our two reads
+                if attempt == self.LOAD_ATTEMPTS - 1:
+                    raise
+        self._cache(user_id, snapshot)
+        return snapshot
+    
+    def _cache(self, user_id: str, snapshot: Optional[Dict]):
+        with self._lock:
+            if snapshot is None:
+                self._users.pop(user_id, None)
+                return
+            self._users[user_id] = snapshot
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_cached_users:
+                self._users.popitem(last=False)
+    
+    def _save(self, user_id: str, rows: Dict[str, tuple]):
+        """Persist a user's rows (id -> (vector, document, metadata)) as a new snapshot"""
+        directory, stem = self._user_paths(user_id)
+        meta_path = directory / f"{stem}.json"
+        if not rows:
+            # JSON first: readers then see no user rather than a missing matrix
+            meta_path.unlink(missing_ok=True)
+            self._remove_matrices(directory, stem)
+            self._cache(user_id, None)
+            return
+        
+        ids = list(rows)
+        vectors = np.stack([np.asarray(rows[chunk_id][0], dtype=np.float32) for chunk_id in ids])
+        meta = {
+            "user_id": user_id,
+            "ids": ids,
+            "documents": [rows[chunk_id][1] for chunk_id in ids],
+            "metadatas": [rows[chunk_id][2] for chunk_id in ids],
+            "scales": None,
+            "sq_norms": None
+        }
+        if self.quantization == "int8":
+            matrix, scales = quantize_int8(vectors)
+            meta["scales"] = scales.tolist()
+            meta["sq_norms"] = np.einsum("ij,ij->i", vectors, vectors).tolist()
+        else:
+            matrix = vectors.astype(QUANTIZATION_DTYPES[self.quantization])
+        matrix = np.ascontiguousarray(matrix)
+        
+        version = uuid.uuid4().hex[:12]
+        meta["matrix"] = f"{stem}.{version}.npy"
+        directory.mkdir(parents=True, exist_ok=True)
+        tmp_matrix = directory / f"{stem}.{version}.npy.tmp"
+        tmp_meta = directory / f"{stem}.{version}.json.tmp"
+        with open(tmp_matrix, "wb") as f:
+            np.save(f, matrix)
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        # The new matrix must exist before the JSON that names it; older matrices go after
+        os.replace(tmp_matrix, directory / meta["matrix"])
+        os.replace(tmp_meta, meta_path)
+        self._remove_matrices(directory, stem, keep=meta["matrix"])
+        
+        snapshot = self._snapshot(matrix, meta)
+        snapshot["stamp"] = self._stamp(os.stat(meta_path))
+        self._cache(user_id, snapshot)
+    
+    @staticmethod
+    def _remove_matrices(directory: Path, stem: str, keep: Optional[str] = None):
+        """Delete a user's matrix files other than keep (readers with one mapped are unaffected)"""
+        for matrix_path in [directory / f"{stem}.npy", *directory.glob(f"{stem}.*.npy")]:
+            if matrix_path.name != keep:
+                matrix_path.unlink(missing_ok=True)
+    
+    @contextmanager
+    def _write_locked(self, user_id: str):
+        """Exclusive across threads (_write_lock) and worker processes (flock on the user's shard)"""
+        directory, _ = self._user_paths(user_id)
+        with self._write_lock:
+            if fcntl is None:
+                yield
+                return
+            directory.mkdir(parents=True, exist_ok=True)
+            with open(directory / ".lock", "a") as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    
+    def _rows(self, user_id: str) -> Dict[str, tuple]:
+        snapshot = self._load(user_id)
+        if snapshot is None:
+            return {}
+        vectors = self._dequantize(snapshot)
+        return {
+            chunk_id: (vectors[i], snapshot["documents"][i], snapshot["metadatas"][i])
+            for i, chunk_id in enumerate(snapshot["ids"])
+        }
+    
+    def _all_user_ids(self) -> List[str]:
+        user_ids = []
+        for meta_path in self.path.glob("*/*.json"):
+            try:
+                with open(meta_path, encoding="utf-8") as f:
+                    user_ids.append(json.load(f)["user_id"])
+            except FileNotFoundError:
+                # User deleted since the listing
+                continue
+        return user_ids
+    
+    @staticmethod
+    def _top_k(distances: np.ndarray, k: int) -> np.ndarray:
+        """Column indices of the k smallest distances per row, closest first"""
+        if k < distances.shape[1]:
+            top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(distances.shape[1]), (len(distances), 1))
+        order = np.take_along_axis(distances, top, axis=1).argsort(axis=1)
+        return np.take_along_axis(top, order, axis=1)
+    
+    def _search(self, snapshot: Dict, queries: np.ndarray, n_results: int):
+        """(row indices, squared L2 distances) per query, closest first"""
+        matrix = snapshot["matrix"]
+        query_sq_norms = np.einsum("ij,ij->i", queries, queries)[:, None]
+        k = min(n_results, matrix.shape[0])
+        
+        if snapshot["scales"] is None:
+            # ||q - x||^2 = ||q||^2 + ||x||^2 - 2 q.x, the dot products in one BLAS call
+            scores = queries @ np.asarray(matrix, dtype=np.float32).T
+            distances = query_sq_norms + snapshot["sq_norms"][None, :] - 2 * scores
+            top = self._top_k(distances, k)
+            return top, np.maximum(np.take_along_axis(distances, top, axis=1), 0.0)
+        
+        # int8: coarse scores from int8 codes on both sides (exact in float32 for 384-1536 dims)
+        query_codes, query_scales = quantize_int8(queries)
+        coarse = (query_codes.astype(np.float32) @ np.asarray(matrix, dtype=np.float32).T)
+        coarse *= query_scales[:, None] * snapshot["scales"][None, :]
+        candidates = self._top_k(snapshot["sq_norms"][None, :] - 2 * coarse, min(k * self.rescore_factor, matrix.shape[0]))
+        
+        # Rescore the candidates with the full-precision query
+        candidate_vectors = self._dequantize(snapshot, candidates)
+        scores = np.einsum("qd,qcd->qc", queries, candidate_vectors)
+        distances = query_sq_norms + snapshot["sq_norms"][candidates] - 2 * scores
+        order = self._top_k(distances, k)
+        return np.take_along_axis(candidates, order, axis=1), np.maximum(np.take_along_axis(distances, order, axis=1), 0.0)
+    
+    def query(self, query_embeddings: List[List[float]], n_results: int, user_id: Optional[str] = None) -> Dict:
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        
+        if user_id is not None:
+            snapshots = [self._load(user_id)]
+        else:
+            # No user filter (admin search): scan every user, not the fast path
+            snapshots = [self._load(uid) for uid in self._all_user_ids()]
+        snapshots = [snapshot for snapshot in snapshots if snapshot is not None and snapshot["ids"]]
+        
+        per_query = [[] for _ in range(len(queries))]
+        for snapshot in snapshots:
+            top, distances = self._search(snapshot, queries, n_results)
+            for q in range(len(queries)):
+                for idx, distance in zip(top[q], distances[q]):
+                    per_query[q].append((float(distance), snapshot, int(idx)))
+        
+        for matches in per_query:
+            matches = sorted(matches, key=lambda match: match[0])[:n_results]
+            results["ids"].append([snapshot["ids"][i] for _, snapshot, i in matches])
+            results["documents"].append([snapshot["documents"][i] for _, snapshot, i in matches])
+            results["metadatas"].append([snapshot["metadatas"][i] for _, snapshot, i in matches])
+            results["distances"].append([distance for distance, _, _ in matches])
+        return results
+    
+    def get(self, user_id: str) -> Dict:
+        snapshot = self._load(user_id)
+        if snapshot is None:
+            return {"ids": [], "metadatas": []}
+        return {"ids": list(snapshot["ids"]), "metadatas": list(snapshot["metadatas"])}
+    
+    def upsert(self, ids: List[str], embeddings: List[List[float]], documents: List[str], metadatas: List[Dict]):
+        by_user: Dict[str, List[int]] = {}
+        for i, metadata in enumerate(metadatas):
+            by_user.setdefault(metadata["user_id"], []).append(i)
+        
+        for user_id, positions in by_user.items():
+            with self._write_locked(user_id):
+                rows = self._rows(user_id)
+                for i in positions:
+                    rows[ids[i]] = (embeddings[i], documents[i], metadatas[i])
+                self._save(user_id, rows)
+    
+    def delete(self, user_id: str, ids: List[str]):
+        with self._write_locked(user_id):
+            rows = self._rows(user_id)
+            for chunk_id in ids:
+                rows.pop(chunk_id, None)
+            self._save(user_id, rows)
+    
+    def delete_user(self, user_id: str) -> int:
+        with self._write_locked(user_id):
+            removed = len(self._rows(user_id))
+            self._save(user_id, {})
+        return removed
+    
+    def count(self) -> int:
+        total = 0
+        for matrix_path in self.path.glob("*/*.npy"):
+            try:
+                total += np.load(matrix_path, mmap_mode="r").shape[0]
+            except FileNotFoundError:
+                # Superseded by a write since the listing
+                continue
+        return total
+
+
+VECTOR_STORE_BACKENDS = {
+    "chroma": ChromaVectorStore,
+    "numpy": NumpyVectorStore
+}
+
+
+def get_vector_store(backend: str = VECTOR_STORE_BACKEND) -> VectorStore:
+    """Vector store for VECTOR_STORE_BACKEND (chroma or numpy)"""
+    if backend not in VECTOR_STORE_BACKENDS:
+        raise ValueError(f"Unknown VECTOR_STORE_BACKEND '{backend}', expected one of {sorted(VECTOR_STORE_BACKENDS)}")
+    if backend == "chroma" and VECTOR_STORE_QUANTIZATION != "none":
+        logger.warning("VECTOR_STORE_QUANTIZATION only applies to the numpy vector store; ChromaDB stores float32")
+    store = VECTOR_STORE_BACKENDS[backend]()
+    logger.info(f"Using {store.backend_name} vector store at {store.location}")
+    return store
+
+
 def get_embedder() -> BaseEmbedder:
     """
     Get the best available embedder with fallback chain:
-    1. Try sentence-transformers (best for local/deployment)
-    2. Try OpenAI embeddings (if valid API key)
-    3. Fall back to NoOp (RAG disabled but app still works)
+    1. Try the ONNX int8 model (if exported; fastest startup and inference on CPU)
+    2. Try sentence-transformers (best for local/deployment)
+    3. Try OpenAI embeddings (if valid API key)
+    4. Fall back to NoOp (RAG disabled but app still works)
     """
     
-    # Option 1: Try sentence-transformers (preferred for deployment)
+    # Option 1: Try the exported ONNX model
+    try:
+        embedder = OnnxEmbedder()
+        logger.info(f"Using ONNX int8 embedder ({ONNX_EMBEDDER_DIR})")
+        return embedder
+    except (ImportError, FileNotFoundError) as e:
+        logger.info(f"ONNX embedder not available ({e}), trying alternatives...")
+    except Exception as e:
+        logger.warning(f"Failed to initialize ONNX embedder: {e}")
+    
+    # Option 2: Try sentence-transformers
     try:
         embedder = SentenceTransformerEmbedder()
         logger.info("Using sentence-transformers embedder (all-MiniLM-L6-v2)")
@@ -100,7 +934,7 @@ def get_embedder() -> BaseEmbedder:
     except Exception as e:
         logger.warning(f"Failed to initialize sentence-transformers: {e}")
     
-    # Option 2: Try OpenAI embeddings with standard API key
+    # Option 3: Try OpenAI embeddings with standard API key
     openai_key = os.environ.get("OPENAI_API_KEY")
     if openai_key and not openai_key.startswith("sk-emergent"):
         try:
@@ -112,34 +946,34 @@ def get_embedder() -> BaseEmbedder:
         except Exception as e:
             logger.warning(f"Failed to initialize OpenAI embedder: {e}")
     
-    # Option 3: Fall back to NoOp
+    # Option 4: Fall back to NoOp
     logger.warning("No embedding backend available - using NoOp embedder")
     return NoOpEmbedder()
 
 
 class EmbedderAgent:
-    """Agent that embeds user financial data into vector database"""
+    """
+    Agent that embeds user financial data into vector database
     
-    def __init__(self):
-        # Initialize ChromaDB client (persistent storage)
-        self.chroma_client = chromadb.PersistentClient(
-            path=str(ROOT_DIR / "chroma_db"),
-            settings=Settings(anonymized_telemetry=False)
-        )
-        
-        # Create or get collection
-        self.collection = self.chroma_client.get_or_create_collection(
-            name="user_financial_data",
-            metadata={"description": "User financial data embeddings for Fibby"}
-        )
-        
-        # Initialize embedding model with fallback chain
-        logger.info("Initializing embedding model...")
-        self.model = get_embedder()
-        logger.info(f"Embedding model initialized: {type(self.model).__name__}")
+    Construction is cheap: the embedding model and vector store load on first
+    use (or through load()/ensure_loaded() from a warm-up task), so importing
+    and starting the API doesn't wait on torch/onnxruntime or ChromaDB.
+    With EMBEDDING_SIDECAR_URL set, both are clients of the shared embedding
+    sidecar (see embedding_sidecar.py) instead of local instances.
+    """
+    
+    def __init__(self, use_sidecar: Optional[bool] = None):
+        self.use_sidecar = bool(os.environ.get("EMBEDDING_SIDECAR_URL")) if use_sidecar is None else use_sidecar
         
-        # Track if RAG is functional
-        self.rag_enabled = not isinstance(self.model, NoOpEmbedder)
+        # Model and vector store, created by load()
+        self._store: Optional[VectorStore] = None
+        self._model: Optional[BaseEmbedder] = None
+        self._query_model: Optional[CachedEmbedder] = None
+        self._rag_enabled = False
+        self._loaded = False
+        self._load_lock = threading.Lock()
+        self._load_future: Optional[asyncio.Future] = None
+        self.load_state = {"status": "cold", "embedder": None, "vector_store": None, "load_seconds": None, "error": None}
         
         # MongoDB connection
         mongo_url = os.environ['MONGO_URL']
@@ -149,54 +983,160 @@ class EmbedderAgent:
         # Transaction ID tracking (user_id -> transaction_id)
         self.user_transactions: Dict[str, str] = {}
     
+    def load(self):
+        """Blocking: create the vector store and embedding model once; concurrent callers wait"""
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
+            self.load_state.update(status="loading", error=None)
+            started = time.perf_counter()
+            try:
+                if self.use_sidecar:
+                    from embedding_sidecar import SidecarClient, RemoteEmbedder, RemoteQueryEmbedder, RemoteVectorStore
+                    client = SidecarClient()
+                    model = RemoteEmbedder(client)
+                    store = RemoteVectorStore(client, model.store_backend)
+                    query_model = RemoteQueryEmbedder(model)
+                    rag_enabled = model.rag_enabled
+                    logger.info(f"Using embedding sidecar at {client.url} ({model.model_name}, {store.backend_name})")
+                else:
+                    # Vector storage (persistent)
+                    store = get_vector_store()
+                    
+                    # Initialize embedding model with fallback chain
+                    logger.info("Initializing embedding model...")
+                    model = get_embedder()
+                    logger.info(f"Embedding model initialized: {type(model).__name__}")
+                    query_model = model
+                    # Track if RAG is functional
+                    rag_enabled = not isinstance(model, NoOpEmbedder)
+            except Exception as e:
+                self.load_state.update(status="failed", error=str(e))
+                raise
+            
+            self._store = store
+            self._model = model
+            self._rag_enabled = rag_enabled
+            # Query-side embedder: LRU cache, then micro-batching of misses (document chunks bypass both)
+            self._query_model = CachedEmbedder(MicroBatchEmbedder(query_model), EmbeddingCache(EMBEDDING_CACHE_SIZE))
+            self._loaded = True
+            self.load_state.update(
+                status="ready",
+                embedder=model.model_name,
+                vector_store=store.backend_name,
+                load_seconds=round(time.perf_counter() - started, 3)
+            )
+    
+    async def ensure_loaded(self):
+        """load() on a worker thread, shared by every caller waiting on it"""
+        if self._loaded:
+            return
+        if self._load_future is None:
+            self._load_future = asyncio.ensure_future(asyncio.to_thread(self.load))
+        future = self._load_future
+        try:
+            await asyncio.shield(future)
+        finally:
+            # A failed load is retried by the next caller
+            if future.done() and (future.cancelled() or future.exception() is not None) and self._load_future is future:
+                self._load_future = None
+    
+    def is_loaded(self) -> bool:
+        """Whether the model and vector store are loaded (never triggers loading)"""
+        return self._loaded
+    
+    @property
+    def store(self) -> VectorStore:
+        self.load()
+        return self._store
+    
+    @property
+    def model(self) -> BaseEmbedder:
+        self.load()
+        return self._model
+    
+    @property
+    def query_model(self) -> CachedEmbedder:
+        self.load()
+        return self._query_model
+    
+    @property
+    def rag_enabled(self) -> bool:
+        self.load()
+        return self._rag_enabled
+    
     def is_rag_enabled(self) -> bool:
         """Check if RAG functionality is available"""
         return self.rag_enabled
     
-    async def fetch_user_data(self, user_id: str) -> Dict:
-        """Fetch all relevant data for a user from MongoDB"""
+    def warm_query_cache(self, phrases: Iterable[str]) -> int:
+        """Pre-embed known query phrases so chat requests hit the cache"""
+        if not self.rag_enabled:
+            return 0
+        encoded = self.query_model.warm(phrases)
+        logger.info(f"Pre-warmed query embedding cache with {encoded} phrases")
+        return encoded
+    
+    def get_query_cache_stats(self) -> Dict:
+        """Hit/miss counters for the query embedding cache"""
+        return {"model": self.query_model.model_name, **self.query_model.cache.stats()}
+    
+    def get_batching_stats(self) -> Dict:
+        """Micro-batcher counters for query encodes"""
+        return self.query_model.embedder.get_stats()
+    
+    async def fetch_user_data(self, user_id: str, sections: Optional[Iterable[str]] = None) -> Dict:
+        """
+        Fetch all relevant data for a user from MongoDB
+        
+        sections limits the fetch to those keys of the returned dict (see
+        DATA_SECTIONS); None fetches everything.
+        """
+        wanted = set(sections) if sections is not None else set(DATA_SECTIONS)
+        data = {}
         try:
             # Fetch user profile
-            user = await self.db.users.find_one({"_id": ObjectId(user_id)})
+            if "user" in wanted:
+                data["user"] = await self.db.users.find_one({"_id": ObjectId(user_id)})
             
             # Fetch transactions (last 100)
-            transactions = await self.db.transactions.find(
-                {"user_id": user_id}
-            ).sort("date", -1).limit(100).to_list(100)
+            if "transactions" in wanted:
+                data["transactions"] = await self.db.transactions.find(
+                    {"user_id": user_id}
+                ).sort("date", -1).limit(100).to_list(100)
             
             # Fetch goals
-            goals = await self.db.goals.find({"user_id": user_id}).to_list(100)
+            if "goals" in wanted:
+                data["goals"] = await self.db.goals.find({"user_id": user_id}).to_list(100)
             
             # Fetch investments - use correct collection names
-            holdings = await self.db.stock_holdings.find(
-                {"user_id": user_id}
-            ).to_list(100)
+            if "holdings" in wanted:
+                data["holdings"] = await self.db.stock_holdings.find(
+                    {"user_id": user_id}
+                ).to_list(100)
             
-            mutual_funds = await self.db.mutual_funds.find(
-                {"user_id": user_id}
-            ).to_list(100)
+            if "mutual_funds" in wanted:
+                data["mutual_funds"] = await self.db.mutual_funds.find(
+                    {"user_id": user_id}
+                ).to_list(100)
             
-            other_investments = await self.db.other_investments.find(
-                {"user_id": user_id}
-            ).to_list(100)
+            if "other_investments" in wanted:
+                data["other_investments"] = await self.db.other_investments.find(
+                    {"user_id": user_id}
+                ).to_list(100)
             
             # Fetch bank account
-            account = await self.db.bank_accounts.find_one({"user_id": user_id})
+            if "account" in wanted:
+                data["account"] = await self.db.bank_accounts.find_one({"user_id": user_id})
             
             # Fetch insights
-            insights = await self.db.insights.find({"user_id": user_id}).to_list(100)
+            if "insights" in wanted:
+                data["insights"] = await self.db.insights.find({"user_id": user_id}).to_list(100)
             
-            return {
-                "user": user,
-                "transactions": transactions,
-                "goals": goals,
-                "holdings": holdings,
-                "mutual_funds": mutual_funds,
-                "other_investments": other_investments,
-                "account": account,
-                "insights": insights,
-                "fetched_at": datetime.utcnow().isoformat()
-            }
+            data["fetched_at"] = datetime.utcnow().isoformat()
+            return data
         
         except Exception as e:
             logger.error(f"Error fetching user data: {str(e)}")
@@ -251,10 +1191,11 @@ class EmbedderAgent:
                 }
             })
             
-            # Individual transaction chunks (top 30)
+            # Individual transaction chunks (top 30), keyed by transaction so
+            # a new transaction doesn't shift (and re-embed) all the others
             for idx, txn in enumerate(transactions[:30]):
                 chunks.append({
-                    "id": f"{user_id}_txn_{idx}",
+                    "id": f"{user_id}_txn_{txn.get('_id', idx)}",
                     "text": f"Transaction: {txn.get('description', 'Payment')} - ₹{txn.get('amount', 0):,.2f} ({txn.get('transaction_type', 'expense')}) in {txn.get('category', 'Unknown')} category at {txn.get('merchant', 'Unknown')}",
                     "metadata": {
                         "user_id": user_id,
@@ -376,7 +1317,7 @@ class EmbedderAgent:
         if data.get("insights"):
             for idx, insight in enumerate(data["insights"]):
                 chunks.append({
-                    "id": f"{user_id}_insight_{idx}",
+                    "id": f"{user_id}_insight_{insight.get('_id', idx)}",
                     "text": f"Financial insight ({insight.get('type')}): {insight.get('message')}",
                     "metadata": {
                         "user_id": user_id,
@@ -387,11 +1328,22 @@ class EmbedderAgent:
         
         return chunks
     
-    async def update_user_embeddings(self, user_id: str) -> Optional[str]:
+    async def update_user_embeddings(
+        self,
+        user_id: str,
+        sections: Optional[Iterable[str]] = None
+    ) -> Optional[str]:
         """
         Fetch user data, create embeddings, and update vector DB
+        
+        Incremental: each chunk's text hash is compared with the content_hash
+        stored in its metadata, so only new or changed chunks are encoded and
+        upserted and only chunks that no longer exist are deleted. Passing
+        sections (see DATA_SECTIONS) refreshes only the chunks built from them.
+        
         Returns transaction_id for this update, or None if RAG is disabled
         """
+        await self.ensure_loaded()
         if not self.rag_enabled:
             logger.info(f"RAG disabled - skipping embedding update for user {user_id}")
             return None
@@ -399,83 +1351,279 @@ class EmbedderAgent:
         try:
             logger.info(f"Updating embeddings for user: {user_id}")
             
-            # Fetch user data
-            user_data = await self.fetch_user_data(user_id)
-            if not user_data:
-                logger.error(f"Failed to fetch data for user: {user_id}")
+            update = await self.prepare_user_update(user_id, sections)
+            if not update:
                 return None
             
-            # Create chunks
-            chunks = self.create_embedding_chunks(user_id, user_data)
-            logger.info(f"Created {len(chunks)} chunks for user {user_id}")
+            await asyncio.to_thread(self.apply_user_updates, [update])
             
-            if not chunks:
-                logger.warning(f"No chunks created for user {user_id}")
-                return None
+            logger.info(
+                f"Embeddings for user {user_id}: {len(update['changed'])} upserted, "
+                f"{len(update['stale_ids'])} deleted, {update['unchanged']} unchanged "
+                f"(transaction_id: {update['transaction_id']})"
+            )
             
+            return update["transaction_id"]
+        
+        except Exception as e:
+            logger.error(f"Error updating embeddings for user {user_id}: {str(e)}")
+            return None
+    
+    async def prepare_user_update(
+        self,
+        user_id: str,
+        sections: Optional[Iterable[str]] = None
+    ) -> Optional[Dict]:
+        """
+        Fetch a user's data, build chunks and diff them against the vector DB
+        
+        Returns {"user_id", "transaction_id", "changed", "stale_ids", "unchanged"}
+        without touching the encoder, or None if there is nothing to embed.
+        """
+        sections = set(sections) if sections is not None else None
+        
+        # Fetch user data
+        user_data = await self.fetch_user_data(user_id, sections)
+        if not user_data:
+            logger.error(f"Failed to fetch data for user: {user_id}")
+            return None
+        
+        # Create chunks
+        chunks = self.create_embedding_chunks(user_id, user_data)
+        logger.debug(f"Created {len(chunks)} chunks for user {user_id}")
+        
+        # A partial refresh with no chunks left still has to delete stale ones
+        if not chunks and sections is None:
+            logger.warning(f"No chunks created for user {user_id}")
+            return None
+        
+        changed, stale_ids = await asyncio.to_thread(self.diff_chunks, user_id, chunks, sections)
+        
+        return {
+            "user_id": user_id,
             # Generate transaction ID (timestamp-based)
-            transaction_id = f"txn_{user_id}_{int(datetime.utcnow().timestamp())}"
-            
-            # Delete existing embeddings for this user
-            try:
-                existing = self.collection.get(where={"user_id": user_id})
-                if existing and existing["ids"]:
-                    self.collection.delete(ids=existing["ids"])
-                    logger.info(f"Deleted {len(existing['ids'])} existing embeddings for user {user_id}")
-            except Exception as e:
-                logger.warning(f"No existing embeddings to delete: {str(e)}")
-            
-            # Prepare data for ChromaDB
-            ids = [chunk["id"] for chunk in chunks]
-            texts = [chunk["text"] for chunk in chunks]
-            metadatas = [
-                {**chunk["metadata"], "transaction_id": transaction_id}
-                for chunk in chunks
-            ]
-            
-            # Generate embeddings
-            logger.info(f"Generating embeddings for {len(texts)} chunks...")
+            "transaction_id": f"txn_{user_id}_{int(datetime.utcnow().timestamp())}",
+            "changed": changed,
+            "stale_ids": stale_ids,
+            "unchanged": len(chunks) - len(changed)
+        }
+    
+    def apply_user_updates(self, updates: List[Dict]) -> Dict:
+        """
+        Write prepared updates for one or many users to the vector DB
+        
+        All changed chunk texts are encoded in a single encode() call, then
+        stale ids are deleted and new vectors upserted in bulk batches.
+        Blocking; call through asyncio.to_thread from async code.
+        """
+        stale_ids = [chunk_id for update in updates for chunk_id in update["stale_ids"]]
+        changed = [
+            (chunk, update["transaction_id"])
+            for update in updates
+            for chunk in update["changed"]
+        ]
+        
+        # Delete embeddings whose chunk no longer exists
+        for update in updates:
+            if update["stale_ids"]:
+                self.store.delete(update["user_id"], update["stale_ids"])
+        
+        if changed:
+            # Generate embeddings for new/changed chunks only
+            texts = [chunk["text"] for chunk, _ in changed]
             embeddings = self.model.encode(texts, show_progress_bar=False)
             
-            # Add to ChromaDB
-            self.collection.add(
-                ids=ids,
+            self.store.upsert(
+                ids=[chunk["id"] for chunk, _ in changed],
                 embeddings=embeddings,
                 documents=texts,
-                metadatas=metadatas
+                metadatas=[
+                    {**chunk["metadata"], "transaction_id": transaction_id}
+                    for chunk, transaction_id in changed
+                ]
             )
-            
-            logger.info(f"Successfully added {len(chunks)} embeddings for user {user_id} with transaction_id: {transaction_id}")
-            
-            # Track transaction ID
-            self.user_transactions[user_id] = transaction_id
-            
-            return transaction_id
         
+        # Track transaction IDs
+        for update in updates:
+            self.user_transactions[update["user_id"]] = update["transaction_id"]
+        
+        return {"encoded": len(changed), "deleted": len(stale_ids)}
+    
+    def diff_chunks(self, user_id: str, chunks: List[Dict], sections: Optional[set] = None):
+        """
+        Compare fresh chunks against the user's stored vectors
+        
+        Stamps each chunk's metadata with its content_hash and returns
+        (chunks that are new or whose text changed, ids of stored chunks that
+        are no longer produced). Only metadata is read back, never embeddings.
+        With sections, stored chunks from other sections are left alone.
+        """
+        stored_hashes = {}
+        try:
+            existing = self.store.get(user_id)
+            if existing and existing["ids"]:
+                for chunk_id, metadata in zip(existing["ids"], existing["metadatas"]):
+                    metadata = metadata or {}
+                    if sections is not None and chunk_section(metadata.get("chunk_type")) not in sections:
+                        continue
+                    stored_hashes[chunk_id] = metadata.get("content_hash")
         except Exception as e:
-            logger.error(f"Error updating embeddings for user {user_id}: {str(e)}")
-            return None
+            logger.warning(f"No existing embeddings found for user {user_id}: {str(e)}")
+        
+        changed = []
+        for chunk in chunks:
+            content_hash = chunk_content_hash(chunk["text"])
+            chunk["metadata"]["content_hash"] = content_hash
+            if stored_hashes.get(chunk["id"]) != content_hash:
+                changed.append(chunk)
+        
+        current_ids = {chunk["id"] for chunk in chunks}
+        stale_ids = [chunk_id for chunk_id in stored_hashes if chunk_id not in current_ids]
+        
+        return changed, stale_ids
     
-    async def update_all_users(self):
-        """Update embeddings for all users in the database"""
+    async def update_all_users(
+        self,
+        fetch_concurrency: int = BULK_FETCH_CONCURRENCY,
+        encode_batch_size: int = BULK_ENCODE_BATCH_SIZE,
+        progress_every: int = 100
+    ) -> Dict:
+        """
+        Update embeddings for all users in the database
+        
+        Pipelined bulk mode: users are streamed from a cursor (no cap), up to
+        fetch_concurrency users are fetched and diffed at once, and their
+        changed chunks are pooled into a shared queue that is encoded and
+        upserted in batches of ~encode_batch_size texts across users.
+        
+        Returns progress/throughput metrics for the run.
+        """
+        metrics = {
+            "users_total": 0,
+            "users_updated": 0,
+            "users_skipped": 0,
+            "users_failed": 0,
+            "chunks_encoded": 0,
+            "chunks_deleted": 0,
+            "chunks_unchanged": 0,
+            "encode_batches": 0,
+            "elapsed_seconds": 0.0,
+            "users_per_second": 0.0,
+            "chunks_per_second": 0.0
+        }
+        
+        await self.ensure_loaded()
         if not self.rag_enabled:
             logger.info("RAG disabled - skipping embedding updates for all users")
-            return
+            return metrics
         
-        try:
-            # Get all users
-            users = await self.db.users.find().to_list(1000)
-            logger.info(f"Found {len(users)} users to process")
-            
-            for user in users:
-                user_id = str(user["_id"])
-                await self.update_user_embeddings(user_id)
-                await asyncio.sleep(0.5)  # Rate limiting
+        started = time.perf_counter()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=fetch_concurrency * 2)
+        fetch_slots = asyncio.Semaphore(fetch_concurrency)
+        
+        def log_progress():
+            elapsed = time.perf_counter() - started
+            done = metrics["users_updated"] + metrics["users_skipped"] + metrics["users_failed"]
+            logger.info(
+                f"Bulk embedding progress: {done}/{metrics['users_total']} users, "
+                f"{metrics['chunks_encoded']} chunks encoded, {done / elapsed if elapsed else 0:.1f} users/s"
+            )
+        
+        async def prepare(user_id: str):
+            try:
+                update = await self.prepare_user_update(user_id)
+                if update:
+                    await queue.put(update)
+                else:
+                    metrics["users_skipped"] += 1
+            except Exception as e:
+                logger.error(f"Error preparing embeddings for user {user_id}: {str(e)}")
+                metrics["users_failed"] += 1
+            finally:
+                fetch_slots.release()
+        
+        async def produce():
+            tasks = set()
+            try:
+                async for user in self.db.users.find({}, {"_id": 1}):
+                    await fetch_slots.acquire()
+                    metrics["users_total"] += 1
+                    task = asyncio.create_task(prepare(str(user["_id"])))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                if tasks:
+                    await asyncio.gather(*tasks)
+            finally:
+                await queue.put(None)
+        
+        async def flush(pending: List[Dict]):
+            try:
+                result = await asyncio.to_thread(self.apply_user_updates, pending)
+                metrics["users_updated"] += len(pending)
+                metrics["chunks_encoded"] += result["encoded"]
+                metrics["chunks_deleted"] += result["deleted"]
+                metrics["chunks_unchanged"] += sum(update["unchanged"] for update in pending)
+                metrics["encode_batches"] += 1
+            except Exception as e:
+                logger.error(f"Error writing embeddings for {len(pending)} users: {str(e)}")
+                metrics["users_failed"] += len(pending)
             
-            logger.info("Completed embedding updates for all users")
+            done = metrics["users_updated"] + metrics["users_failed"]
+            if progress_every and done // progress_every != (done - len(pending)) // progress_every:
+                log_progress()
         
+        async def consume():
+            pending = []
+            pending_texts = 0
+            while True:
+                update = await queue.get()
+                if update is None:
+                    break
+                pending.append(update)
+                pending_texts += len(update["changed"])
+                if pending_texts >= encode_batch_size:
+                    await flush(pending)
+                    pending = []
+                    pending_texts = 0
+            if pending:
+                await flush(pending)
+        
+        try:
+            await asyncio.gather(produce(), consume())
         except Exception as e:
             logger.error(f"Error updating all users: {str(e)}")
+        
+        elapsed = time.perf_counter() - started
+        metrics["elapsed_seconds"] = round(elapsed, 3)
+        if elapsed:
+            metrics["users_per_second"] = round(metrics["users_total"] / elapsed, 2)
+            metrics["chunks_per_second"] = round(metrics["chunks_encoded"] / elapsed, 2)
+        
+        logger.info(f"Completed embedding updates for all users: {metrics}")
+        return metrics
+    
+    def user_data_fingerprint(self, user_id: str) -> str:
+        """
+        Hash of every stored chunk id and content_hash for a user
+        
+        Changes whenever the data RAG can retrieve for the user changes, without
+        reading any embeddings.
+        """
+        existing = self.store.get(user_id)
+        pairs = sorted(
+            (chunk_id, (metadata or {}).get("content_hash") or "")
+            for chunk_id, metadata in zip(existing["ids"], existing["metadatas"])
+        ) if existing and existing["ids"] else []
+        digest = hashlib.sha256()
+        for chunk_id, content_hash in pairs:
+            digest.update(f"{chunk_id}:{content_hash}\n".encode("utf-8"))
+        return digest.hexdigest()[:32]
+    
+    def clear_user_data(self, user_id: str) -> int:
+        """Delete every stored embedding for a user; returns how many were removed"""
+        removed = self.store.delete_user(user_id)
+        self.user_transactions.pop(user_id, None)
+        return removed
     
     def get_user_transactions(self) -> Dict[str, str]:
         """Get mapping of user_id -> transaction_id"""
@@ -489,8 +1637,8 @@ class EmbedderAgent:
         print(f"RAG Enabled: {self.rag_enabled}")
         print(f"Embedder: {type(self.model).__name__}")
         print(f"Total Users: {len(self.user_transactions)}")
-        print(f"Vector DB Location: {ROOT_DIR / 'chroma_db'}")
-        print(f"Total Documents in DB: {self.collection.count()}")
+        print(f"Vector DB: {self.store.backend_name} at {self.store.location}")
+        print(f"Total Documents in DB: {self.store.count()}")
         print("="*80)
         print(f"{'User ID':<30} {'Transaction ID':<50}")
         print("-"*80)
@@ -504,19 +1652,39 @@ class EmbedderAgent:
     async def close(self):
         """Cleanup resources"""
         self.mongo_client.close()
+        if self._loaded:
+            self._query_model.embedder.close()
+            if self.use_sidecar:
+                self._model.client.close()
 
 
 # Main execution
 async def main():
     """Main function to run the embedder agent"""
+    parser = argparse.ArgumentParser(description="Re-embed every user's financial data into the vector store")
+    parser.add_argument("--concurrency", type=int, default=BULK_FETCH_CONCURRENCY,
+                        help="users fetched from MongoDB concurrently")
+    parser.add_argument("--batch-size", type=int, default=BULK_ENCODE_BATCH_SIZE,
+                        help="chunk texts per encoder batch (across users)")
+    args = parser.parse_args()
+    
     agent = EmbedderAgent()
     
     try:
         # Update embeddings for all users
-        await agent.update_all_users()
+        metrics = await agent.update_all_users(
+            fetch_concurrency=args.concurrency,
+            encode_batch_size=args.batch_size
+        )
         
         # Print transaction report
         agent.print_transaction_report()
+        
+        print("BULK UPDATE METRICS")
+        print("-"*80)
+        for key, value in metrics.items():
+            print(f"{key:<30} {value}")
+        print("="*80)
     
     finally:
         await agent.close()
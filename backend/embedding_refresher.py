@@ -0,0 +1,177 @@
+"""
+Embedding Refresher
+Keeps the RAG vectors fresh by re-embedding users as their MongoDB data changes
+
+Listens to MongoDB change streams when the deployment supports them (replica
+set / Atlas) and otherwise falls back to an in-process queue fed by write hooks
+in server.py. Changes are debounced per user, and only the chunk sections
+touched by the changed collections are re-embedded.
+"""
+import os
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable, Optional, Set
+
+from embedder_service import EmbedderAgent
+
+logger = logging.getLogger(__name__)
+
+# Quiet period after the last write before a user's embeddings are refreshed
+EMBEDDING_REFRESH_DEBOUNCE_SECONDS = float(os.environ.get("EMBEDDING_REFRESH_DEBOUNCE_SECONDS", "2.0"))
+# Upper bound on how long a constantly-written user can be postponed
+EMBEDDING_REFRESH_MAX_DELAY_SECONDS = float(os.environ.get("EMBEDDING_REFRESH_MAX_DELAY_SECONDS", "30.0"))
+
+# MongoDB collection -> data section (see embedder_service.DATA_SECTIONS)
+COLLECTION_SECTIONS = {
+    "users": "user",
+    "bank_accounts": "account",
+    "transactions": "transactions",
+    "goals": "goals",
+    "stock_holdings": "holdings",
+    "investment_holdings": "holdings",
+    "mutual_funds": "mutual_funds",
+    "other_investments": "other_investments",
+    "insights": "insights"
+}
+
+
+class EmbeddingRefresher:
+    """Debounced, per-user incremental re-embedding driven by data changes"""
+
+    def __init__(
+        self,
+        embedder_agent: EmbedderAgent,
+        debounce_seconds: float = EMBEDDING_REFRESH_DEBOUNCE_SECONDS,
+        max_delay_seconds: float = EMBEDDING_REFRESH_MAX_DELAY_SECONDS
+    ):
+        self.embedder = embedder_agent
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+
+        # "change_stream" or "hooks" once started
+        self.mode: Optional[str] = None
+
+        # user_id -> sections waiting to be refreshed
+        self.pending: Dict[str, Set[str]] = {}
+        self._first_change: Dict[str, float] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._tasks = []
+        self._stream = None
+
+        self.stats = {"changes_seen": 0, "refreshes": 0, "refresh_failures": 0}
+
+    async def start(self):
+        """Open a change stream if supported and start the refresh worker"""
+        self._tasks.append(asyncio.create_task(self._refresh_worker()))
+
+        pipeline = [{"$match": {
+            "ns.coll": {"$in": list(COLLECTION_SECTIONS)},
+            "operationType": {"$in": ["insert", "update", "replace", "delete"]}
+        }}]
+        try:
+            self._stream = self.embedder.db.watch(pipeline, full_document="updateLookup")
+            # Forces the server round-trip, so unsupported deployments fail here
+            first_change = await self._stream.try_next()
+        except Exception as e:
+            # Standalone mongod has no change streams
+            logger.info(f"Change streams unavailable ({e}); refreshing embeddings from write hooks")
+            self._stream = None
+            self.mode = "hooks"
+            return
+
+        self.mode = "change_stream"
+        logger.info("Refreshing embeddings from MongoDB change stream")
+        if first_change:
+            self._handle_change(first_change)
+        self._tasks.append(asyncio.create_task(self._watch_changes()))
+
+    async def stop(self):
+        """Stop watching and cancel pending refreshes"""
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        for task in self._tasks:
+            task.cancel()
+        if self._stream is not None:
+            await self._stream.close()
+
+    def notify_write(self, user_id: Optional[str], collections: Iterable[str]):
+        """
+        Write hook called by API routes after they modify user data
+
+        With a change stream active the same write also arrives as an event;
+        both land in one debounce window and collapse into a single refresh.
+        Hooks still matter there for deletes, which change events can't
+        attribute to a user.
+        """
+        self.mark_changed(user_id, collections)
+
+    def mark_changed(self, user_id: Optional[str], collections: Iterable[str]):
+        """Record that collections changed for a user and (re)start its debounce timer"""
+        if not user_id:
+            return
+        sections = {COLLECTION_SECTIONS[c] for c in collections if c in COLLECTION_SECTIONS}
+        if not sections:
+            return
+
+        self.stats["changes_seen"] += 1
+        self.pending.setdefault(user_id, set()).update(sections)
+
+        now = time.monotonic()
+        first = self._first_change.setdefault(user_id, now)
+        delay = min(self.debounce_seconds, max(0.0, first + self.max_delay_seconds - now))
+
+        timer = self._timers.pop(user_id, None)
+        if timer:
+            timer.cancel()
+        loop = asyncio.get_running_loop()
+        self._timers[user_id] = loop.call_later(delay, self._mark_ready, user_id)
+
+    def _mark_ready(self, user_id: str):
+        self._timers.pop(user_id, None)
+        self._first_change.pop(user_id, None)
+        self._ready.put_nowait(user_id)
+
+    def _handle_change(self, change: Dict):
+        collection = change.get("ns", {}).get("coll")
+        if collection == "users":
+            user_id = str(change.get("documentKey", {}).get("_id"))
+        else:
+            # Deletes carry no document; those rely on the route's write hook
+            user_id = (change.get("fullDocument") or {}).get("user_id")
+        self.mark_changed(user_id, [collection])
+
+    async def _watch_changes(self):
+        try:
+            async for change in self._stream:
+                self._handle_change(change)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Embedding change stream failed, falling back to write hooks: {e}")
+            self.mode = "hooks"
+
+    async def _refresh_worker(self):
+        while True:
+            user_id = await self._ready.get()
+            sections = self.pending.pop(user_id, None)
+            if not sections:
+                continue
+            try:
+                if await self.embedder.update_user_embeddings(user_id, sections):
+                    self.stats["refreshes"] += 1
+                else:
+                    self.stats["refresh_failures"] += 1
+            except Exception as e:
+                self.stats["refresh_failures"] += 1
+                logger.error(f"Error refreshing embeddings for user {user_id}: {str(e)}")
+
+    def get_status(self) -> Dict:
+        """Mode, pending users and counters, for monitoring"""
+        return {
+            "mode": self.mode,
+            "pending_users": len(self.pending),
+            **self.stats
+        }
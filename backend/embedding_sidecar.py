@@ -0,0 +1,265 @@
+"""
+Embedding Sidecar
+One process that owns the embedding model and vector store for every API worker
+
+Each uvicorn worker used to load its own model and open its own ChromaDB
+client. With EMBEDDING_SIDECAR_URL set, EmbedderAgent in the workers uses
+RemoteEmbedder and RemoteVectorStore instead, which forward encode and vector
+store calls to this service over HTTP (or a Unix socket), so the model is
+loaded once and the vector store has a single writer. Query encodes arriving
+from different workers go through the agent's micro-batcher
+(EMBEDDING_BATCH_MAX_WAIT_MS), so they run as one batch. Vectors travel as
+base64 float32, not JSON number lists.
+
+Run (from backend/):
+    python embedding_sidecar.py --uds /tmp/fibby-embeddings.sock
+    # workers: EMBEDDING_SIDECAR_URL=http://sidecar EMBEDDING_SIDECAR_UDS=/tmp/fibby-embeddings.sock
+"""
+import os
+import argparse
+import asyncio
+import base64
+import logging
+from typing import Dict, List, Optional
+
+import httpx
+import numpy as np
+from fastapi import FastAPI, HTTPException
+
+from embedder_service import BaseEmbedder, EmbedderAgent, VectorStore
+
+logger = logging.getLogger(__name__)
+
+# Where workers reach the sidecar; with EMBEDDING_SIDECAR_UDS the URL's host is ignored
+EMBEDDING_SIDECAR_URL = os.environ.get("EMBEDDING_SIDECAR_URL", "")
+EMBEDDING_SIDECAR_UDS = os.environ.get("EMBEDDING_SIDECAR_UDS", "")
+EMBEDDING_SIDECAR_TIMEOUT_SECONDS = float(os.environ.get("EMBEDDING_SIDECAR_TIMEOUT_SECONDS", "30"))
+
+
+def pack_vectors(vectors) -> Dict:
+    """Vectors as a base64 float32 payload"""
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if matrix.size == 0:
+        matrix = np.zeros((0, 0), dtype=np.float32)
+    return {"shape": list(matrix.shape), "data": base64.b64encode(matrix.tobytes()).decode("ascii")}
+
+
+def unpack_vectors(payload: Dict) -> List[List[float]]:
+    matrix = np.frombuffer(base64.b64decode(payload["data"]), dtype=np.float32).reshape(payload["shape"])
+    return matrix.tolist()
+
+
+# ============= CLIENT (API WORKERS) =============
+
+class SidecarClient:
+    """Blocking HTTP client for the sidecar; safe to share across threads"""
+
+    def __init__(
+        self,
+        url: str = EMBEDDING_SIDECAR_URL,
+        uds: str = EMBEDDING_SIDECAR_UDS,
+        timeout: float = EMBEDDING_SIDECAR_TIMEOUT_SECONDS
+    ):
+        if not url:
+            raise ValueError("EMBEDDING_SIDECAR_URL is not set")
+        self.url = url
+        transport = httpx.HTTPTransport(uds=uds) if uds else None
+        self.http = httpx.Client(base_url=url, transport=transport, timeout=timeout)
+
+    def call(self, method: str, path: str, payload: Optional[Dict] = None) -> Dict:
+        response = self.http.request(method, path, json=payload)
+        response.raise_for_status()
+        return response.json()
+
+    def close(self):
+        self.http.close()
+
+
+class RemoteEmbedder(BaseEmbedder):
+    """BaseEmbedder whose encode() runs in the sidecar"""
+
+    def __init__(self, client: SidecarClient):
+        self.client = client
+        info = client.call("GET", "/info")
+        self.model_name = info["model"]
+        self.dimensions = info["dimensions"]
+        self.rag_enabled = info["rag_enabled"]
+        self.store_backend = info["vector_store"]
+
+    def encode(self, texts: List[str], show_progress_bar: bool = False, query: bool = False) -> List[List[float]]:
+        if not texts:
+            return []
+        result = self.client.call("POST", "/encode", {"texts": list(texts), "query": query})
+        return unpack_vectors(result["embeddings"])
+
+
+class RemoteQueryEmbedder(BaseEmbedder):
+    """Query-side view of a RemoteEmbedder: encodes go through the sidecar's micro-batcher and LRU cache"""
+
+    def __init__(self, embedder: RemoteEmbedder):
+        self.embedder = embedder
+        self.model_name = embedder.model_name
+        self.dimensions = embedder.dimensions
+
+    def encode(self, texts: List[str], show_progress_bar: bool = False) -> List[List[float]]:
+        return self.embedder.encode(texts, query=True)
+
+
+class RemoteVectorStore(VectorStore):
+    """VectorStore whose reads and writes run in the sidecar"""
+
+    def __init__(self, client: SidecarClient, backend_name: str):
+        self.client = client
+        self.backend_name = f"{backend_name} (sidecar)"
+        self.location = client.url
+
+    def query(self, query_embeddings: List[List[float]], n_results: int, user_id: Optional[str] = None) -> Dict:
+        return self.client.call("POST", "/query", {
+            "query_embeddings": pack_vectors(query_embeddings),
+            "n_results": n_results,
+            "user_id": user_id
+        })
+
+    def get(self, user_id: str) -> Dict:
+        return self.client.call("POST", "/get", {"user_id": user_id})
+
+    def upsert(self, ids: List[str], embeddings: List[List[float]], documents: List[str], metadatas: List[Dict]):
+        self.client.call("POST", "/upsert", {
+            "ids": ids,
+            "embeddings": pack_vectors(embeddings),
+            "documents": documents,
+            "metadatas": metadatas
+        })
+
+    def delete(self, user_id: str, ids: List[str]):
+        self.client.call("POST", "/delete", {"user_id": user_id, "ids": ids})
+
+    def delete_user(self, user_id: str) -> int:
+        return self.client.call("POST", "/delete_user", {"user_id": user_id})["removed"]
+
+    def count(self) -> int:
+        return self.client.call("GET", "/count")["count"]
+
+
+# ============= SERVICE =============
+
+app = FastAPI(title="Fibby embedding sidecar")
+agent: Optional[EmbedderAgent] = None
+
+
+@app.on_event("startup")
+async def startup():
+    """Load the model and vector store locally (never through another sidecar)"""
+    global agent
+    agent = EmbedderAgent(use_sidecar=False)
+    await agent.ensure_loaded()
+    logger.info(f"Embedding sidecar ready: {agent.load_state}")
+
+
+@app.get("/info")
+async def info():
+    return {
+        "model": agent.model.model_name,
+        "dimensions": agent.model.dimensions,
+        "rag_enabled": agent.is_rag_enabled(),
+        "vector_store": agent.store.backend_name,
+        "batching": agent.get_batching_stats()
+    }
+
+
+@app.post("/encode")
+async def encode(request: dict):
+    """Document encodes go straight to the model; query encodes are batched and cached"""
+    try:
+        texts = request.get("texts", [])
+        if request.get("query"):
+            embeddings = await agent.query_model.encode_async(texts)
+        else:
+            embeddings = await asyncio.to_thread(agent.model.encode, texts)
+        return {"embeddings": pack_vectors(embeddings)}
+    except Exception as e:
+        logger.error(f"Sidecar encode error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/query")
+async def query(request: dict):
+    try:
+        return await asyncio.to_thread(
+            agent.store.query,
+            unpack_vectors(request["query_embeddings"]),
+            request.get("n_results", 3),
+            request.get("user_id")
+        )
+    except Exception as e:
+        logger.error(f"Sidecar query error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/get")
+async def get(request: dict):
+    try:
+        return await asyncio.to_thread(agent.store.get, request["user_id"])
+    except Exception as e:
+        logger.error(f"Sidecar get error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/upsert")
+async def upsert(request: dict):
+    try:
+        await asyncio.to_thread(
+            agent.store.upsert,
+            request["ids"],
+            unpack_vectors(request["embeddings"]),
+            request["documents"],
+            request["metadatas"]
+        )
+        return {"upserted": len(request["ids"])}
+    except Exception as e:
+        logger.error(f"Sidecar upsert error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/delete")
+async def delete(request: dict):
+    try:
+        await asyncio.to_thread(agent.store.delete, request["user_id"], request["ids"])
+        return {"deleted": len(request["ids"])}
+    except Exception as e:
+        logger.error(f"Sidecar delete error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/delete_user")
+async def delete_user(request: dict):
+    try:
+        return {"removed": await asyncio.to_thread(agent.store.delete_user, request["user_id"])}
+    except Exception as e:
+        logger.error(f"Sidecar delete_user error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/count")
+async def count():
+    return {"count": await asyncio.to_thread(agent.store.count)}
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Shared embedding model and vector store for API workers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--uds", help="listen on a Unix socket instead of host:port")
+    args = parser.parse_args()
+
+    # One process by design: a single model copy and a single vector store writer
+    if args.uds:
+        uvicorn.run(app, uds=args.uds, workers=1)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port, workers=1)
+
+
+if __name__ == "__main__":
+    main()
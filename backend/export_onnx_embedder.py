@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Export all-MiniLM-L6-v2 to ONNX and quantize it to int8
+
+Writes model.onnx (float32), model_int8.onnx (dynamic int8 weights) and
+tokenizer.json to ONNX_EMBEDDER_DIR, where get_embedder() picks it up.
+Needs torch and transformers at export time only; the server runs the
+result with onnxruntime and tokenizers.
+
+Usage (from backend/):
+    python export_onnx_embedder.py [--output models/all-MiniLM-L6-v2-onnx]
+    python -m benchmarks.onnx_embedder   # equivalence check and benchmarks
+"""
+import argparse
+from pathlib import Path
+
+from embedder_service import ONNX_EMBEDDER_DIR, ONNX_MODEL_FILE, ONNX_MAX_SEQ_LENGTH
+
+HF_MODEL_ID = "sentence-transformers/all-MiniLM-L6-v2"
+OPSET_VERSION = 17
+
+
+def export(output_dir: Path):
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(HF_MODEL_ID)
+    model = AutoModel.from_pretrained(HF_MODEL_ID)
+    model.eval()
+
+    # The fast tokenizer's tokenizer.json is all OnnxEmbedder needs
+    tokenizer.save_pretrained(str(output_dir))
+
+    sample = tokenizer(
+        ["Transaction: Lunch - ₹450.00 (expense) in Food category at Zomato"],
+        padding=True, truncation=True, max_length=ONNX_MAX_SEQ_LENGTH, return_tensors="pt"
+    )
+    float_path = output_dir / "model.onnx"
+    dynamic_axes = {"input_ids": {0: "batch", 1: "sequence"},
+                    "attention_mask": {0: "batch", 1: "sequence"},
+                    "token_type_ids": {0: "batch", 1: "sequence"},
+                    "last_hidden_state": {0: "batch", 1: "sequence"}}
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+            str(float_path),
+            input_names=["input_ids", "attention_mask", "token_type_ids"],
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=OPSET_VERSION,
+            do_constant_folding=True
+        )
+    print(f"Exported {float_path} ({float_path.stat().st_size / 1e6:.1f} MB)")
+
+    quantized_path = output_dir / ONNX_MODEL_FILE
+    quantize_dynamic(str(float_path), str(quantized_path), weight_type=QuantType.QInt8)
+    print(f"Quantized {quantized_path} ({quantized_path.stat().st_size / 1e6:.1f} MB)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", type=Path, default=ONNX_EMBEDDER_DIR)
+    args = parser.parse_args()
+    export(args.output)
+
+
+if __name__ == "__main__":
+    main()
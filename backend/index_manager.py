@@ -0,0 +1,215 @@
+"""
+Index Manager
+Declares the compound indexes every hot query needs and creates them at startup
+
+ensure_indexes() is idempotent and safe to run on every boot. verify_index_usage()
+runs explain() for the hot-path queries issued by the API routes and raises
+IndexVerificationError if any of them would fall back to a COLLSCAN.
+
+Usage (from backend/):
+    python index_manager.py            # create indexes
+    python index_manager.py --check    # create indexes, then verify query plans
+"""
+import os
+import asyncio
+import argparse
+import logging
+from datetime import datetime
+from typing import Dict, List
+
+from bson import ObjectId
+
+from spending_rollups import ROLLUPS_COLLECTION, ROLLUP_INDEXES, ROLLUP_OBSOLETE_INDEXES
+
+logger = logging.getLogger(__name__)
+
+# "off" skips plan verification at startup, "warn" logs COLLSCANs, "strict" refuses to start
+INDEX_CHECK_MODE = os.environ.get("INDEX_CHECK_MODE", "warn").lower()
+
+# collection -> [(keys, options)]
+INDEX_SPECS = {
+    "users": [
+        ([("email", 1)], {"name": "email"}),
+        ([("phone", 1)], {"name": "phone"}),
+        ([("pan_card", 1)], {"name": "pan_card"}),
+    ],
+    "transactions": [
+        # Also serves every (user_id, date) query; _id breaks date ties for keyset pages
+        ([("user_id", 1), ("date", -1), ("_id", -1)], {"name": "user_date_id"}),
+        ([("user_id", 1), ("transaction_type", 1), ("date", -1)], {"name": "user_type_date"}),
+    ],
+    "bank_accounts": [
+        ([("user_id", 1), ("last_updated", -1)], {"name": "user_last_updated"}),
+    ],
+    "goals": [
+        ([("user_id", 1)], {"name": "user"}),
+    ],
+    "insights": [
+        ([("user_id", 1), ("date", -1)], {"name": "user_date"}),
+        ([("user_id", 1), ("is_read", 1), ("date", -1)], {"name": "user_read_date"}),
+    ],
+    "investment_holdings": [
+        ([("user_id", 1)], {"name": "user"}),
+    ],
+    "stock_holdings": [
+        ([("user_id", 1)], {"name": "user"}),
+    ],
+    "mutual_funds": [
+        ([("user_id", 1), ("is_sip", 1)], {"name": "user_is_sip"}),
+    ],
+    "other_investments": [
+        ([("user_id", 1), ("type", 1)], {"name": "user_type"}),
+    ],
+    "chat_conversations": [
+        ([("user_id", 1), ("conversation_id", 1)], {"name": "user_conversation"}),
+        ([("user_id", 1), ("updated_at", -1)], {"name": "user_updated_at"}),
+    ],
+    ROLLUPS_COLLECTION: ROLLUP_INDEXES,
+}
+
+# collection -> [index name] superseded by INDEX_SPECS and dropped before creating them
+OBSOLETE_INDEXES = {
+    ROLLUPS_COLLECTION: ROLLUP_OBSOLETE_INDEXES,
+}
+
+# Representative filters/sorts issued by the API routes; values only need the right types
+_SAMPLE_USER = "000000000000000000000000"
+HOT_QUERIES = [
+    {"route": "GET /transactions", "collection": "transactions",
+     "filter": {"user_id": _SAMPLE_USER}, "sort": {"date": -1, "_id": -1}},
+    {"route": "GET /transactions/page?cursor", "collection": "transactions",
+     "filter": {"user_id": _SAMPLE_USER, "$or": [
+         {"date": {"$lt": datetime(2000, 1, 1)}},
+         {"date": datetime(2000, 1, 1), "_id": {"$lt": ObjectId(_SAMPLE_USER)}}
+     ]},
+     "sort": {"date": -1, "_id": -1}},
+    {"route": "analytics (expense range)", "collection": "transactions",
+     "filter": {"user_id": _SAMPLE_USER, "transaction_type": "expense", "date": {"$gte": datetime(2000, 1, 1)}}},
+    {"route": "GET /goals", "collection": "goals",
+     "filter": {"user_id": _SAMPLE_USER}},
+    {"route": "GET /insights", "collection": "insights",
+     "filter": {"user_id": _SAMPLE_USER}, "sort": {"date": -1}},
+    {"route": "GET /insights?unread_only", "collection": "insights",
+     "filter": {"user_id": _SAMPLE_USER, "is_read": False}, "sort": {"date": -1}},
+    {"route": "GET /bank-accounts", "collection": "bank_accounts",
+     "filter": {"user_id": _SAMPLE_USER}, "sort": {"last_updated": -1}},
+    {"route": "GET /investments/holdings", "collection": "investment_holdings",
+     "filter": {"user_id": _SAMPLE_USER}},
+    {"route": "GET /investments/sips", "collection": "mutual_funds",
+     "filter": {"user_id": _SAMPLE_USER, "is_sip": True}},
+    {"route": "GET /investments/other", "collection": "other_investments",
+     "filter": {"user_id": _SAMPLE_USER, "type": "fd"}},
+    {"route": "GET /chat/conversations", "collection": "chat_conversations",
+     "filter": {"user_id": _SAMPLE_USER}, "sort": {"updated_at": -1}},
+    {"route": "GET /chat/conversations/{id}", "collection": "chat_conversations",
+     "filter": {"user_id": _SAMPLE_USER, "conversation_id": "sample"}},
+    {"route": "analytics (rollups)", "collection": ROLLUPS_COLLECTION,
+     "filter": {"user_id": _SAMPLE_USER, "generation": "sample", "granularity": "day", "transaction_type": "expense"}},
+]
+
+
+class IndexVerificationError(RuntimeError):
+    """A hot-path query's winning plan scans the whole collection"""
+
+
+async def ensure_indexes(db) -> int:
+    """Create every declared index; existing identical indexes are left as they are"""
+    for collection, names in OBSOLETE_INDEXES.items():
+        try:
+            existing = await db[collection].index_information()
+            for name in names:
+                if name in existing:
+                    await db[collection].drop_index(name)
+                    logger.info(f"Dropped obsolete index {name} on {collection}")
+        except Exception as e:
+            logger.error(f"Could not drop obsolete indexes on {collection}: {e}")
+
+    created = 0
+    for collection, specs in INDEX_SPECS.items():
+        for keys, options in specs:
+            try:
+                await db[collection].create_index(keys, **options)
+                created += 1
+            except Exception as e:
+                # e.g. an index with the same name but different keys/options already exists
+                logger.error(f"Could not create index {options.get('name')} on {collection}: {e}")
+    logger.info(f"Ensured {created} indexes across {len(INDEX_SPECS)} collections")
+    return created
+
+
+def _plan_stages(plan) -> List[str]:
+    """All stage names in an explain plan tree"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(_plan_stages(item))
+    return stages
+
+
+async def explain_query(db, query: Dict) -> List[str]:
+    """Stage names of the winning plan for one hot query"""
+    command = {"find": query["collection"], "filter": query["filter"]}
+    if query.get("sort"):
+        command["sort"] = query["sort"]
+    explanation = await db.command("explain", command, verbosity="queryPlanner")
+    return _plan_stages(explanation["queryPlanner"]["winningPlan"])
+
+
+async def verify_index_usage(db, strict: bool = True) -> List[Dict]:
+    """
+    Explain every hot query and report those whose plan contains a COLLSCAN
+
+    Raises IndexVerificationError when strict and any query is unindexed.
+    """
+    failures = []
+    for query in HOT_QUERIES:
+        stages = await explain_query(db, query)
+        if "COLLSCAN" in stages:
+            failures.append({"route": query["route"], "collection": query["collection"], "stages": stages})
+
+    for failure in failures:
+        logger.error(f"COLLSCAN for {failure['route']} on {failure['collection']}: {failure['stages']}")
+
+    if failures and strict:
+        raise IndexVerificationError(
+            f"{len(failures)} hot queries fall back to COLLSCAN: "
+            + ", ".join(failure["route"] for failure in failures)
+        )
+    if not failures:
+        logger.info(f"All {len(HOT_QUERIES)} hot queries use an index")
+    return failures
+
+
+async def bootstrap_indexes(db, check_mode: str = INDEX_CHECK_MODE):
+    """Startup entry point: create indexes, then verify plans according to check_mode"""
+    await ensure_indexes(db)
+    if check_mode != "off":
+        await verify_index_usage(db, strict=check_mode == "strict")
+
+
+async def main():
+    from pathlib import Path
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Create MongoDB indexes and verify hot-path query plans")
+    parser.add_argument("--check", action="store_true", help="fail if any hot query uses a COLLSCAN")
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    try:
+        await bootstrap_indexes(client[os.environ['DB_NAME']], "strict" if args.check else "off")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
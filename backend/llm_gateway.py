@@ -0,0 +1,554 @@
+"""
+LLM Gateway
+Single entry point for every GPT call made by the API
+
+Holds one pre-built configuration per persona (system prompt, model, timeout,
+fallback reply), caps concurrent LLM calls globally, rate-limits each user,
+and records latency and token metrics per persona.
+
+Transport: with LLM_API_BASE set, calls go straight to that OpenAI-compatible
+endpoint through litellm over one shared keep-alive connection pool, and
+token counts come from the provider's usage report. Without it they go
+through emergentintegrations' LlmChat, which resolves the Emergent endpoint
+itself: each call builds its own client (LlmChat exposes no way to share a
+pool) and reports no usage, so token counts are estimated from text length.
+get_metrics() says which applies. Token streaming also needs LLM_API_BASE;
+without it stream() yields one complete() reply instead of attempting a
+stream that can't succeed.
+"""
+import os
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, Optional
+
+import httpx
+from emergentintegrations.llm.chat import LlmChat, UserMessage
+
+logger = logging.getLogger(__name__)
+
+LLM_PROVIDER = os.environ.get("LLM_PROVIDER", "openai")
+LLM_MODEL = os.environ.get("LLM_MODEL", "gpt-5.1")
+# OpenAI-compatible endpoint that accepts EMERGENT_LLM_KEY; unset routes through LlmChat
+LLM_API_BASE = os.environ.get("LLM_API_BASE")
+# LLM calls in flight at once across all users (queue wait counts toward the timeout)
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "16"))
+# Calls per user per minute before requests are rejected
+LLM_USER_RATE_PER_MINUTE = int(os.environ.get("LLM_USER_RATE_PER_MINUTE", "20"))
+LLM_TIMEOUT_SECONDS = float(os.environ.get("LLM_TIMEOUT_SECONDS", "30"))
+LLM_HTTP_MAX_CONNECTIONS = int(os.environ.get("LLM_HTTP_MAX_CONNECTIONS", "32"))
+# Tracked users before idle rate-limit windows are pruned
+LLM_RATE_LIMIT_MAX_USERS = 10000
+# Recent call latencies kept per persona for percentiles
+LLM_LATENCY_WINDOW = 500
+
+HINGLISH_BUDDY_PROMPT = """You are Fibby, a friendly Gen-Z finance buddy for Indians. 
+
+Your personality:
+- Speak in casual Hinglish (mix of Hindi and English)
+- Use phrases like "bro", "yaar", "scene", "chill hai"
+- Be encouraging and supportive, never judgemental
+- Keep responses short and conversational (2-3 sentences max)
+- Use emojis naturally but don't overdo it
+
+Your role:
+- Help users understand their spending
+- Give practical money advice
+- Encourage good financial habits
+- Make finance feel fun and approachable
+
+Examples:
+- "Bro, you spent ₹5k on Zomato this month. Ghar ka khana bhi try karo! 🍛"
+- "Scene sorted hai! You're under budget. Keep it up yaar 📈"
+- "Relax bro, sabka hota hai. Next month better karenge 💪"
+"""
+
+PROFESSIONAL_ADVISOR_PROMPT = """You are Fibby, a smart and friendly finance companion for individuals looking to learn more and be self-reliant when it comes to finances.
+
+YOUR TONE: Professional Advisor
+- Be encouraging and supportive
+- Use emojis strategically (3-5 per response for visual appeal)
+
+YOUR ROLE:
+- Provide REAL ANSWERS with actual data and insights from the user's data
+- Analyze trends and give actionable advice
+- Help users understand their financial situation clearly
+- Guide them toward better financial decisions
+
+RESPONSE STRUCTURE:
+
+MAIN ANSWER (Required):
+- Address their question directly with their specific data
+- Share insights, trends, or analysis
+- Provide actionable recommendations
+- Use numbers and percentages from the context
+- Keep it 1-2 sentences, short, and direct. No need to write lengthy explanations
+- Use visual formatting for better engagement
+
+VISUAL FORMATTING GUIDELINES:
+
+✅ USE EMOJIS AS BULLET POINTS:
+- Use relevant emojis (🛒 Shopping, 🚗 Travel, 🍽️ Food, 💰 Money, 📊 Stats, etc.)
+- Start category lists with emoji bullets
+
+📊 USE VISUAL BARS FOR PERCENTAGES:
+- For percentages 0-100%, show visual bar using █ blocks
+- Example: "████████░░ 80%"
+- Always show percentage number after the bar
+
+💡 FORMAT BREAKDOWN LISTS:
+- Category emoji + name + amount + visual bar
+- Example: "🛒 Shopping: ₹22,500 ████████░░ 35%"
+
+🎯 USE CLEAR SECTIONS:
+- Break down response into clear sections
+- Use spacing and line breaks for readability
+- Group related information together
+
+MCQ OPTIONS (Only when relevant):
+- Include when there are natural next steps
+- When user needs to make a decision
+- When exploring different aspects of a topic
+- When there are multiple follow-up paths
+- Limit to 2-4 options max
+- Format MCQs like: "OPTIONS:\n[Option 1]\n[Option 2]\n[Option 3]"
+
+DON'T:
+- Don't always add MCQs if the answer is complete
+- Don't be overly casual or lose professionalism
+- Don't give vague answers - use the data provided
+
+DO:
+- Give specific numbers and percentages
+- Highlight important trends or concerns
+- Offer practical advice
+- Make finance feel accessible
+- End naturally without forcing MCQs
+
+CRITICAL: You must respond ONLY with valid JSON in this exact structure:
+
+JSON RESPONSE FORMAT:
+{
+  "summary": "Your response text here (match length to query complexity)",
+  "cardType": "spending_breakdown" | "portfolio" | "budget_status" | "goal_progress" | null,
+  "metrics": {
+    // Structure varies by cardType - see examples below
+  },
+  "options": ["Option 1", "Option 2"] // 2-4 MCQ options when relevant
+}
+
+CARD TYPES & METRICS STRUCTURE:
+
+1. spending_breakdown (for spending queries):
+{
+  "total": 32400,
+  "period": "This Month",
+  "categories": [
+    {"name": "Food", "emoji": "🍽️", "amount": 12200, "percentage": 38, "color": "#608BB6"},
+    {"name": "Travel", "emoji": "🚗", "amount": 8500, "percentage": 26, "color": "#82B1FF"}
+  ]
+}
+
+2. portfolio (for investment queries):
+{
+  "currentValue": 523400,
+  "invested": 442000,
+  "returns": 81400,
+  "returnsPercentage": 18.4,
+  "assets": [
+    {"name": "Equity", "emoji": "📈", "percentage": 60, "returns": 22, "color": "#608BB6"}
+  ]
+}
+
+3. budget_status (for budget queries):
+{
+  "spent": 32400,
+  "budget": 45000,
+  "percentage": 72,
+  "topCategories": [
+    {"name": "Food", "emoji": "🍽️", "amount": 12200, "color": "#608BB6"}
+  ]
+}
+
+4. goal_progress (for goal queries):
+{
+  "goalName": "Goa Trip",
+  "target": 50000,
+  "current": 36000,
+  "percentage": 72,
+  "emoji": "✈️"
+}
+
+WHEN TO USE CARDS:
+- Use cardType when query asks about specific data (spending, budget, investments, goals)
+- Set cardType to null for general questions, advice, or explanations
+- The card will visualize the data, so keep your summary focused on insights
+
+MCQ OPTIONS (when relevant):
+   - Include when there are natural next steps
+   - When user needs to make a decision
+   - When exploring different aspects of a topic
+   - Limit to 2-4 options max
+
+EXAMPLES:
+
+Example 1 - Spending Query (with card):
+User Data: Total ₹32,400, Food ₹12,200 (38%), Travel ₹8,500 (26%)
+Response:
+{
+  "summary": "You've spent ₹32,400 this month. Food is your biggest expense at 38%, followed by travel at 26%.",
+  "cardType": "spending_breakdown",
+  "metrics": {
+    "total": 32400,
+    "period": "This Month",
+    "categories": [
+      {"name": "Food", "emoji": "🍽️", "amount": 12200, "percentage": 38, "color": "#608BB6"},
+      {"name": "Travel", "emoji": "🚗", "amount": 8500, "percentage": 26, "color": "#82B1FF"},
+      {"name": "Shopping", "emoji": "🛒", "amount": 6200, "percentage": 19, "color": "#81C784"},
+      {"name": "Bills", "emoji": "💳", "amount": 5500, "percentage": 17, "color": "#FFB74D"}
+    ]
+  },
+  "options": ["Set spending limit for Food", "View daily breakdown", "Compare with last month"]
+}
+
+Example 2 - Investment Query (with card):
+{
+  "summary": "Your portfolio is up 18.4% with ₹81,400 in gains. Equity is driving most returns at +22%.",
+  "cardType": "portfolio",
+  "metrics": {
+    "currentValue": 523400,
+    "invested": 442000,
+    "returns": 81400,
+    "returnsPercentage": 18.4,
+    "assets": [
+      {"name": "Equity", "emoji": "📈", "percentage": 60, "returns": 22, "color": "#608BB6"},
+      {"name": "Debt", "emoji": "📊", "percentage": 30, "returns": 8, "color": "#82B1FF"},
+      {"name": "Gold", "emoji": "💰", "percentage": 10, "returns": 12, "color": "#FFD700"}
+    ]
+  },
+  "options": ["Review holdings", "Rebalance portfolio", "Increase SIP"]
+}
+
+Example 3 - General Question (no card):
+{
+  "summary": "SIP (Systematic Investment Plan) is a way to invest a fixed amount regularly in mutual funds. It helps build wealth through rupee cost averaging and compound growth.",
+  "cardType": null,
+  "metrics": null,
+  "options": ["Learn about mutual funds", "How to start a SIP", "Best SIP strategies"]
+}
+
+IMPORTANT: Always return valid JSON. The frontend will display only the summary to users and render the card separately."""
+
+INVESTMENT_ADVISOR_PROMPT = """You are a financial advisor specializing in Indian investments.
+                Analyze the portfolio and provide 2-3 specific, actionable investment recommendations.
+                Focus on:
+                - Asset allocation balance
+                - Diversification opportunities
+                - Tax-saving instruments (80C, NPS)
+                - Risk-adjusted returns
+
+                Return recommendations in this JSON format:
+                [
+                    {
+                        "title": "Short title",
+                        "description": "1-2 sentence description",
+                        "asset_class": "Asset class name",
+                        "priority": 1-10 (higher is more important),
+                        "reasoning": "Why this is recommended"
+                    }
+                ]
+
+                Keep it practical and specific to Indian market."""
+
+# persona -> pre-built call configuration
+PERSONAS = {
+    "hinglish_buddy": {
+        "system_message": HINGLISH_BUDDY_PROMPT,
+        "timeout": LLM_TIMEOUT_SECONDS,
+        "fallback": "Arre yaar, my brain is a little slow right now 😅 Try again in a bit?"
+    },
+    "professional_advisor": {
+        "system_message": PROFESSIONAL_ADVISOR_PROMPT,
+        "timeout": LLM_TIMEOUT_SECONDS,
+        "fallback": "I'm taking longer than usual to analyse your data right now. Please try again in a moment. 🙏"
+    },
+    "investment_advisor": {
+        "system_message": INVESTMENT_ADVISOR_PROMPT,
+        "timeout": float(os.environ.get("RECOMMENDATION_AI_TIMEOUT_SECONDS", "60")),
+        "fallback": None
+    },
+}
+
+
+class LLMRateLimited(Exception):
+    """The user made too many LLM calls in the last minute"""
+
+
+class LLMResult:
+    """Reply text plus how it was produced"""
+
+    def __init__(self, text: str, fallback: bool = False, error: Optional[str] = None):
+        self.text = text
+        self.fallback = fallback
+        self.error = error
+
+
+def _estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English-heavy text; used when the transport reports no usage
+    return max(1, len(text) // 4) if text else 0
+
+
+class LLMGateway:
+    """Shared, bounded, observable access to the chat model for all personas"""
+
+    def __init__(
+        self,
+        personas: Dict[str, Dict] = PERSONAS,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        user_rate_per_minute: int = LLM_USER_RATE_PER_MINUTE,
+        api_base: Optional[str] = LLM_API_BASE
+    ):
+        self.personas = personas
+        self.max_concurrency = max_concurrency
+        self.user_rate_per_minute = user_rate_per_minute
+        self.api_base = api_base
+        self.api_key = os.environ.get("EMERGENT_LLM_KEY")
+        self.model = f"{LLM_PROVIDER}/{LLM_MODEL}"
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+
+        # One keep-alive connection pool for every litellm call in the process
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=LLM_HTTP_MAX_CONNECTIONS, max_keepalive_connections=LLM_HTTP_MAX_CONNECTIONS)
+        )
+
+        # user_id -> timestamps of calls in the last minute
+        self._user_calls: Dict[str, Deque[float]] = {}
+        self._metrics: Dict[str, Dict] = {name: self._empty_metrics() for name in personas}
+        self._latencies: Dict[str, Deque[float]] = {name: deque(maxlen=LLM_LATENCY_WINDOW) for name in personas}
+
+    def _litellm(self):
+        """litellm, imported on first use (it adds seconds to startup) and bound to the shared pool"""
+        import litellm
+        if litellm.aclient_session is not self.http_client:
+            litellm.aclient_session = self.http_client
+        return litellm
+
+    @staticmethod
+    def _empty_metrics() -> Dict:
+        return {
+            "calls": 0, "failures": 0, "timeouts": 0, "fallbacks": 0, "rate_limited": 0,
+            "prompt_tokens": 0, "completion_tokens": 0, "estimated_token_calls": 0, "total_latency_ms": 0.0
+        }
+
+    def check_rate_limit(self, user_id: Optional[str], persona: str):
+        """Record a call for user_id, raising LLMRateLimited over the per-minute budget"""
+        if not user_id or self.user_rate_per_minute <= 0:
+            return
+        now = time.monotonic()
+        if len(self._user_calls) > LLM_RATE_LIMIT_MAX_USERS:
+            # Forget users with no calls in the current window
+            self._user_calls = {uid: calls for uid, calls in self._user_calls.items() if calls and calls[-1] > now - 60}
+        calls = self._user_calls.setdefault(user_id, deque())
+        while calls and calls[0] <= now - 60:
+            calls.popleft()
+        if len(calls) >= self.user_rate_per_minute:
+            self._metrics[persona]["rate_limited"] += 1
+            raise LLMRateLimited("Too many requests, please wait a moment before asking again")
+        calls.append(now)
+
+    def _record(self, persona: str, started: float, prompt_tokens: int, completion_tokens: int, estimated: bool):
+        latency_ms = (time.perf_counter() - started) * 1000
+        metrics = self._metrics[persona]
+        metrics["calls"] += 1
+        metrics["prompt_tokens"] += prompt_tokens
+        metrics["completion_tokens"] += completion_tokens
+        if estimated:
+            metrics["estimated_token_calls"] += 1
+        metrics["total_latency_ms"] += latency_ms
+        self._latencies[persona].append(latency_ms)
+
+    async def complete(
+        self,
+        persona: str,
+        prompt: str,
+        user_id: Optional[str] = None,
+        session_id: Optional[str] = None
+    ) -> LLMResult:
+        """
+        One reply for a persona
+
+        Raises LLMRateLimited when user_id is over its budget. Timeouts and
+        transport errors return the persona's fallback reply (fallback=True)
+        or raise if the persona has none.
+        """
+        config = self.personas[persona]
+        self.check_rate_limit(user_id, persona)
+
+        started = time.perf_counter()
+        try:
+            # The timeout covers waiting for a slot too, so a saturated gateway degrades to fallbacks
+            text, prompt_tokens, completion_tokens, estimated = await asyncio.wait_for(
+                self._call(config, prompt, session_id or f"{persona}_{user_id}"), config["timeout"]
+            )
+        except asyncio.TimeoutError:
+            self._metrics[persona]["timeouts"] += 1
+            return self._fallback(persona, f"timed out after {config['timeout']}s")
+        except Exception as e:
+            self._metrics[persona]["failures"] += 1
+            return self._fallback(persona, str(e))
+
+        self._record(persona, started, prompt_tokens, completion_tokens, estimated)
+        return LLMResult(text)
+
+    def _fallback(self, persona: str, error: str) -> LLMResult:
+        logger.error(f"LLM call for persona {persona} failed: {error}")
+        fallback = self.personas[persona]["fallback"]
+        if fallback is None:
+            raise RuntimeError(f"LLM call failed: {error}")
+        self._metrics[persona]["fallbacks"] += 1
+        return LLMResult(fallback, fallback=True, error=error)
+
+    async def _call(self, config: Dict, prompt: str, session_id: str):
+        async with self.semaphore:
+            self.in_flight += 1
+            try:
+                return await self._send(config, prompt, session_id)
+            finally:
+                self.in_flight -= 1
+
+    async def _send(self, config: Dict, prompt: str, session_id: str):
+        """(text, prompt tokens, completion tokens, whether the token counts are estimates)"""
+        if self.api_base:
+            response = await self._litellm().acompletion(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": config["system_message"]},
+                    {"role": "user", "content": prompt}
+                ],
+                api_key=self.api_key,
+                api_base=self.api_base
+            )
+            text = response.choices[0].message.content or ""
+            usage = getattr(response, "usage", None)
+            if usage:
+                return text, usage.prompt_tokens, usage.completion_tokens, False
+            return text, _estimate_tokens(config["system_message"] + prompt), _estimate_tokens(text), True
+
+        # Not pooled: LlmChat opens its own client per instance and returns only the text
+        chat = LlmChat(
+            api_key=self.api_key,
+            session_id=session_id,
+            system_message=config["system_message"]
+        ).with_model(LLM_PROVIDER, LLM_MODEL)
+        text = await chat.send_message(UserMessage(text=prompt))
+        return text, _estimate_tokens(config["system_message"] + prompt), _estimate_tokens(text), True
+
+    async def stream(
+        self,
+        persona: str,
+        prompt: str,
+        user_id: Optional[str] = None,
+        session_id: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        Yield reply tokens as the model produces them
+
+        Only with LLM_API_BASE set; otherwise, or if streaming fails before the
+        first token arrives, yields one complete() reply. The persona timeout
+        bounds the whole call (slot wait, opening the stream and every chunk),
+        so a stalled stream can't hold a concurrency slot indefinitely.
+        """
+        config = self.personas[persona]
+        self.check_rate_limit(user_id, persona)
+
+        if self.api_base:
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + config["timeout"]
+
+            def until_deadline(awaitable):
+                # Per-await deadline rather than asyncio.timeout(): a timeout scope left open
+                # across yield would cancel the consumer's code instead of this generator
+                return asyncio.wait_for(awaitable, max(0.0, deadline - loop.time()))
+
+            started = time.perf_counter()
+            received = []
+            try:
+                await until_deadline(self.semaphore.acquire())
+                self.in_flight += 1
+                try:
+                    response = await until_deadline(self._litellm().acompletion(
+                        model=self.model,
+                        messages=[
+                            {"role": "system", "content": config["system_message"]},
+                            {"role": "user", "content": prompt}
+                        ],
+                        api_key=self.api_key,
+                        api_base=self.api_base,
+                        stream=True
+                    ))
+                    chunks = response.__aiter__()
+                    while True:
+                        try:
+                            chunk = await until_deadline(chunks.__anext__())
+                        except StopAsyncIteration:
+                            break
+                        token = chunk.choices[0].delta.content if chunk.choices else None
+                        if token:
+                            received.append(token)
+                            yield token
+                finally:
+                    self.in_flight -= 1
+                    self.semaphore.release()
+                text = "".join(received)
+                # Streamed chunks carry no usage
+                self._record(
+                    persona, started, _estimate_tokens(config["system_message"] + prompt), _estimate_tokens(text), True
+                )
+                return
+            except asyncio.TimeoutError:
+                self._metrics[persona]["timeouts"] += 1
+                if received:
+                    raise
+                yield self._fallback(persona, f"timed out after {config['timeout']}s").text
+                return
+            except Exception as e:
+                if received:
+                    self._metrics[persona]["failures"] += 1
+                    raise
+                logger.warning(f"Streaming completion unavailable, falling back to a full reply: {str(e)}")
+
+        # Already counted against the rate limit above
+        result = await self.complete(persona, prompt, session_id=session_id or f"{persona}_{user_id}")
+        yield result.text
+
+    def is_fallback(self, persona: str, text: str) -> bool:
+        """Whether a reply is the persona's canned fallback rather than model output"""
+        return text == self.personas[persona]["fallback"]
+
+    def get_metrics(self) -> Dict:
+        """Per-persona call counts, token totals and latency percentiles"""
+        report = {}
+        for persona, metrics in self._metrics.items():
+            latencies = sorted(self._latencies[persona])
+            report[persona] = {
+                **metrics,
+                "total_latency_ms": round(metrics["total_latency_ms"], 1),
+                "avg_latency_ms": round(metrics["total_latency_ms"] / metrics["calls"], 1) if metrics["calls"] else 0.0,
+                "p50_latency_ms": round(latencies[len(latencies) // 2], 1) if latencies else 0.0,
+                "p95_latency_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 1) if latencies else 0.0
+            }
+        return {
+            "transport": "litellm" if self.api_base else "llmchat",
+            # llmchat: no shared connection pool, and every token count is an estimate
+            "pooled_http": bool(self.api_base),
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "user_rate_per_minute": self.user_rate_per_minute,
+            "personas": report
+        }
+
+    async def close(self):
+        """Release the shared HTTP connection pool"""
+        await self.http_client.aclose()
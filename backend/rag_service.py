@@ -1,18 +1,338 @@
 """
 RAG Service - Retrieval Augmented Generation
 Intelligently fetches relevant context from vector database for chat queries
+
+A query router sends numeric/time-window questions ("what did I spend on Food
+last week") to exact aggregation tools backed by the spending rollups, and
+only open-ended questions to vector search. Retrieved chunks are packed under
+a token budget (see context_packer) before they are added to the prompt.
 """
+import os
+import re
+import asyncio
 import logging
-from typing import List, Dict, Set
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+from typing import List, Dict, Set, Optional
 from embedder_service import EmbedderAgent
+from context_packer import ContextPacker, CONTEXT_HEADER, CONTEXT_FOOTER
+from spending_rollups import SpendingRollups, day_floor, month_floor
 
 logger = logging.getLogger(__name__)
 
+# Encoding and vector search run in a bounded thread pool so they never block the event loop
+RAG_MAX_WORKERS = int(os.environ.get("RAG_MAX_WORKERS", "2"))
+# Requests allowed to wait on (or run in) the pool at once; the rest queue on the semaphore
+RAG_MAX_CONCURRENCY = int(os.environ.get("RAG_MAX_CONCURRENCY", "8"))
+
+# (trigger keywords, extra search phrases) applied by RAGService.expand_query
+QUERY_EXPANSION_RULES = [
+    # Financial affordability queries
+    (['afford', 'buy', 'purchase', 'can i'], [
+        "current account balance",
+        "monthly budget and spending",
+        "upcoming bills and payments",
+        "recent expenses"
+    ]),
+    # Goal-related queries
+    (['goal', 'save', 'saving', 'target'], [
+        "financial goals and savings"
+    ]),
+    # Trip/Travel queries
+    (['trip', 'travel', 'vacation', 'goa', 'holiday'], [
+        "travel goals",
+        "travel expenses",
+        "entertainment spending"
+    ]),
+    # Spending analysis queries
+    (['spend', 'spent', 'spending', 'expenses'], [
+        "recent transactions",
+        "spending by category",
+        "monthly expenses"
+    ]),
+    # Investment queries
+    (['invest', 'portfolio', 'stocks', 'mutual fund', 'sip'], [
+        "investment holdings",
+        "mutual funds portfolio",
+        "SIP investments"
+    ]),
+    # Budget queries
+    (['budget', 'monthly'], [
+        "monthly budget",
+        "spending limits",
+        "budget status"
+    ]),
+]
+
+# Monthly budget assumed until users can set their own (same figure the keyword context uses)
+DEFAULT_MONTHLY_BUDGET = 45000
+
+# Intent keywords for QueryRouter (matched as whole words, plural "s" allowed)
+SPENDING_KEYWORDS = ['spend', 'spent', 'spending', 'expense', 'paid', 'pay for', 'cost me']
+INCOME_KEYWORDS = ['income', 'salary', 'earn', 'earned', 'earning', 'credited', 'savings rate', 'net savings']
+BUDGET_KEYWORDS = ['budget']
+BREAKDOWN_KEYWORDS = ['breakdown', 'categories', 'category', 'where did my money', 'where is my money', 'top merchants', 'merchant', 'most on']
+# "How much" / a bare time window only means spending when no other topic is named
+OTHER_TOPIC_KEYWORDS = ['portfolio', 'invest', 'investment', 'investing', 'sip', 'stock', 'mutual fund', 'fund',
+                        'goal', 'balance', 'loan', 'credit', 'emi']
+# Questions asking for judgement or planning still need the broader vector context
+OPEN_ENDED_KEYWORDS = [
+    'afford', 'should', 'advice', 'advise', 'tip', 'suggest', 'recommend', 'plan', 'why',
+    'how can', 'how do', 'how to', 'improve', 'reduce', 'cut down', 'cut back', 'help me', 'goal',
+    'invest', 'investment', 'investing'
+]
+
+
+def keyword_pattern(keywords: List[str]) -> re.Pattern:
+    """Regex matching any keyword as a whole word ("fund" matches "funds", not "refund")"""
+    alternatives = "|".join(re.escape(keyword) for keyword in keywords)
+    return re.compile(rf"\b(?:{alternatives})s?\b")
+
+
+SPENDING_PATTERN = keyword_pattern(SPENDING_KEYWORDS)
+INCOME_PATTERN = keyword_pattern(INCOME_KEYWORDS)
+BUDGET_PATTERN = keyword_pattern(BUDGET_KEYWORDS)
+BREAKDOWN_PATTERN = keyword_pattern(BREAKDOWN_KEYWORDS)
+OTHER_TOPIC_PATTERN = keyword_pattern(OTHER_TOPIC_KEYWORDS)
+OPEN_ENDED_PATTERN = keyword_pattern(OPEN_ENDED_KEYWORDS)
+
+MONTHS = ["january", "february", "march", "april", "may", "june",
+          "july", "august", "september", "october", "november", "december"]
+
+
+def _window(label: str, start: datetime, end: Optional[datetime]) -> Dict:
+    return {"label": label, "start": start, "end": end}
+
+
+def resolve_time_window(query: str, now: Optional[datetime] = None) -> Optional[Dict]:
+    """
+    Time window named in a query as {"label", "start", "end"} ([start, end), end None = open)
+
+    Returns None when the query names no window.
+    """
+    now = now or datetime.utcnow()
+    q = query.lower()
+    today = day_floor(now)
+    week_start = today - timedelta(days=today.weekday())
+    month_start = month_floor(now)
+
+    if re.search(r"\btoday\b", q):
+        return _window("today", today, None)
+    if re.search(r"\byesterday\b", q):
+        return _window("yesterday", today - timedelta(days=1), today)
+    match = re.search(r"\b(?:last|past|previous) (\d{1,3}) days\b", q)
+    if match:
+        days = int(match.group(1))
+        return _window(f"last {days} days", now - timedelta(days=days), None)
+    if re.search(r"\bweekend\b", q):
+        # Most recent Saturday-Sunday whose Sunday has begun (same weekend the keyword context uses)
+        days_since_sunday = (now.weekday() + 1) % 7
+        saturday = today - timedelta(days=days_since_sunday + 1)
+        return _window("last weekend", saturday, saturday + timedelta(days=2))
+    if re.search(r"\bthis week\b", q):
+        return _window("this week", week_start, None)
+    if re.search(r"\b(?:last|previous|past) week\b", q):
+        return _window("last week", week_start - timedelta(days=7), week_start)
+    if re.search(r"\b(?:last|previous|past) month\b", q):
+        previous = month_floor(month_start - timedelta(days=1))
+        return _window(previous.strftime("%B %Y"), previous, month_start)
+    if re.search(r"\bthis month\b|\bmonth so far\b", q):
+        return _window("this month", month_start, None)
+    if re.search(r"\bthis year\b", q):
+        return _window(str(now.year), datetime(now.year, 1, 1), None)
+    for index, name in enumerate(MONTHS):
+        # "may" is too common a word on its own
+        pattern = r"\bin may\b" if name == "may" else rf"\b{name}\b"
+        if re.search(pattern, q):
+            year = now.year if index + 1 <= now.month else now.year - 1
+            start = datetime(year, index + 1, 1)
+            end = datetime(year + 1, 1, 1) if index == 11 else datetime(year, index + 2, 1)
+            return _window(start.strftime("%B %Y"), start, end)
+    return None
+
+
+def _word_forms(text: str) -> Set[str]:
+    """Lower-case words of text plus naive singulars (groceries -> grocery, bills -> bill)"""
+    words = set(re.findall(r"[a-z0-9']+", text.lower()))
+    forms = set(words)
+    for word in words:
+        if word.endswith("ies") and len(word) > 4:
+            forms.add(word[:-3] + "y")
+        elif word.endswith("s") and len(word) > 3:
+            forms.add(word[:-1])
+    return forms
+
+
+def mentioned_keys(query: str, keys: List[str]) -> List[str]:
+    """Category/merchant names whose significant words appear in the query"""
+    query_words = _word_forms(query)
+    mentioned = []
+    for key in keys:
+        if not key:
+            continue
+        key_words = {w for w in _word_forms(key) if len(w) >= 3 and w not in ("and", "the")}
+        if key_words & query_words:
+            mentioned.append(key)
+    return mentioned
+
+
+def _rupees(amount: float) -> str:
+    return f"₹{amount:,.0f}"
+
+
+class QueryRouter:
+    """Classifies a chat query into structured (aggregates), vector or hybrid retrieval"""
+
+    def classify(self, user_query: str, now: Optional[datetime] = None) -> Dict:
+        q = user_query.lower()
+        window = resolve_time_window(user_query, now)
+
+        intents = []
+        if BUDGET_PATTERN.search(q):
+            intents.append("budget")
+        if INCOME_PATTERN.search(q):
+            intents.append("income")
+        other_topic = OTHER_TOPIC_PATTERN.search(q)
+        if SPENDING_PATTERN.search(q) or BREAKDOWN_PATTERN.search(q) \
+                or (not other_topic and not intents and (re.search(r"\bhow much\b", q) or window)):
+            intents.append("spending")
+
+        if not intents:
+            route = "vector"
+        elif OPEN_ENDED_PATTERN.search(q):
+            route = "hybrid"
+        else:
+            route = "structured"
+
+        return {"route": route, "intents": intents, "window": window}
+
+
+class AggregationTools:
+    """Exact answers for numeric questions, computed from the spending rollups"""
+
+    def __init__(self, rollups: SpendingRollups):
+        self.rollups = rollups
+
+    async def spending_summary(self, user_id: str, query: str, window: Optional[Dict] = None) -> List[str]:
+        """Expense total for the window, narrowed to any category/merchant the query names"""
+        window = window or _window("this month", month_floor(datetime.utcnow()), None)
+        by_category, by_merchant = await asyncio.gather(
+            self.rollups.totals_by(user_id, window["start"], window["end"], "category"),
+            self.rollups.totals_by(user_id, window["start"], window["end"], "merchant")
+        )
+        total = sum(item["total"] for item in by_category.values())
+        count = sum(item["count"] for item in by_category.values())
+
+        lines = [f"Spending ({window['label']}): {_rupees(total)} across {count} transactions"]
+
+        categories = mentioned_keys(query, list(by_category))
+        merchants = mentioned_keys(query, list(by_merchant))
+        for category in categories:
+            item = by_category[category]
+            share = (item["total"] / total * 100) if total else 0
+            lines.append(f"{category} ({window['label']}): {_rupees(item['total'])} "
+                         f"across {item['count']} transactions ({share:.0f}% of spending)")
+        for merchant in merchants:
+            item = by_merchant[merchant]
+            lines.append(f"{merchant} ({window['label']}): {_rupees(item['total'])} across {item['count']} transactions")
+
+        if not categories and not merchants:
+            top_categories = sorted(by_category.items(), key=lambda x: x[1]["total"], reverse=True)[:5]
+            if top_categories:
+                lines.append("Top categories: " + ", ".join(
+                    f"{category} {_rupees(item['total'])}" for category, item in top_categories
+                ))
+            top_merchants = sorted(by_merchant.items(), key=lambda x: x[1]["total"], reverse=True)[:3]
+            if top_merchants:
+                lines.append("Top merchants: " + ", ".join(
+                    f"{merchant} {_rupees(item['total'])}" for merchant, item in top_merchants
+                ))
+        return lines
+
+    async def income_summary(self, user_id: str, window: Optional[Dict] = None) -> List[str]:
+        """Income vs expenses and net savings for the window"""
+        window = window or _window("this month", month_floor(datetime.utcnow()), None)
+        totals = await self.rollups.totals_by(
+            user_id, window["start"], window["end"], "transaction_type", transaction_type=None
+        )
+        income = totals.get("income", {}).get("total", 0)
+        expense = totals.get("expense", {}).get("total", 0)
+        lines = [
+            f"Income ({window['label']}): {_rupees(income)}",
+            f"Expenses ({window['label']}): {_rupees(expense)}",
+            f"Net savings ({window['label']}): {_rupees(income - expense)}"
+        ]
+        if income:
+            lines.append(f"Savings rate: {(income - expense) / income * 100:.0f}%")
+        return lines
+
+    async def budget_status(self, user_id: str, budget: float = DEFAULT_MONTHLY_BUDGET) -> List[str]:
+        """This month's expenses against the monthly budget"""
+        now = datetime.utcnow()
+        totals = await self.rollups.totals_by(user_id, month_floor(now), None, None)
+        spent = totals.get(None, {}).get("total", 0)
+        return [
+            f"This Month Spending: {_rupees(spent)}",
+            f"Monthly Budget: {_rupees(budget)}",
+            f"Budget Used: {spent / budget * 100:.0f}%",
+            f"Remaining: {_rupees(budget - spent)} with {self._days_left(now)} days left in the month"
+        ]
+
+    @staticmethod
+    def _days_left(now: datetime) -> int:
+        next_month = month_floor(month_floor(now) + timedelta(days=32))
+        return (next_month - day_floor(now)).days
+
+    async def run(self, user_id: str, user_query: str, route: Dict) -> List[str]:
+        """Facts for every structured intent the router found"""
+        tasks = []
+        for intent in route["intents"]:
+            if intent == "spending":
+                tasks.append(self.spending_summary(user_id, user_query, route["window"]))
+            elif intent == "income":
+                tasks.append(self.income_summary(user_id, route["window"]))
+            elif intent == "budget":
+                tasks.append(self.budget_status(user_id))
+        lines = []
+        for result in await asyncio.gather(*tasks):
+            lines.extend(result)
+        return lines
+
+
 class RAGService:
     """Service for intelligent context retrieval from vector database"""
     
-    def __init__(self, embedder_agent: EmbedderAgent):
+    def __init__(
+        self,
+        embedder_agent: EmbedderAgent,
+        max_workers: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+        tools: Optional[AggregationTools] = None,
+        packer: Optional[ContextPacker] = None
+    ):
         self.embedder = embedder_agent
+        self.tools = tools
+        self.router = QueryRouter()
+        self.route_counts = {"structured": 0, "vector": 0, "hybrid": 0}
+        self.packer = packer or ContextPacker()
+        self.max_workers = max_workers or RAG_MAX_WORKERS
+        self.max_concurrency = max_concurrency or RAG_MAX_CONCURRENCY
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix="rag"
+        )
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+    
+    async def run_blocking(self, func, *args, **kwargs):
+        """Run a synchronous embedding/vector DB call on the RAG thread pool"""
+        async with self.semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+    
+    def close(self):
+        """Shut down the RAG thread pool"""
+        self.executor.shutdown(wait=False)
     
     def expand_query(self, user_query: str) -> List[str]:
         """
@@ -30,59 +350,32 @@ class RAGService:
         ]
         """
         queries = [user_query]  # Always include original query
+        query_lower = user_query.lower()
         
-        # Financial affordability queries
-        if any(word in user_query.lower() for word in ['afford', 'buy', 'purchase', 'can i']):
-            queries.extend([
-                "current account balance",
-                "monthly budget and spending",
-                "upcoming bills and payments",
-                "recent expenses"
-            ])
-        
-        # Goal-related queries
-        if any(word in user_query.lower() for word in ['goal', 'save', 'saving', 'target']):
-            queries.append("financial goals and savings")
-        
-        # Trip/Travel queries
-        if any(word in user_query.lower() for word in ['trip', 'travel', 'vacation', 'goa', 'holiday']):
-            queries.extend([
-                "travel goals",
-                "travel expenses",
-                "entertainment spending"
-            ])
-        
-        # Spending analysis queries
-        if any(word in user_query.lower() for word in ['spend', 'spent', 'spending', 'expenses']):
-            queries.extend([
-                "recent transactions",
-                "spending by category",
-                "monthly expenses"
-            ])
-        
-        # Investment queries
-        if any(word in user_query.lower() for word in ['invest', 'portfolio', 'stocks', 'mutual fund', 'sip']):
-            queries.extend([
-                "investment holdings",
-                "mutual funds portfolio",
-                "SIP investments"
-            ])
-        
-        # Budget queries
-        if any(word in user_query.lower() for word in ['budget', 'monthly']):
-            queries.extend([
-                "monthly budget",
-                "spending limits",
-                "budget status"
-            ])
+        for keywords, phrases in QUERY_EXPANSION_RULES:
+            if any(word in query_lower for word in keywords):
+                queries.extend(phrases)
         
         return queries
     
+    def expand_queries(self, user_query: str) -> List[str]:
+        """expand_query without duplicates, in the order they are encoded and searched"""
+        return list(dict.fromkeys(self.expand_query(user_query)))
+    
+    @staticmethod
+    def all_expansion_phrases() -> List[str]:
+        """Every fixed phrase expand_query can emit, used to pre-warm the embedding cache"""
+        phrases = []
+        for _, rule_phrases in QUERY_EXPANSION_RULES:
+            phrases.extend(rule_phrases)
+        return list(dict.fromkeys(phrases))
+    
     def fetch_relevant_chunks(
         self, 
         user_id: str, 
         user_query: str, 
-        max_chunks: int = 15
+        max_chunks: int = 15,
+        query_embeddings: Optional[List[List[float]]] = None
     ) -> List[Dict]:
         """
         Fetch relevant chunks from vector database using intelligent query expansion
@@ -91,66 +384,67 @@ class RAGService:
             user_id: User ID to filter chunks
             user_query: Original user query
             max_chunks: Maximum number of chunks to return
+            query_embeddings: Embeddings of expand_queries(user_query), if already encoded
         
         Returns:
             List of relevant chunks with metadata
         """
         try:
             # Expand query for comprehensive retrieval
-            queries = self.expand_query(user_query)
+            queries = self.expand_queries(user_query)
             logger.info(f"Expanded query into {len(queries)} search queries")
             
-            all_chunks = []
-            seen_ids = set()
-            
-            # Search for each expanded query
-            for query in queries:
-                try:
-                    # Generate query embedding
-                    embedding_result = self.embedder.model.encode([query])[0]
-                    # Handle both numpy arrays and lists
-                    query_embedding = embedding_result.tolist() if hasattr(embedding_result, 'tolist') else embedding_result
-                    
-                    # Search vector database with user filter
-                    results = self.embedder.collection.query(
-                        query_embeddings=[query_embedding],
-                        n_results=3,  # Top 3 per query
-                        where={"user_id": user_id}
-                    )
-                    
-                    # Process results
-                    if results and results["ids"] and len(results["ids"][0]) > 0:
-                        for i in range(len(results["ids"][0])):
-                            chunk_id = results["ids"][0][i]
-                            
-                            # Avoid duplicates
-                            if chunk_id in seen_ids:
-                                continue
-                            
-                            seen_ids.add(chunk_id)
-                            all_chunks.append({
-                                "id": chunk_id,
-                                "text": results["documents"][0][i],
-                                "metadata": results["metadatas"][0][i],
-                                "distance": results["distances"][0][i],
-                                "query": query
-                            })
-                
-                except Exception as e:
-                    logger.warning(f"Error searching for query '{query}': {str(e)}")
-                    continue
+            if query_embeddings is None:
+                # One batched forward pass for every expanded query not already cached
+                query_embeddings = self.embedder.query_model.encode(queries)
             
-            # Sort by relevance (distance) and limit
-            all_chunks.sort(key=lambda x: x["distance"])
-            relevant_chunks = all_chunks[:max_chunks]
+            # One multi-embedding vector search over the user's vectors
+            results = self.embedder.store.query(
+                query_embeddings,
+                n_results=3,  # Top 3 per query
+                user_id=user_id
+            )
             
-            logger.info(f"Retrieved {len(relevant_chunks)} relevant chunks for user query")
-            return relevant_chunks
+            return self.merge_query_results(queries, results, max_chunks)
         
         except Exception as e:
             logger.error(f"Error fetching relevant chunks: {str(e)}")
             return []
     
+    def merge_query_results(self, queries: List[str], results: Dict, max_chunks: int) -> List[Dict]:
+        """
+        Merge per-query result lists from a batched vector search
+        
+        A chunk matched by several queries is kept once, with its best distance
+        and the query that produced it.
+        """
+        best_chunks: Dict[str, Dict] = {}
+        
+        if results and results["ids"]:
+            for query_idx, chunk_ids in enumerate(results["ids"]):
+                for i, chunk_id in enumerate(chunk_ids):
+                    distance = results["distances"][query_idx][i]
+                    
+                    # Avoid duplicates, keeping the closest match
+                    existing = best_chunks.get(chunk_id)
+                    if existing and existing["distance"] <= distance:
+                        continue
+                    
+                    best_chunks[chunk_id] = {
+                        "id": chunk_id,
+                        "text": results["documents"][query_idx][i],
+                        "metadata": results["metadatas"][query_idx][i],
+                        "distance": distance,
+                        "query": queries[query_idx]
+                    }
+        
+        # Sort by relevance (distance) and limit
+        all_chunks = sorted(best_chunks.values(), key=lambda x: x["distance"])
+        relevant_chunks = all_chunks[:max_chunks]
+        
+        logger.info(f"Retrieved {len(relevant_chunks)} relevant chunks for user query")
+        return relevant_chunks
+    
     def group_chunks_by_type(self, chunks: List[Dict]) -> Dict[str, List[Dict]]:
         """Group chunks by their type for better organization"""
         grouped = {
@@ -180,11 +474,12 @@ class RAGService:
         # Remove empty categories
         return {k: v for k, v in grouped.items() if v}
     
-    def format_context_for_llm(self, chunks: List[Dict]) -> str:
+    def format_context_for_llm(self, chunks: List[Dict], token_budget: Optional[int] = None) -> str:
         """
         Format retrieved chunks into a readable context string for LLM
         
-        Returns formatted string with sections for different data types
+        Returns formatted string with sections for different data types,
+        packed under the token budget by the context packer
         """
         if not chunks:
             return "No additional context available from user's financial data."
@@ -192,60 +487,32 @@ class RAGService:
         # Group chunks by type
         grouped = self.group_chunks_by_type(chunks)
         
-        context_parts = []
-        context_parts.append("=== RETRIEVED USER CONTEXT ===\n")
-        
-        # Profile information
-        if "profile" in grouped:
-            context_parts.append("USER PROFILE:")
-            for chunk in grouped["profile"]:
-                context_parts.append(f"- {chunk['text']}")
-            context_parts.append("")
-        
-        # Account balance
-        if "account" in grouped:
-            context_parts.append("ACCOUNT INFORMATION:")
-            for chunk in grouped["account"]:
-                context_parts.append(f"- {chunk['text']}")
-            context_parts.append("")
-        
-        # Goals
-        if "goals" in grouped:
-            context_parts.append("FINANCIAL GOALS:")
-            for chunk in grouped["goals"]:
-                context_parts.append(f"- {chunk['text']}")
-            context_parts.append("")
-        
-        # Transactions
-        if "transactions" in grouped:
-            context_parts.append("RECENT TRANSACTIONS:")
-            # Limit to top 10 most relevant transactions
-            for chunk in grouped["transactions"][:10]:
-                context_parts.append(f"- {chunk['text']}")
-            context_parts.append("")
-        
-        # Investments
-        if "investments" in grouped:
-            context_parts.append("INVESTMENT PORTFOLIO:")
-            for chunk in grouped["investments"]:
-                context_parts.append(f"- {chunk['text']}")
-            context_parts.append("")
-        
-        # Other relevant data
-        if "other" in grouped:
-            context_parts.append("OTHER RELEVANT INFORMATION:")
-            for chunk in grouped["other"]:
-                context_parts.append(f"- {chunk['text']}")
-            context_parts.append("")
-        
-        context_parts.append("=== END OF RETRIEVED CONTEXT ===\n")
-        
-        return "\n".join(context_parts)
+        context, _ = self.packer.pack(grouped, token_budget)
+        return context
+    
+    def format_structured_context(self, facts: List[str], label: str = "EXACT FIGURES") -> str:
+        """Aggregation results as a context block; figures are exact, not retrieved text"""
+        lines = [f"{label} (computed from all of the user's transactions):"]
+        lines.extend(f"- {fact}" for fact in facts)
+        lines.append("")
+        return "\n".join(lines)
     
-    def get_rag_context(self, user_id: str, user_query: str) -> str:
+    def classify(self, user_query: str) -> Dict:
+        """Route get_rag_context will take for a query (always vector without aggregation tools)"""
+        return self.router.classify(user_query) if self.tools else {"route": "vector", "intents": []}
+    
+    async def get_rag_context(self, user_id: str, user_query: str) -> str:
         """
         Main method: Get RAG context for a user query
         
+        The query router answers numeric/time-window questions from the
+        aggregation tools and skips vector search for them entirely;
+        open-ended questions use vector search, and questions mixing both
+        get the vector context plus the exact figures. Query encoding goes
+        through the embedder's micro-batcher, so concurrent chats share one
+        forward pass; vector search runs on the RAG thread pool, so the event
+        loop keeps serving other requests while context is retrieved.
+        
         Args:
             user_id: User ID
             user_query: User's question
@@ -253,8 +520,55 @@ class RAGService:
         Returns:
             Formatted context string ready to be added to LLM prompt
         """
+        route = self.classify(user_query)
+        self.route_counts[route["route"]] += 1
+        logger.info(f"Routing query as {route['route']} (intents: {route['intents']})")
+        
+        facts = []
+        if route["route"] != "vector":
+            try:
+                facts = await self.tools.run(user_id, user_query, route)
+            except Exception as e:
+                logger.warning(f"Aggregation tools failed, using vector search only: {str(e)}")
+        
+        if route["route"] == "structured" and facts:
+            return self.with_structured_context("", facts)
+        
+        try:
+            query_embeddings = await self.embedder.query_model.encode_async(self.expand_queries(user_query))
+        except Exception as e:
+            logger.error(f"Error encoding queries: {str(e)}")
+            return self.with_structured_context(self.format_context_for_llm([]), facts)
+        
+        context = await self.run_blocking(self.get_rag_context_sync, user_id, user_query, query_embeddings)
+        return self.with_structured_context(context, facts)
+    
+    def with_structured_context(self, context: str, facts: List[str]) -> str:
+        """Add the exact figures inside the retrieved-context section (they replace it if it is empty)"""
+        if not facts:
+            return context
+        structured = self.format_structured_context(facts)
+        if context.endswith(CONTEXT_FOOTER):
+            return context[:-len(CONTEXT_FOOTER)] + structured + "\n" + CONTEXT_FOOTER
+        return "\n".join([CONTEXT_HEADER, structured, CONTEXT_FOOTER])
+    
+    def get_routing_stats(self) -> Dict:
+        """How many queries each retrieval route has served"""
+        return dict(self.route_counts)
+    
+    def get_packing_stats(self) -> Dict:
+        """Chunks and tokens kept by the context packer, and tokens saved"""
+        return self.packer.get_stats()
+    
+    def get_rag_context_sync(
+        self,
+        user_id: str,
+        user_query: str,
+        query_embeddings: Optional[List[List[float]]] = None
+    ) -> str:
+        """Blocking version of get_rag_context, for scripts and worker threads"""
         # Fetch relevant chunks
-        chunks = self.fetch_relevant_chunks(user_id, user_query, max_chunks=15)
+        chunks = self.fetch_relevant_chunks(user_id, user_query, max_chunks=15, query_embeddings=query_embeddings)
         
         # Format for LLM
         context = self.format_context_for_llm(chunks)
@@ -0,0 +1,260 @@
+"""
+Recommendation Service
+Investment recommendations that never wait on the LLM
+
+Rule-based recommendations are computed on every request. AI recommendations
+are served from a per-user cache keyed by a hash of the portfolio composition
+(what is held and how much, not today's prices); a miss or an expired entry
+schedules a background refresh and the request returns without them.
+Refreshes are single-flight per user and bounded by a concurrency limit.
+"""
+import os
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from typing import Dict, List
+
+from llm_gateway import LLMGateway
+
+logger = logging.getLogger(__name__)
+
+# How long AI recommendations stay fresh for an unchanged portfolio
+RECOMMENDATION_AI_TTL_SECONDS = float(os.environ.get("RECOMMENDATION_AI_TTL_SECONDS", "21600"))
+# Back-off before retrying a user whose last refresh failed
+RECOMMENDATION_AI_RETRY_SECONDS = float(os.environ.get("RECOMMENDATION_AI_RETRY_SECONDS", "60"))
+# Background refreshes allowed in flight at once, so they never take over the gateway's slots
+RECOMMENDATION_AI_CONCURRENCY = int(os.environ.get("RECOMMENDATION_AI_CONCURRENCY", "2"))
+RECOMMENDATION_CACHE_MAX_USERS = int(os.environ.get("RECOMMENDATION_CACHE_MAX_USERS", "10000"))
+
+
+def portfolio_fingerprint(holdings: List[Dict], mutual_funds: List[Dict], other_investments: List[Dict]) -> str:
+    """Hash of what the user holds; price moves alone don't change it"""
+    composition = sorted(
+        [("equity", h.get("tradingsymbol"), h.get("quantity")) for h in holdings]
+        + [("mf", m.get("tradingsymbol"), m.get("quantity")) for m in mutual_funds]
+        + [("other", i.get("type"), i.get("name"), i.get("amount_invested")) for i in other_investments],
+        key=repr
+    )
+    return hashlib.sha256(repr(composition).encode("utf-8")).hexdigest()[:32]
+
+
+def summarize_portfolio(holdings: List[Dict], mutual_funds: List[Dict], other_investments: List[Dict]) -> Dict:
+    """Totals and allocation percentages used by both the rules and the LLM prompt"""
+    total_equity = sum(h["last_price"] * h["quantity"] for h in holdings)
+    total_mf = sum(m["last_price"] * m["quantity"] for m in mutual_funds)
+    total_other = sum(i["current_value"] for i in other_investments)
+    total_portfolio = total_equity + total_mf + total_other
+
+    return {
+        "total_value": total_portfolio,
+        "total_equity": total_equity,
+        "equity_pct": (total_equity / total_portfolio * 100) if total_portfolio > 0 else 0,
+        "mf_pct": (total_mf / total_portfolio * 100) if total_portfolio > 0 else 0,
+        "other_pct": (total_other / total_portfolio * 100) if total_portfolio > 0 else 0,
+        "crypto_invested": sum(i["current_value"] for i in other_investments if i["type"] == "crypto"),
+        "gold_invested": sum(i["current_value"] for i in other_investments if "gold" in i["name"].lower()),
+        "holdings_count": len(holdings),
+        "age_group": "25-30",  # Mock data
+    }
+
+
+def rule_based_recommendations(summary: Dict) -> List[Dict]:
+    """Deterministic recommendations from allocation gaps"""
+    rule_based = []
+    total_portfolio = summary["total_value"]
+
+    # Check for missing asset classes
+    crypto_invested = summary["crypto_invested"]
+    if crypto_invested == 0 or crypto_invested < total_portfolio * 0.05:
+        rule_based.append({
+            "type": "rule",
+            "title": "Consider Crypto Allocation",
+            "description": "Allocate 5-10% to crypto for portfolio diversification",
+            "asset_class": "Cryptocurrency",
+            "priority": 3,
+            "reasoning": "You have minimal/no crypto exposure. Consider starting small."
+        })
+
+    if summary["gold_invested"] == 0:
+        rule_based.append({
+            "type": "rule",
+            "title": "Add Gold to Portfolio",
+            "description": "Invest in Gold ETF or Sovereign Gold Bonds",
+            "asset_class": "Gold",
+            "priority": 4,
+            "reasoning": "Gold provides hedge against inflation and market volatility."
+        })
+
+    # Check equity concentration
+    if summary["total_equity"] > total_portfolio * 0.7:
+        rule_based.append({
+            "type": "rule",
+            "title": "High Equity Concentration",
+            "description": "Consider adding debt/fixed income for stability",
+            "asset_class": "Debt",
+            "priority": 5,
+            "reasoning": "Your portfolio has >70% equity exposure, increasing risk."
+        })
+
+    return rule_based
+
+
+def parse_ai_recommendations(response: str) -> List[Dict]:
+    """LLM reply -> recommendation dicts, falling back to one summary card"""
+    try:
+        ai_recommendations = json.loads(response)
+        return [{**rec, "type": "ai"} for rec in ai_recommendations]
+    except Exception:
+        # If JSON parsing fails, create a default AI recommendation
+        return [{
+            "type": "ai",
+            "title": "Portfolio Review",
+            "description": response[:150] + "...",
+            "asset_class": "General",
+            "priority": 8,
+            "reasoning": "AI-powered analysis"
+        }]
+
+
+class RecommendationService:
+    """Rule-based recommendations inline, AI recommendations from a background-refreshed cache"""
+
+    def __init__(
+        self,
+        db,
+        llm_gateway: LLMGateway,
+        ttl_seconds: float = RECOMMENDATION_AI_TTL_SECONDS,
+        retry_seconds: float = RECOMMENDATION_AI_RETRY_SECONDS,
+        max_concurrency: int = RECOMMENDATION_AI_CONCURRENCY,
+        max_users: int = RECOMMENDATION_CACHE_MAX_USERS
+    ):
+        self.db = db
+        self.llm = llm_gateway
+        self.ttl_seconds = ttl_seconds
+        self.retry_seconds = retry_seconds
+        self.max_users = max_users
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+        # user_id -> {"fingerprint", "expires_at", "recommendations"}
+        self._cache: Dict[str, Dict] = {}
+        # user_id -> running refresh task (single-flight)
+        self._refreshing: Dict[str, asyncio.Task] = {}
+
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "refresh_failures": 0}
+
+    async def load_portfolio(self, user_id: str):
+        holdings, mutual_funds, other_investments = await asyncio.gather(
+            self.db.investment_holdings.find({"user_id": user_id}).to_list(100),
+            self.db.mutual_funds.find({"user_id": user_id}).to_list(100),
+            self.db.other_investments.find({"user_id": user_id}).to_list(100)
+        )
+        return holdings, mutual_funds, other_investments
+
+    async def get_recommendations(self, user_id: str, limit: int = 5) -> List[Dict]:
+        """Top recommendations right now; AI ones only if already cached for this portfolio"""
+        holdings, mutual_funds, other_investments = await self.load_portfolio(user_id)
+        summary = summarize_portfolio(holdings, mutual_funds, other_investments)
+        fingerprint = portfolio_fingerprint(holdings, mutual_funds, other_investments)
+
+        ai_recommendations = self.cached_ai_recommendations(user_id, fingerprint, summary)
+
+        # Merge recommendations (AI gets +2 priority bonus); copies keep the cache untouched
+        recommendations = [
+            {**rec, "priority": rec.get("priority", 0) + 2} for rec in ai_recommendations
+        ] + rule_based_recommendations(summary)
+        recommendations.sort(key=lambda x: x["priority"], reverse=True)
+
+        return recommendations[:limit]
+
+    def cached_ai_recommendations(self, user_id: str, fingerprint: str, summary: Dict) -> List[Dict]:
+        """
+        Cached AI recommendations for this portfolio, scheduling a refresh when needed
+
+        An expired entry for the same portfolio is still served while it refreshes;
+        an entry for a different portfolio is not.
+        """
+        entry = self._cache.get(user_id)
+        if entry and entry["fingerprint"] == fingerprint:
+            if entry["expires_at"] > time.monotonic():
+                self.stats["hits"] += 1
+                return entry["recommendations"]
+            self.stats["stale_hits"] += 1
+            self.schedule_refresh(user_id, fingerprint, summary)
+            return entry["recommendations"]
+
+        self.stats["misses"] += 1
+        self.schedule_refresh(user_id, fingerprint, summary)
+        return []
+
+    def schedule_refresh(self, user_id: str, fingerprint: str, summary: Dict):
+        """Start a background LLM refresh unless one is already running for the user"""
+        if user_id in self._refreshing:
+            return
+        task = asyncio.create_task(self._refresh(user_id, fingerprint, summary))
+        self._refreshing[user_id] = task
+        task.add_done_callback(lambda _: self._refreshing.pop(user_id, None))
+
+    async def _refresh(self, user_id: str, fingerprint: str, summary: Dict):
+        try:
+            async with self.semaphore:
+                # The gateway applies the investment_advisor timeout and raises on failure
+                response = await self.generate_ai_response(user_id, summary)
+            recommendations = parse_ai_recommendations(response)
+            ttl = self.ttl_seconds
+            self.stats["refreshes"] += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"AI recommendation error for user {user_id}: {e}")
+            self.stats["refresh_failures"] += 1
+            # Keep serving the previous recommendations for this portfolio, retry after a back-off
+            previous = self._cache.get(user_id)
+            recommendations = previous["recommendations"] if previous and previous["fingerprint"] == fingerprint else []
+            ttl = self.retry_seconds
+
+        self._cache.pop(user_id, None)
+        self._cache[user_id] = {
+            "fingerprint": fingerprint,
+            "expires_at": time.monotonic() + ttl,
+            "recommendations": recommendations
+        }
+        # Dicts keep insertion order, so the first key is the least recently refreshed user
+        while len(self._cache) > self.max_users:
+            del self._cache[next(iter(self._cache))]
+
+    async def generate_ai_response(self, user_id: str, summary: Dict) -> str:
+        """Ask the LLM for recommendations for a portfolio summary"""
+        prompt = f"""Analyze this investment portfolio and provide recommendations:
+
+            Portfolio Summary:
+            - Total Value: ₹{summary['total_value']:,.2f}
+            - Equity: {summary['equity_pct']:.1f}%
+            - Mutual Funds: {summary['mf_pct']:.1f}%
+            - Other (FD/Bonds/Crypto): {summary['other_pct']:.1f}%
+            - Number of Holdings: {summary['holdings_count']}
+            - Investor Age: {summary['age_group']}
+
+            Provide 2-3 specific recommendations."""
+
+        result = await self.llm.complete(
+            "investment_advisor", prompt, session_id=f"investment_rec_{user_id}"
+        )
+        return result.text
+
+    def invalidate(self, user_id: str):
+        """Forget a user's AI recommendations (e.g. on account deletion)"""
+        self._cache.pop(user_id, None)
+
+    async def close(self):
+        """Cancel refreshes still waiting on the LLM"""
+        for task in list(self._refreshing.values()):
+            task.cancel()
+
+    def get_stats(self) -> Dict:
+        return {
+            "cached_users": len(self._cache),
+            "refreshing": len(self._refreshing),
+            **self.stats
+        }
@@ -0,0 +1,113 @@
+"""
+Response Cache
+Short-TTL, per-user cache for composed read responses (e.g. the home dashboard)
+
+Entries are dropped on write via invalidate(), so the TTL only bounds how
+stale a response can get from writes that bypass the API's write hooks.
+Concurrent misses for the same user share one computation, and a result
+computed while an invalidation happened is returned but never stored.
+"""
+import os
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+DASHBOARD_CACHE_TTL_SECONDS = float(os.environ.get("DASHBOARD_CACHE_TTL_SECONDS", "15"))
+DASHBOARD_CACHE_MAX_USERS = int(os.environ.get("DASHBOARD_CACHE_MAX_USERS", "5000"))
+
+
+class UserResponseCache:
+    """LRU of user_id -> (expires_at, response) with single-flight recomputation"""
+
+    def __init__(self, ttl_seconds: float, max_users: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # Users invalidated while their computation was in flight; never larger than _inflight
+        self._invalidated_inflight: Set[str] = set()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0 and self.max_users > 0
+
+    def get(self, user_id: str) -> Optional[Any]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        expires_at, response = entry
+        if expires_at <= time.monotonic():
+            del self._entries[user_id]
+            return None
+        self._entries.move_to_end(user_id)
+        return response
+
+    def set(self, user_id: str, response: Any):
+        self._entries[user_id] = (time.monotonic() + self.ttl_seconds, response)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_users:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: str):
+        """Drop a user's cached response; called from the write hooks"""
+        if not user_id:
+            return
+        self.invalidations += 1
+        self._entries.pop(user_id, None)
+        if user_id in self._inflight:
+            self._invalidated_inflight.add(user_id)
+
+    async def get_or_compute(self, user_id: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the cached response or build it once, sharing the result with concurrent callers"""
+        if not self.enabled:
+            return await compute()
+
+        cached = self.get(user_id)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+
+        inflight = self._inflight.get(user_id)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[user_id] = future
+        try:
+            response = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so waiter-less failures don't log "exception never retrieved"
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(user_id, None)
+            stale = user_id in self._invalidated_inflight
+            self._invalidated_inflight.discard(user_id)
+
+        future.set_result(response)
+        if not stale:
+            self.set(user_id, response)
+        return response
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations
+        }
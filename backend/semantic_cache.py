@@ -0,0 +1,141 @@
+"""
+Semantic Response Cache
+Serves near-duplicate chat questions without another RAG + LLM round-trip
+
+Each entry maps (query embedding, user data fingerprint) -> parsed chat
+response. A lookup hits when an unexpired entry has the same fingerprint and
+its query embedding is within SEMANTIC_CACHE_THRESHOLD cosine similarity of
+the new question. The fingerprint covers every chunk RAG can retrieve for the
+user, so any change to their data makes older answers unreachable. Only
+vector-routed questions are cached (see probe_semantic_cache in server.py);
+exact figures from the spending rollups are always recomputed.
+"""
+import os
+import logging
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from embedder_service import EmbedderAgent
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_CACHE_ENABLED = os.environ.get("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+# Minimum cosine similarity between questions to reuse an answer
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL_SECONDS = float(os.environ.get("SEMANTIC_CACHE_TTL_SECONDS", "3600"))
+SEMANTIC_CACHE_MAX_ENTRIES_PER_USER = int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES_PER_USER", "32"))
+SEMANTIC_CACHE_MAX_USERS = int(os.environ.get("SEMANTIC_CACHE_MAX_USERS", "2000"))
+
+
+def _normalize(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vector))
+    return [x / norm for x in vector] if norm else list(vector)
+
+
+class SemanticResponseCache:
+    """Per-user LRU of (normalized query embedding, fingerprint, response) entries"""
+
+    def __init__(
+        self,
+        embedder_agent: EmbedderAgent,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        ttl_seconds: float = SEMANTIC_CACHE_TTL_SECONDS,
+        max_entries_per_user: int = SEMANTIC_CACHE_MAX_ENTRIES_PER_USER,
+        max_users: int = SEMANTIC_CACHE_MAX_USERS,
+        enabled: bool = SEMANTIC_CACHE_ENABLED
+    ):
+        self.embedder = embedder_agent
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries_per_user = max_entries_per_user
+        self.max_users = max_users
+        # Whether RAG works is only known once the embedder has loaded; probe() checks it
+        self.enabled = enabled
+
+        # user_id -> [entry], most recently used last; users ordered by last use
+        self._entries: "OrderedDict[str, List[Dict]]" = OrderedDict()
+
+        self.stats = {"lookups": 0, "hits": 0, "misses": 0, "stores": 0, "evictions": 0, "stale_dropped": 0}
+
+    async def probe(self, user_id: str, query: str, run_blocking) -> Optional[Tuple[List[float], str]]:
+        """
+        Embed the question and fingerprint the user's data
+
+        The encode goes through the cached, micro-batched query embedder, so
+        the RAG lookup that follows a miss reuses the vector; the fingerprint
+        (a vector store read) runs via run_blocking.
+        """
+        if not self.enabled or not self.embedder.is_rag_enabled():
+            return None
+        embedding = (await self.embedder.query_model.encode_async([query]))[0]
+        return _normalize(embedding), await run_blocking(self.embedder.user_data_fingerprint, user_id)
+
+    def lookup(self, user_id: str, embedding: List[float], fingerprint: str) -> Optional[Dict]:
+        """Best cached response for a near-duplicate question, or None"""
+        self.stats["lookups"] += 1
+        entries = self._entries.get(user_id)
+        if not entries:
+            self.stats["misses"] += 1
+            return None
+
+        now = time.monotonic()
+        live = [entry for entry in entries if entry["expires_at"] > now and entry["fingerprint"] == fingerprint]
+        self.stats["stale_dropped"] += len(entries) - len(live)
+        best, best_score = None, self.threshold
+        for entry in live:
+            score = sum(a * b for a, b in zip(entry["embedding"], embedding))
+            if score >= best_score:
+                best, best_score = entry, score
+
+        if live:
+            self._entries[user_id] = live
+            self._entries.move_to_end(user_id)
+        else:
+            del self._entries[user_id]
+
+        if best is None:
+            self.stats["misses"] += 1
+            return None
+
+        self.stats["hits"] += 1
+        live.remove(best)
+        live.append(best)
+        logger.info(f"Semantic cache hit for user {user_id} (similarity {best_score:.3f}, cached query: {best['query'][:60]})")
+        return dict(best["response"])
+
+    def store(self, user_id: str, query: str, embedding: List[float], fingerprint: str, response: Dict):
+        """Remember a response for this question and data fingerprint"""
+        entries = self._entries.setdefault(user_id, [])
+        entries.append({
+            "query": query,
+            "embedding": embedding,
+            "fingerprint": fingerprint,
+            "response": dict(response),
+            "expires_at": time.monotonic() + self.ttl_seconds
+        })
+        self._entries.move_to_end(user_id)
+        self.stats["stores"] += 1
+
+        while len(entries) > self.max_entries_per_user:
+            entries.pop(0)
+            self.stats["evictions"] += 1
+        while len(self._entries) > self.max_users:
+            _, evicted = self._entries.popitem(last=False)
+            self.stats["evictions"] += len(evicted)
+
+    def invalidate(self, user_id: str):
+        """Drop every cached answer for a user"""
+        self._entries.pop(user_id, None)
+
+    def get_stats(self) -> Dict:
+        hits, lookups = self.stats["hits"], self.stats["lookups"]
+        return {
+            "enabled": self.enabled and self.embedder.is_loaded() and self.embedder.is_rag_enabled(),
+            "users": len(self._entries),
+            "entries": sum(len(entries) for entries in self._entries.values()),
+            "threshold": self.threshold,
+            **self.stats,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0
+        }
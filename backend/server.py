@@ -1,9 +1,11 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 from bson import ObjectId
 import os
+import asyncio
 import logging
 from pathlib import Path
 from typing import List, Optional
@@ -22,7 +24,13 @@ from mock_data import (
 from mock_investment_data import (
     generate_mock_holdings, generate_mock_mutual_funds, generate_mock_other_investments
 )
-from emergentintegrations.llm.chat import LlmChat, UserMessage
+from spending_rollups import SpendingRollups, to_naive_utc
+from rag_service import RAGService, AggregationTools, resolve_time_window
+from index_manager import bootstrap_indexes, IndexVerificationError
+from response_cache import UserResponseCache, DASHBOARD_CACHE_TTL_SECONDS, DASHBOARD_CACHE_MAX_USERS
+from recommendation_service import RecommendationService
+from chat_streaming import SummaryStreamExtractor, sse_event
+from llm_gateway import LLMGateway, LLMRateLimited
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -32,6 +40,21 @@ mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
+# Materialized per-user daily/monthly spending totals read by the analytics routes
+spending_rollups = SpendingRollups(db)
+
+# Exact spending/income/budget figures for chat context, computed from the rollups
+analytics_tools = AggregationTools(spending_rollups)
+
+# Composed /dashboard responses, invalidated by the write hooks (notify_data_changed)
+dashboard_cache = UserResponseCache(DASHBOARD_CACHE_TTL_SECONDS, DASHBOARD_CACHE_MAX_USERS)
+
+# Every GPT call goes through one gateway: persona configs, pooled HTTP, concurrency/rate limits, metrics
+llm_gateway = LLMGateway()
+
+# Investment recommendations; AI suggestions are cached per portfolio and refreshed off the request path
+recommendation_service = RecommendationService(db, llm_gateway)
+
 # Create the main app without a prefix
 app = FastAPI()
 
@@ -51,6 +74,23 @@ def serialize_doc(doc):
         doc["_id"] = str(doc["_id"])
     return doc
 
+@api_router.on_event("startup")
+async def startup_indexes():
+    """Create the compound indexes hot queries rely on and verify their plans"""
+    try:
+        await spending_rollups.migrate_markers()
+        await bootstrap_indexes(db)
+    except IndexVerificationError:
+        # INDEX_CHECK_MODE=strict: refuse to serve with unindexed hot paths
+        raise
+    except Exception as e:
+        logger.error(f"Error bootstrapping indexes: {e}")
+
+@api_router.on_event("shutdown")
+async def shutdown_rollups():
+    """Cancel spending rollup rebuilds still running in the background"""
+    await spending_rollups.close()
+
 # ============= USER ROUTES =============
 @api_router.get("/")
 async def root():
@@ -84,6 +124,7 @@ async def initialize_user():
             transactions = generate_mock_transactions(user_id, account_id, num_months=3)
             if transactions:
                 await db.transactions.insert_many(transactions)
+                await spending_rollups.record_transactions(transactions)
             
             # Create goals
             goals = generate_mock_goals(user_id)
@@ -114,6 +155,10 @@ async def initialize_user():
             if other_investments:
                 await db.other_investments.insert_many(other_investments)
         
+        notify_data_changed(
+            user_id, "users", "bank_accounts", "transactions", "goals", "insights",
+            "investment_holdings", "mutual_funds", "other_investments"
+        )
         return {"status": "success", "user_id": user_id, "message": "User initialized"}
     except Exception as e:
         logger.error(f"Error initializing user: {e}")
@@ -296,6 +341,8 @@ async def signup(data: dict):
         if insights:
             await db.insights.insert_many(insights)
         
+        notify_data_changed(user_id, "users", "bank_accounts", "goals", "insights")
+        
         # Fetch the created user
         user = await db.users.find_one({"_id": result.inserted_id})
         
@@ -327,6 +374,7 @@ async def disable_account(data: dict):
         
         if result.modified_count == 0:
             raise HTTPException(status_code=404, detail="User not found")
+        dashboard_cache.invalidate(user_id)
         
         return {
             "status": "success",
@@ -352,6 +400,7 @@ async def delete_account(data: dict):
         await db.users.delete_one({"_id": ObjectId(user_id)})
         await db.bank_accounts.delete_many({"user_id": user_id})
         await db.transactions.delete_many({"user_id": user_id})
+        await spending_rollups.clear_user(user_id)
         await db.goals.delete_many({"user_id": user_id})
         await db.insights.delete_many({"user_id": user_id})
         await db.investment_holdings.delete_many({"user_id": user_id})
@@ -363,11 +412,14 @@ async def delete_account(data: dict):
         for conv in conversations:
             await db.chat_messages.delete_many({"conversation_id": str(conv["_id"])})
         await db.chat_conversations.delete_many({"user_id": user_id})
+        dashboard_cache.invalidate(user_id)
+        recommendation_service.invalidate(user_id)
+        if semantic_cache:
+            semantic_cache.invalidate(user_id)
         
         # Clear from vector DB
         try:
-            from embedder_service import embedder_agent
-            embedder_agent.clear_user_data(user_id)
+            await asyncio.to_thread(embedder_agent.clear_user_data, user_id)
             logger.info(f"Cleared vector DB data for user {user_id}")
         except Exception as e:
             logger.error(f"Error clearing vector DB: {e}")
@@ -453,14 +505,233 @@ async def get_account(account_id: str):
     return serialize_doc(account)
 
 # ============= TRANSACTION ROUTES =============
+TRANSACTIONS_PAGE_MAX_LIMIT = int(os.environ.get("TRANSACTIONS_PAGE_MAX_LIMIT", "500"))
+
+def encode_transaction_cursor(txn: dict) -> str:
+    """Opaque cursor for the (date, _id) position just after txn"""
+    import base64
+    import json
+    _id = txn["_id"]
+    position = {
+        "d": txn["date"].isoformat(),
+        "i": str(_id),
+        "o": isinstance(_id, ObjectId)
+    }
+    return base64.urlsafe_b64encode(json.dumps(position, separators=(",", ":")).encode()).decode().rstrip("=")
+
+def decode_transaction_cursor(cursor: str):
+    """(date, _id) from encode_transaction_cursor; raises ValueError if malformed"""
+    import base64
+    import json
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        _id = ObjectId(position["i"]) if position["o"] else position["i"]
+        return datetime.fromisoformat(position["d"]), _id
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+def build_transaction_filter(
+    user_id: str,
+    category: Optional[str] = None,
+    merchant: Optional[str] = None,
+    transaction_type: Optional[str] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None
+) -> dict:
+    """Mongo filter for a user's transactions narrowed by the optional list filters"""
+    query = {"user_id": user_id}
+    if category:
+        query["category"] = category
+    if merchant:
+        query["merchant"] = merchant
+    if transaction_type:
+        query["transaction_type"] = transaction_type
+    if min_amount is not None or max_amount is not None:
+        query["amount"] = {}
+        if min_amount is not None:
+            query["amount"]["$gte"] = min_amount
+        if max_amount is not None:
+            query["amount"]["$lte"] = max_amount
+    return query
+
 @api_router.get("/transactions")
-async def get_transactions(user_id: str, limit: int = 100, offset: int = 0):
-    """Get transactions for a user"""
-    transactions = await db.transactions.find(
-        {"user_id": user_id}
-    ).sort("date", -1).skip(offset).limit(limit).to_list(limit)
+async def get_transactions(
+    user_id: str,
+    limit: int = 100,
+    offset: int = 0,
+    category: Optional[str] = None,
+    merchant: Optional[str] = None,
+    transaction_type: Optional[str] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None
+):
+    """
+    Get transactions for a user, newest first, as a plain list
+    
+    Offset paging skips and discards rows, so deep offsets get slower;
+    /transactions/page pages by cursor instead.
+    """
+    query = build_transaction_filter(user_id, category, merchant, transaction_type, min_amount, max_amount)
+    transactions = await db.transactions.find(query).sort(
+        [("date", -1), ("_id", -1)]
+    ).skip(offset).limit(limit).to_list(limit)
     return [serialize_doc(txn) for txn in transactions]
 
+@api_router.get("/transactions/page")
+async def get_transactions_page(
+    user_id: str,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    category: Optional[str] = None,
+    merchant: Optional[str] = None,
+    transaction_type: Optional[str] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None
+):
+    """
+    Get a page of transactions for a user, newest first
+    
+    Keyset pagination: pass the previous page's next_cursor to continue
+    after its last (date, _id), so every page is an index range scan on
+    (user_id, date, _id) however deep the user has scrolled. next_cursor
+    is None on the last page. Filters are applied server-side.
+    """
+    limit = max(1, min(limit, TRANSACTIONS_PAGE_MAX_LIMIT))
+    query = build_transaction_filter(user_id, category, merchant, transaction_type, min_amount, max_amount)
+    if cursor:
+        try:
+            after_date, after_id = decode_transaction_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        query["$or"] = [
+            {"date": {"$lt": after_date}},
+            {"date": after_date, "_id": {"$lt": after_id}}
+        ]
+    
+    # One extra row tells whether another page exists
+    transactions = await db.transactions.find(query).sort(
+        [("date", -1), ("_id", -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+    
+    next_cursor = None
+    if len(transactions) > limit:
+        transactions = transactions[:limit]
+        next_cursor = encode_transaction_cursor(transactions[-1])
+    return {
+        "transactions": [serialize_doc(txn) for txn in transactions],
+        "next_cursor": next_cursor
+    }
+
+TRANSACTIONS_EXPORT_BATCH_SIZE = int(os.environ.get("TRANSACTIONS_EXPORT_BATCH_SIZE", "1000"))
+TRANSACTIONS_EXPORT_MAX_BATCH_SIZE = 10000
+TRANSACTIONS_EXPORT_CSV_FIELDS = [
+    "_id", "date", "account_id", "amount", "category", "merchant",
+    "description", "transaction_type", "payment_mode", "created_at"
+]
+
+def export_value(value):
+    """JSON/CSV-safe form of a transaction field"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    return value
+
+@api_router.get("/transactions/export")
+async def export_transactions(
+    user_id: str,
+    format: str = "ndjson",
+    batch_size: int = TRANSACTIONS_EXPORT_BATCH_SIZE,
+    category: Optional[str] = None,
+    merchant: Optional[str] = None,
+    transaction_type: Optional[str] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None
+):
+    """
+    Stream a user's full transaction history as NDJSON or CSV, newest first
+    
+    Rows go straight from the Motor cursor to the response: batch_size
+    documents are fetched per round trip and written out as one chunk, so
+    memory stays constant however many rows the user has. Accepts the same
+    filters as GET /transactions.
+    """
+    import csv
+    import io
+    import json
+    
+    export_format = format.lower()
+    if export_format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'csv'")
+    batch_size = max(1, min(batch_size, TRANSACTIONS_EXPORT_MAX_BATCH_SIZE))
+    query = build_transaction_filter(user_id, category, merchant, transaction_type, min_amount, max_amount)
+    
+    async def rows():
+        cursor = db.transactions.find(query).sort([("date", -1), ("_id", -1)]).batch_size(batch_size)
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=TRANSACTIONS_EXPORT_CSV_FIELDS, extrasaction="ignore")
+        if export_format == "csv":
+            writer.writeheader()
+        pending = 0
+        exported = 0
+        try:
+            async for txn in cursor:
+                record = {key: export_value(value) for key, value in txn.items()}
+                if export_format == "csv":
+                    writer.writerow(record)
+                else:
+                    buffer.write(json.dumps(record, default=str))
+                    buffer.write("\n")
+                pending += 1
+                if pending >= batch_size:
+                    exported += pending
+                    pending = 0
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            exported += pending
+            if buffer.tell():
+                yield buffer.getvalue()
+            logger.info(f"Exported {exported} transactions for user {user_id} as {export_format}")
+        except Exception as e:
+            # Headers are already sent; aborting the body tells the client the file is incomplete
+            logger.error(f"Error exporting transactions: {str(e)}")
+            raise
+        finally:
+            await cursor.close()
+    
+    media_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    filename = f"transactions-{user_id}.{export_format}"
+    return StreamingResponse(
+        rows(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "X-Accel-Buffering": "no"}
+    )
+
+def resolve_analytics_range(
+    months: int,
+    month: Optional[int],
+    year: Optional[int],
+    start_date_str: Optional[str],
+    end_date_str: Optional[str]
+):
+    """Resolve analytics query params into a [start, end) range of naive UTC datetimes; end None = open-ended"""
+    # If start and end date strings provided (for daily/weekly filtering); "Z"/offsets become naive UTC
+    if start_date_str and end_date_str:
+        return (
+            to_naive_utc(datetime.fromisoformat(start_date_str)),
+            to_naive_utc(datetime.fromisoformat(end_date_str))
+        )
+    # If specific month and year provided, filter for that month only
+    if month and year:
+        start_date = datetime(year, month, 1)
+        if month == 12:
+            end_date = datetime(year + 1, 1, 1)
+        else:
+            end_date = datetime(year, month + 1, 1)
+        return start_date, end_date
+    return datetime.utcnow() - timedelta(days=30 * months), None
+
 @api_router.get("/transactions/category-breakdown")
 async def get_category_breakdown(
     user_id: str, 
@@ -471,47 +742,18 @@ async def get_category_breakdown(
     end_date_str: Optional[str] = None
 ):
     """Get spending breakdown by category"""
-    # If start and end date strings provided (for daily/weekly filtering)
-    if start_date_str and end_date_str:
-        start_date = datetime.fromisoformat(start_date_str)
-        end_date = datetime.fromisoformat(end_date_str)
-        match_query = {
-            "user_id": user_id,
-            "transaction_type": "expense",
-            "date": {"$gte": start_date, "$lt": end_date}
-        }
-    # If specific month and year provided, filter for that month only
-    elif month and year:
-        start_date = datetime(year, month, 1)
-        if month == 12:
-            end_date = datetime(year + 1, 1, 1)
-        else:
-            end_date = datetime(year, month + 1, 1)
-        match_query = {
-            "user_id": user_id,
-            "transaction_type": "expense",
-            "date": {"$gte": start_date, "$lt": end_date}
-        }
-    else:
-        start_date = datetime.utcnow() - timedelta(days=30 * months)
-        match_query = {
-            "user_id": user_id,
-            "transaction_type": "expense",
-            "date": {"$gte": start_date}
-        }
+    start_date, end_date = resolve_analytics_range(
+        months, month, year, start_date_str, end_date_str
+    )
     
-    pipeline = [
-        {"$match": match_query},
-        {"$group": {
-            "_id": "$category",
-            "total": {"$sum": "$amount"},
-            "count": {"$sum": 1}
-        }},
-        {"$sort": {"total": -1}}
-    ]
+    totals = await spending_rollups.totals_by(user_id, start_date, end_date, "category")
     
-    results = await db.transactions.aggregate(pipeline).to_list(100)
-    return results
+    results = [
+        {"_id": category, "total": item["total"], "count": item["count"]}
+        for category, item in totals.items()
+    ]
+    results.sort(key=lambda x: x["total"], reverse=True)
+    return results[:100]
 
 @api_router.get("/transactions/merchant-leaderboard")
 async def get_merchant_leaderboard(
@@ -523,245 +765,207 @@ async def get_merchant_leaderboard(
     end_date_str: Optional[str] = None
 ):
     """Get top merchants by spending"""
-    # If start and end date strings provided (for daily/weekly filtering)
-    if start_date_str and end_date_str:
-        start_date = datetime.fromisoformat(start_date_str)
-        end_date = datetime.fromisoformat(end_date_str)
-        match_query = {
-            "user_id": user_id,
-            "transaction_type": "expense",
-            "date": {"$gte": start_date, "$lt": end_date}
-        }
-    # If specific month and year provided, filter for that month only
-    elif month and year:
-        start_date = datetime(year, month, 1)
-        if month == 12:
-            end_date = datetime(year + 1, 1, 1)
-        else:
-            end_date = datetime(year, month + 1, 1)
-        match_query = {
-            "user_id": user_id,
-            "transaction_type": "expense",
-            "date": {"$gte": start_date, "$lt": end_date}
-        }
-    else:
-        start_date = datetime.utcnow() - timedelta(days=30)
-        match_query = {
-            "user_id": user_id,
-            "transaction_type": "expense",
-            "date": {"$gte": start_date}
-        }
+    start_date, end_date = resolve_analytics_range(
+        1, month, year, start_date_str, end_date_str
+    )
     
-    pipeline = [
-        {"$match": match_query},
-        {"$group": {
-            "_id": "$merchant",
-            "total": {"$sum": "$amount"},
-            "count": {"$sum": 1},
-            "category": {"$first": "$category"}
-        }},
-        {"$sort": {"total": -1}},
-        {"$limit": limit}
-    ]
+    totals = await spending_rollups.totals_by(user_id, start_date, end_date, "merchant")
     
-    results = await db.transactions.aggregate(pipeline).to_list(limit)
-    return results
+    results = [
+        {"_id": merchant, "total": item["total"], "count": item["count"], "category": item["category"]}
+        for merchant, item in totals.items()
+    ]
+    results.sort(key=lambda x: x["total"], reverse=True)
+    return results[:limit]
 
-@api_router.get("/analytics/monthly-spending")
-async def get_monthly_spending(user_id: str, months: int = 6):
-    """Get monthly spending aggregation"""
+@api_router.get("/analytics/income-expense")
+async def get_income_expense_split(user_id: str, months: int = 1):
+    """Get income vs expense totals for the last N months"""
     start_date = datetime.utcnow() - timedelta(days=30 * months)
+    totals = await spending_rollups.totals_by(
+        user_id, start_date, None, "transaction_type", transaction_type=None
+    )
+    income = totals.get("income", {}).get("total", 0)
+    expense = totals.get("expense", {}).get("total", 0)
+    return {
+        "income": income,
+        "expense": expense,
+        "net": income - expense,
+        "income_count": totals.get("income", {}).get("count", 0),
+        "expense_count": totals.get("expense", {}).get("count", 0)
+    }
+
+@api_router.post("/analytics/rollups/rebuild")
+async def rebuild_spending_rollups(user_id: Optional[str] = None):
+    """Backfill spending rollups from raw transactions for one user or everyone"""
+    try:
+        if user_id:
+            await spending_rollups.rebuild_user(user_id)
+            return {"status": "success", "users_rebuilt": 1}
+        count = await spending_rollups.rebuild_all()
+        return {"status": "success", "users_rebuilt": count}
+    except Exception as e:
+        logger.error(f"Error rebuilding spending rollups: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+MONTH_NAMES = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+def _add_months(year: int, month: int, count: int):
+    """Return (year, month) shifted forward by count months"""
+    month_index = (year * 12 + month - 1) + count
+    return month_index // 12, month_index % 12 + 1
+
+async def aggregate_expense_buckets(user_id: str, buckets: List[tuple]) -> List[dict]:
+    """
+    Sum a user's expenses into [start, end) date buckets in one pass.
     
-    pipeline = [
-        {"$match": {
-            "user_id": user_id,
-            "transaction_type": "expense",
-            "date": {"$gte": start_date}
-        }},
-        {"$group": {
-            "_id": {
-                "year": {"$year": "$date"},
-                "month": {"$month": "$date"}
-            },
-            "total": {"$sum": "$amount"}
-        }},
-        {"$sort": {"_id.year": 1, "_id.month": 1}}
-    ]
-    
-    results = await db.transactions.aggregate(pipeline).to_list(100)
-    
-    # Format month names
-    month_names = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
-    formatted = []
-    for item in results:
-        month_num = item["_id"]["month"]
-        formatted.append({
-            "month": month_names[month_num - 1],
-            "amount": item["total"],
-            "year": item["_id"]["year"],
-            "month_num": month_num
-        })
+    Whole days come from the daily spending rollups and only partial days at
+    bucket edges are summed from raw transactions (as conditional $sums in a
+    single $group), so a chart costs at most two queries no matter how many
+    bars it has. Buckets may overlap or leave gaps.
     
-    return formatted
+    Returns [{"total": ..., "count": ...}] in the same order as buckets.
+    """
+    return await spending_rollups.bucket_totals(user_id, buckets)
 
-@api_router.get("/analytics/spending-by-period")
-async def get_spending_by_period(user_id: str, period: str = "6mnth"):
-    """Get spending data based on selected time period"""
-    now = datetime.utcnow()
+def build_spending_period_bars(period: str, now: datetime) -> List[tuple]:
+    """
+    Build the chart bars for a spending period.
+    
+    Returns a list of (start, end, fields) tuples where fields is the response
+    item for that bar with its amount still 0. Unknown periods return [].
+    """
+    bars = []
     
     if period == "1wk":
         # Last 7 days (daily breakdown)
-        results = []
         day_names = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
-        
         for i in range(6, -1, -1):
             day_date = now - timedelta(days=i)
             start_of_day = datetime(day_date.year, day_date.month, day_date.day)
-            end_of_day = start_of_day + timedelta(days=1)
-            
-            pipeline = [
-                {"$match": {
-                    "user_id": user_id,
-                    "transaction_type": "expense",
-                    "date": {"$gte": start_of_day, "$lt": end_of_day}
-                }},
-                {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-            ]
-            
-            result = await db.transactions.aggregate(pipeline).to_list(1)
-            amount = result[0]["total"] if result else 0
-            
-            results.append({
+            bars.append((start_of_day, start_of_day + timedelta(days=1), {
                 "month": day_names[day_date.weekday()],
-                "amount": amount,
+                "amount": 0,
                 "date": day_date.strftime("%d %b"),
                 "day": day_date.day,
                 "month_num": day_date.month,
                 "year": day_date.year
-            })
-        
-        return results
+            }))
     
     elif period == "1mnth":
         # Last 5 weeks (weekly breakdown)
-        results = []
-        
         for i in range(4, -1, -1):
             week_start = now - timedelta(days=now.weekday() + (i * 7))
             week_end = week_start + timedelta(days=7)
-            
-            pipeline = [
-                {"$match": {
-                    "user_id": user_id,
-                    "transaction_type": "expense",
-                    "date": {"$gte": week_start, "$lt": week_end}
-                }},
-                {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-            ]
-            
-            result = await db.transactions.aggregate(pipeline).to_list(1)
-            amount = result[0]["total"] if result else 0
-            
-            results.append({
+            bars.append((week_start, week_end, {
                 "month": f"W{5-i}",
-                "amount": amount,
+                "amount": 0,
                 "date": f"{week_start.strftime('%d')}-{week_end.strftime('%d %b')}",
                 "week_num": 5-i,
                 "week_start": week_start.isoformat(),
                 "week_end": week_end.isoformat()
-            })
-        
-        return results
+            }))
     
     elif period == "6mnth":
         # Last 6 months (monthly breakdown)
-        month_names = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
-        results = []
-        
         for i in range(5, -1, -1):
             target_date = now - timedelta(days=30*i)
             start_of_month = datetime(target_date.year, target_date.month, 1)
-            
-            if target_date.month == 12:
-                end_of_month = datetime(target_date.year + 1, 1, 1)
-            else:
-                end_of_month = datetime(target_date.year, target_date.month + 1, 1)
-            
-            pipeline = [
-                {"$match": {
-                    "user_id": user_id,
-                    "transaction_type": "expense",
-                    "date": {"$gte": start_of_month, "$lt": end_of_month}
-                }},
-                {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-            ]
-            
-            result = await db.transactions.aggregate(pipeline).to_list(1)
-            amount = result[0]["total"] if result else 0
-            
-            results.append({
-                "month": month_names[target_date.month - 1],
-                "amount": amount,
+            end_year, end_month = _add_months(target_date.year, target_date.month, 1)
+            bars.append((start_of_month, datetime(end_year, end_month, 1), {
+                "month": MONTH_NAMES[target_date.month - 1],
+                "amount": 0,
                 "year": target_date.year,
                 "month_num": target_date.month
-            })
-        
-        return results
+            }))
     
     elif period == "1yr":
         # Last 12 months in 6 bi-monthly pairs
-        month_names = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
-        results = []
-        
         for i in range(5, -1, -1):
             # Each bar represents 2 months
             target_date = now - timedelta(days=60*i)
             start_month = target_date.month
             start_year = target_date.year
-            
-            # Calculate end month (2 months later)
-            end_month = start_month + 2
-            end_year = start_year
-            if end_month > 12:
-                end_month -= 12
-                end_year += 1
+            end_year, end_month = _add_months(start_year, start_month, 2)
+            _, second_month = _add_months(start_year, start_month, 1)
             
             start_of_period = datetime(start_year, start_month, 1)
             end_of_period = datetime(end_year, end_month, 1)
             
-            pipeline = [
-                {"$match": {
-                    "user_id": user_id,
-                    "transaction_type": "expense",
-                    "date": {"$gte": start_of_period, "$lt": end_of_period}
-                }},
-                {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-            ]
-            
-            result = await db.transactions.aggregate(pipeline).to_list(1)
-            amount = result[0]["total"] if result else 0
-            
-            # Calculate the second month in the pair
-            second_month = start_month + 1
-            if second_month > 12:
-                second_month = 1
-            
             # Format: "Feb-Mar", "Apr-May", etc.
-            label = f"{month_names[start_month-1]}-{month_names[second_month-1]}"
-            
-            results.append({
-                "month": label,
-                "amount": amount,
+            bars.append((start_of_period, end_of_period, {
+                "month": f"{MONTH_NAMES[start_month-1]}-{MONTH_NAMES[second_month-1]}",
+                "amount": 0,
                 "period_start": start_of_period.isoformat(),
                 "period_end": end_of_period.isoformat(),
                 "start_month": start_month,
                 "start_year": start_year
-            })
-        
-        return results
+            }))
+    
+    return bars
+
+@api_router.get("/analytics/monthly-spending")
+async def get_monthly_spending(user_id: str, months: int = 6):
+    """Get monthly spending aggregation"""
+    now = datetime.utcnow()
+    start_date = now - timedelta(days=30 * months)
+    
+    # One bucket per calendar month from start_date through the current month
+    buckets = []
+    year, month = start_date.year, start_date.month
+    while (year, month) <= (now.year, now.month):
+        next_year, next_month = _add_months(year, month, 1)
+        month_start = max(datetime(year, month, 1), start_date)
+        buckets.append((month_start, datetime(next_year, next_month, 1), year, month))
+        year, month = next_year, next_month
+    
+    totals = await aggregate_expense_buckets(
+        user_id, [(bucket_start, bucket_end) for bucket_start, bucket_end, _, _ in buckets]
+    )
+    
+    # Only months with spending are reported, oldest first
+    formatted = []
+    for (_, _, year, month_num), bucket in zip(buckets, totals):
+        if not bucket["count"]:
+            continue
+        formatted.append({
+            "month": MONTH_NAMES[month_num - 1],
+            "amount": bucket["total"],
+            "year": year,
+            "month_num": month_num
+        })
+    
+    return formatted
+
+@api_router.get("/analytics/spending-by-period")
+async def get_spending_by_period(user_id: str, period: str = "6mnth"):
+    """Get spending data based on selected time period"""
+    bars = build_spending_period_bars(period, datetime.utcnow())
+    
+    if not bars:
+        # Default to 6 months
+        return await get_monthly_spending(user_id, 6)
+    
+    totals = await aggregate_expense_buckets(
+        user_id, [(bar_start, bar_end) for bar_start, bar_end, _ in bars]
+    )
     
-    # Default to 6 months
-    return await get_monthly_spending(user_id, 6)
+    results = []
+    for (_, _, fields), bucket in zip(bars, totals):
+        if bucket["count"]:
+            fields["amount"] = bucket["total"]
+        results.append(fields)
+    
+    return results
+
+def cumulative_by_day(by_day: dict, last_day: int) -> dict:
+    """Running total for days 1..last_day of a day-of-month -> amount map"""
+    running = 0
+    cumulative = {}
+    for day in range(1, max([last_day, *by_day]) + 1):
+        running += by_day.get(day, 0)
+        cumulative[day] = running
+    return cumulative
 
 @api_router.get("/analytics/spend-velocity")
 async def get_spend_velocity(user_id: str):
@@ -770,37 +974,33 @@ async def get_spend_velocity(user_id: str):
     current_month_start = datetime(now.year, now.month, 1)
     last_month_start = current_month_start - timedelta(days=30)
     
-    # Current month spending by day
-    current_month = await db.transactions.find({
-        "user_id": user_id,
-        "transaction_type": "expense",
-        "date": {"$gte": current_month_start}
-    }).to_list(1000)
-    
-    # Last month spending by day
-    last_month = await db.transactions.find({
-        "user_id": user_id,
-        "transaction_type": "expense",
-        "date": {"$gte": last_month_start, "$lt": current_month_start}
-    }).to_list(1000)
-    
-    # Aggregate by day
-    current_by_day = {}
-    for txn in current_month:
-        day = txn["date"].day
-        current_by_day[day] = current_by_day.get(day, 0) + txn["amount"]
+    # Spending by day for both months, summed in the database (no document cap)
+    daily = await spending_rollups.daily_totals(user_id, last_month_start)
     
+    current_by_day = {}
     last_by_day = {}
-    for txn in last_month:
-        day = txn["date"].day
-        last_by_day[day] = last_by_day.get(day, 0) + txn["amount"]
+    for day, item in sorted(daily.items()):
+        by_day = current_by_day if day >= current_month_start else last_by_day
+        by_day[day.day] = by_day.get(day.day, 0) + item["total"]
+    
+    current_total = sum(current_by_day.values())
+    last_total = sum(last_by_day.values())
+    
+    # Cumulative curves the chart plots directly: this month up to today, last month in full
+    current_cumulative = cumulative_by_day(current_by_day, now.day)
+    last_cumulative = cumulative_by_day(last_by_day, (current_month_start - timedelta(days=1)).day)
+    last_to_date = last_cumulative.get(now.day, last_total)
     
     return {
         "current_month": current_by_day,
         "last_month": last_by_day,
-        "current_total": sum(current_by_day.values()),
-        "last_total": sum(last_by_day.values()),
-        "difference": sum(current_by_day.values()) - sum(last_by_day.values())
+        "current_total": current_total,
+        "last_total": last_total,
+        "difference": current_total - last_total,
+        "current_cumulative": current_cumulative,
+        "last_cumulative": last_cumulative,
+        "last_total_to_date": last_to_date,
+        "difference_to_date": current_total - last_to_date
     }
 
 # ============= GOAL ROUTES =============
@@ -819,6 +1019,7 @@ async def create_goal(goal: GoalCreate, user_id: str):
     goal_data["created_at"] = datetime.utcnow()
     
     result = await db.goals.insert_one(goal_data)
+    notify_data_changed(user_id, "goals")
     return {"id": str(result.inserted_id), **goal_data}
 
 @api_router.put("/goals/{goal_id}")
@@ -835,6 +1036,7 @@ async def update_goal(goal_id: str, goal: GoalCreate, user_id: str):
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Goal not found")
     
+    notify_data_changed(user_id, "goals")
     return {"id": goal_id, **goal_data}
 
 @api_router.delete("/goals/{goal_id}")
@@ -847,6 +1049,7 @@ async def delete_goal(goal_id: str, user_id: str):
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Goal not found")
     
+    notify_data_changed(user_id, "goals")
     return {"message": "Goal deleted successfully"}
 
 # ============= INSIGHT ROUTES =============
@@ -862,46 +1065,26 @@ async def get_insights(user_id: str, unread_only: bool = False):
 
 # ============= CHAT ROUTES =============
 @api_router.post("/chat")
-async def chat_with_fibby(request: ChatRequest):
+async def chat_with_fibby(request: ChatRequest, http_request: Request):
     """Chat with Fibby AI assistant"""
     try:
         session_id = request.session_id or str(uuid.uuid4())
         
-        # Initialize LLM Chat with Hinglish personality
-        chat = LlmChat(
-            api_key=os.environ.get("EMERGENT_LLM_KEY"),
-            session_id=session_id,
-            system_message="""You are Fibby, a friendly Gen-Z finance buddy for Indians. 
-
-Your personality:
-- Speak in casual Hinglish (mix of Hindi and English)
-- Use phrases like "bro", "yaar", "scene", "chill hai"
-- Be encouraging and supportive, never judgemental
-- Keep responses short and conversational (2-3 sentences max)
-- Use emojis naturally but don't overdo it
-
-Your role:
-- Help users understand their spending
-- Give practical money advice
-- Encourage good financial habits
-- Make finance feel fun and approachable
-
-Examples:
-- "Bro, you spent ₹5k on Zomato this month. Ghar ka khana bhi try karo! 🍛"
-- "Scene sorted hai! You're under budget. Keep it up yaar 📈"
-- "Relax bro, sabka hota hai. Next month better karenge 💪"
-"""
-        ).with_model("openai", "gpt-5.1")
-        
-        # Send message
-        user_message = UserMessage(text=request.message)
-        response = await chat.send_message(user_message)
+        # Hinglish buddy persona via the shared LLM gateway; the session id is
+        # client-chosen, so the rate limit is keyed on the client address instead
+        result = await llm_gateway.complete(
+            "hinglish_buddy", request.message,
+            user_id=rate_limit_key(None, http_request), session_id=session_id
+        )
+        response = result.text
         
         return ChatResponse(
             message=response,
             widget_data=None,
             session_id=session_id
         )
+    except LLMRateLimited as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         logger.error(f"Chat error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -918,32 +1101,10 @@ async def get_user_context(user_id: str, query: str) -> str:
         if user:
             context_parts.append(f"User: {user.get('name', 'User')}")
         
-        # Budget-related queries
+        # Budget-related queries (exact figures from the same aggregation tools the RAG router uses)
         if any(word in query_lower for word in ['budget', 'spending', 'expense', 'spend', 'money']):
-            # Get current month transactions
-            from datetime import datetime, timedelta
-            current_month_start = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            
-            transactions = list(await db.transactions.find({
-                "user_id": user_id,
-                "date": {"$gte": current_month_start}
-            }).to_list(length=100))
-            
-            if transactions:
-                total_spent = sum(t.get('amount', 0) for t in transactions if t.get('amount', 0) > 0)
-                
-                # Category breakdown
-                category_spending = {}
-                for t in transactions:
-                    cat = t.get('category', 'Other')
-                    category_spending[cat] = category_spending.get(cat, 0) + t.get('amount', 0)
-                
-                top_categories = sorted(category_spending.items(), key=lambda x: x[1], reverse=True)[:3]
-                
-                context_parts.append(f"This Month Spending: ₹{total_spent:,.0f}")
-                context_parts.append(f"Top Categories: {', '.join([f'{cat} ₹{amt:,.0f}' for cat, amt in top_categories])}")
-                context_parts.append(f"Monthly Budget: ₹45,000")
-                context_parts.append(f"Budget Used: {(total_spent/45000)*100:.0f}%")
+            context_parts.extend(await analytics_tools.budget_status(user_id))
+            context_parts.extend(await analytics_tools.spending_summary(user_id, query))
         
         # Investment-related queries
         if any(word in query_lower for word in ['invest', 'portfolio', 'sip', 'stock', 'mutual', 'fund', 'return']):
@@ -987,40 +1148,8 @@ async def get_user_context(user_id: str, query: str) -> str:
         
         # Weekend/recent spending
         if any(word in query_lower for word in ['weekend', 'week', 'recent', 'today', 'yesterday']):
-            from datetime import datetime, timedelta
-            
-            # Get last weekend (Saturday & Sunday)
-            now = datetime.now()
-            days_since_sunday = (now.weekday() + 1) % 7
-            last_sunday = now - timedelta(days=days_since_sunday)
-            last_saturday = last_sunday - timedelta(days=1)
-            
-            # Set time boundaries
-            weekend_start = last_saturday.replace(hour=0, minute=0, second=0, microsecond=0)
-            weekend_end = last_sunday.replace(hour=23, minute=59, second=59, microsecond=999999)
-            
-            weekend_txns = list(await db.transactions.find({
-                "user_id": user_id,
-                "date": {"$gte": weekend_start, "$lte": weekend_end}
-            }).to_list(length=100))
-            
-            if weekend_txns:
-                total_weekend = sum(t.get('amount', 0) for t in weekend_txns if t.get('amount', 0) > 0)
-                
-                # Category breakdown for weekend
-                weekend_categories = {}
-                for t in weekend_txns:
-                    if t.get('amount', 0) > 0:
-                        cat = t.get('category', 'Other')
-                        weekend_categories[cat] = weekend_categories.get(cat, 0) + t.get('amount', 0)
-                
-                context_parts.append(f"Weekend Spending (Sat-Sun): ₹{total_weekend:,.0f}")
-                context_parts.append(f"Weekend Transactions: {len(weekend_txns)}")
-                
-                # Top weekend categories
-                if weekend_categories:
-                    top_weekend = sorted(weekend_categories.items(), key=lambda x: x[1], reverse=True)[:3]
-                    context_parts.append(f"Top Weekend Categories: {', '.join([f'{cat} ₹{amt:,.0f}' for cat, amt in top_weekend])}")
+            window = resolve_time_window(query) or resolve_time_window("weekend")
+            context_parts.extend(await analytics_tools.spending_summary(user_id, query, window))
         
         if not context_parts:
             context_parts.append("No specific financial data found for this query.")
@@ -1031,24 +1160,33 @@ async def get_user_context(user_id: str, query: str) -> str:
         logger.error(f"Error fetching user context: {str(e)}")
         return "Unable to fetch user data at the moment."
 
-@api_router.post("/chat/message")
-async def chat_message(request: dict):
-    """Chat endpoint with RAG-enhanced contextual responses using GPT-5.1"""
+DEFAULT_CHAT_OPTIONS = [
+    "Check my spending breakdown",
+    "View my budget status",
+    "See investment portfolio",
+    "Explore financial goals"
+]
+
+async def build_chat_prompt(user_id: str, message: str):
+    """
+    User message wrapped with RAG-retrieved context (keyword context if RAG fails).
+    
+    Returns (prompt, whether the context came from RAG).
+    """
+    # RAG: Fetch relevant context from vector database
     try:
-        user_id = request.get("user_id", "guest")
-        message = request.get("message", "")
-        
-        # RAG: Fetch relevant context from vector database
-        try:
-            rag_context = rag_service.get_rag_context(user_id, message)
-            logger.info(f"RAG context retrieved for user {user_id}")
-        except Exception as e:
-            logger.warning(f"RAG context retrieval failed, using fallback: {str(e)}")
-            # Fallback to traditional context fetching if RAG fails
-            rag_context = await get_user_context(user_id, message)
-        
-        # Build context-aware prompt with RAG-retrieved information
-        context_prompt = f"""User Query: {message}
+        await ensure_embedder()
+        rag_context = await rag_service.get_rag_context(user_id, message)
+        from_rag = True
+        logger.info(f"RAG context retrieved for user {user_id}")
+    except Exception as e:
+        logger.warning(f"RAG context retrieval failed, using fallback: {str(e)}")
+        # Fallback to traditional context fetching if RAG fails
+        rag_context = await get_user_context(user_id, message)
+        from_rag = False
+    
+    # Build context-aware prompt with RAG-retrieved information
+    prompt = f"""User Query: {message}
 
 {rag_context}
 
@@ -1058,274 +1196,199 @@ Based on this retrieved context, provide a helpful response that:
 3. Only include MCQ options when there are natural follow-up paths or decisions to make
 4. Keep the response concise but informative
 5. If the context doesn't contain enough information to answer, acknowledge it politely"""
-        
-        # Initialize LLM Chat with professional advisor tone and structured output
-        chat = LlmChat(
-            api_key=os.environ.get("EMERGENT_LLM_KEY"),
-            session_id=f"chat_{user_id}",
-            system_message="""You are Fibby, a smart and friendly finance companion for individuals looking to learn more and be self-reliant when it comes to finances.
-
-YOUR TONE: Professional Advisor
-- Be encouraging and supportive
-- Use emojis strategically (3-5 per response for visual appeal)
-
-YOUR ROLE:
-- Provide REAL ANSWERS with actual data and insights from the user's data
-- Analyze trends and give actionable advice
-- Help users understand their financial situation clearly
-- Guide them toward better financial decisions
-
-RESPONSE STRUCTURE:
-
-MAIN ANSWER (Required):
-- Address their question directly with their specific data
-- Share insights, trends, or analysis
-- Provide actionable recommendations
-- Use numbers and percentages from the context
-- Keep it 1-2 sentences, short, and direct. No need to write lengthy explanations
-- Use visual formatting for better engagement
-
-VISUAL FORMATTING GUIDELINES:
-
-✅ USE EMOJIS AS BULLET POINTS:
-- Use relevant emojis (🛒 Shopping, 🚗 Travel, 🍽️ Food, 💰 Money, 📊 Stats, etc.)
-- Start category lists with emoji bullets
-
-📊 USE VISUAL BARS FOR PERCENTAGES:
-- For percentages 0-100%, show visual bar using █ blocks
-- Example: "████████░░ 80%"
-- Always show percentage number after the bar
-
-💡 FORMAT BREAKDOWN LISTS:
-- Category emoji + name + amount + visual bar
-- Example: "🛒 Shopping: ₹22,500 ████████░░ 35%"
-
-🎯 USE CLEAR SECTIONS:
-- Break down response into clear sections
-- Use spacing and line breaks for readability
-- Group related information together
-
-MCQ OPTIONS (Only when relevant):
-- Include when there are natural next steps
-- When user needs to make a decision
-- When exploring different aspects of a topic
-- When there are multiple follow-up paths
-- Limit to 2-4 options max
-- Format MCQs like: "OPTIONS:\n[Option 1]\n[Option 2]\n[Option 3]"
-
-DON'T:
-- Don't always add MCQs if the answer is complete
-- Don't be overly casual or lose professionalism
-- Don't give vague answers - use the data provided
-
-DO:
-- Give specific numbers and percentages
-- Highlight important trends or concerns
-- Offer practical advice
-- Make finance feel accessible
-- End naturally without forcing MCQs
-
-CRITICAL: You must respond ONLY with valid JSON in this exact structure:
-
-JSON RESPONSE FORMAT:
-{
-  "summary": "Your response text here (match length to query complexity)",
-  "cardType": "spending_breakdown" | "portfolio" | "budget_status" | "goal_progress" | null,
-  "metrics": {
-    // Structure varies by cardType - see examples below
-  },
-  "options": ["Option 1", "Option 2"] // 2-4 MCQ options when relevant
-}
-
-CARD TYPES & METRICS STRUCTURE:
-
-1. spending_breakdown (for spending queries):
-{
-  "total": 32400,
-  "period": "This Month",
-  "categories": [
-    {"name": "Food", "emoji": "🍽️", "amount": 12200, "percentage": 38, "color": "#608BB6"},
-    {"name": "Travel", "emoji": "🚗", "amount": 8500, "percentage": 26, "color": "#82B1FF"}
-  ]
-}
-
-2. portfolio (for investment queries):
-{
-  "currentValue": 523400,
-  "invested": 442000,
-  "returns": 81400,
-  "returnsPercentage": 18.4,
-  "assets": [
-    {"name": "Equity", "emoji": "📈", "percentage": 60, "returns": 22, "color": "#608BB6"}
-  ]
-}
-
-3. budget_status (for budget queries):
-{
-  "spent": 32400,
-  "budget": 45000,
-  "percentage": 72,
-  "topCategories": [
-    {"name": "Food", "emoji": "🍽️", "amount": 12200, "color": "#608BB6"}
-  ]
-}
-
-4. goal_progress (for goal queries):
-{
-  "goalName": "Goa Trip",
-  "target": 50000,
-  "current": 36000,
-  "percentage": 72,
-  "emoji": "✈️"
-}
-
-WHEN TO USE CARDS:
-- Use cardType when query asks about specific data (spending, budget, investments, goals)
-- Set cardType to null for general questions, advice, or explanations
-- The card will visualize the data, so keep your summary focused on insights
-
-MCQ OPTIONS (when relevant):
-   - Include when there are natural next steps
-   - When user needs to make a decision
-   - When exploring different aspects of a topic
-   - Limit to 2-4 options max
-
-EXAMPLES:
-
-Example 1 - Spending Query (with card):
-User Data: Total ₹32,400, Food ₹12,200 (38%), Travel ₹8,500 (26%)
-Response:
-{
-  "summary": "You've spent ₹32,400 this month. Food is your biggest expense at 38%, followed by travel at 26%.",
-  "cardType": "spending_breakdown",
-  "metrics": {
-    "total": 32400,
-    "period": "This Month",
-    "categories": [
-      {"name": "Food", "emoji": "🍽️", "amount": 12200, "percentage": 38, "color": "#608BB6"},
-      {"name": "Travel", "emoji": "🚗", "amount": 8500, "percentage": 26, "color": "#82B1FF"},
-      {"name": "Shopping", "emoji": "🛒", "amount": 6200, "percentage": 19, "color": "#81C784"},
-      {"name": "Bills", "emoji": "💳", "amount": 5500, "percentage": 17, "color": "#FFB74D"}
-    ]
-  },
-  "options": ["Set spending limit for Food", "View daily breakdown", "Compare with last month"]
-}
-
-Example 2 - Investment Query (with card):
-{
-  "summary": "Your portfolio is up 18.4% with ₹81,400 in gains. Equity is driving most returns at +22%.",
-  "cardType": "portfolio",
-  "metrics": {
-    "currentValue": 523400,
-    "invested": 442000,
-    "returns": 81400,
-    "returnsPercentage": 18.4,
-    "assets": [
-      {"name": "Equity", "emoji": "📈", "percentage": 60, "returns": 22, "color": "#608BB6"},
-      {"name": "Debt", "emoji": "📊", "percentage": 30, "returns": 8, "color": "#82B1FF"},
-      {"name": "Gold", "emoji": "💰", "percentage": 10, "returns": 12, "color": "#FFD700"}
-    ]
-  },
-  "options": ["Review holdings", "Rebalance portfolio", "Increase SIP"]
-}
+    return prompt, from_rag
 
-Example 3 - General Question (no card):
-{
-  "summary": "SIP (Systematic Investment Plan) is a way to invest a fixed amount regularly in mutual funds. It helps build wealth through rupee cost averaging and compound growth.",
-  "cardType": null,
-  "metrics": null,
-  "options": ["Learn about mutual funds", "How to start a SIP", "Best SIP strategies"]
-}
+def rate_limit_key(user_id: Optional[str], http_request: Optional[Request] = None) -> Optional[str]:
+    """
+    Per-user LLM rate limit key
+    
+    Anonymous callers (no user id, or "guest") aren't limited as one shared
+    user; they are keyed on their client address instead.
+    """
+    if user_id and user_id != "guest":
+        return user_id
+    if http_request is not None and http_request.client:
+        return f"client:{http_request.client.host}"
+    return None
+
+async def probe_semantic_cache(user_id: str, message: str):
+    """
+    Embed the question and look for a cached answer to a near-duplicate.
+    
+    Returns (probe, cached response); probe is the (embedding, data
+    fingerprint) pair to store the new answer under, None if caching is off.
+    Questions the router answers from the spending rollups (structured or
+    hybrid) are never cached: their figures move with the clock ("today",
+    "this week") and with rollup rebuilds, neither of which the chunk
+    fingerprint sees.
+    """
+    if not semantic_cache or not semantic_cache.enabled:
+        return None, None
+    if rag_service.classify(message)["route"] != "vector":
+        return None, None
+    try:
+        await ensure_embedder()
+        probe = await semantic_cache.probe(user_id, message, rag_service.run_blocking)
+    except Exception as e:
+        logger.warning(f"Semantic cache probe failed: {str(e)}")
+        return None, None
+    if probe is None:
+        return None, None
+    return probe, semantic_cache.lookup(user_id, *probe)
 
-IMPORTANT: Always return valid JSON. The frontend will display only the summary to users and render the card separately."""
-        ).with_model("openai", "gpt-5.1")
+def parse_chat_response(response_text: str) -> dict:
+    """
+    Turn the LLM reply into the chat payload: response text, options and card.
+    
+    Expects the JSON structure requested by the professional_advisor persona and falls back
+    to plain text with an optional "OPTIONS:" section.
+    """
+    import json
+    try:
+        # Try to parse the response as JSON
+        parsed_response = json.loads(response_text)
+        
+        # Extract components from parsed JSON
+        summary = parsed_response.get("summary", response_text)
+        card_type = parsed_response.get("cardType")
+        metrics = parsed_response.get("metrics")
+        options = parsed_response.get("options", [])
+        
+        # Build card data if cardType is provided
+        card_data = None
+        if card_type and metrics:
+            card_data = {
+                "type": card_type,
+                **metrics
+            }
         
-        # Send message with context
-        user_message = UserMessage(text=context_prompt)
-        response_text = await chat.send_message(user_message)
+        # Ensure we have some options
+        if not options:
+            options = list(DEFAULT_CHAT_OPTIONS)
         
-        # Parse JSON response from LLM
-        try:
-            import json
-            # Try to parse the response as JSON
-            parsed_response = json.loads(response_text)
-            
-            # Extract components from parsed JSON
-            summary = parsed_response.get("summary", response_text)
-            card_type = parsed_response.get("cardType")
-            metrics = parsed_response.get("metrics")
-            options = parsed_response.get("options", [])
-            
-            # Build card data if cardType is provided
-            card_data = None
-            if card_type and metrics:
-                card_data = {
-                    "type": card_type,
-                    **metrics
-                }
-            
-            # Ensure we have some options
-            if not options:
-                options = [
-                    "Check my spending breakdown",
-                    "View my budget status", 
-                    "See investment portfolio",
-                    "Explore financial goals"
-                ]
-            
-            return {
-                "response": summary,
-                "options": options[:4],  # Limit to 4 options
-                "card": card_data,
-                "cta": None
-            }
-            
-        except json.JSONDecodeError:
-            # Fallback to old parsing if JSON parsing fails
-            logger.warning(f"Failed to parse JSON response, falling back to text parsing: {response_text[:100]}...")
-            
-            # Parse response to extract options (old method)
-            options = []
-            main_response = response_text
-            
-            # Simple parsing: look for "OPTIONS:" section
-            if "OPTIONS:" in response_text:
-                parts = response_text.split("OPTIONS:")
-                main_response = parts[0].strip()
-                options_text = parts[1].strip()
-                
-                # Extract options (lines starting with -)
-                for line in options_text.split('\n'):
-                    line = line.strip()
-                    if line.startswith('-'):
-                        option = line[1:].strip()
-                        if option:
-                            options.append(option)
-            
-            # If no options found, provide default exploration options
-            if not options:
-                options = [
-                    "Check my spending breakdown",
-                    "View my budget status",
-                    "See investment portfolio",
-                    "Explore financial goals"
-                ]
+        return {
+            "response": summary,
+            "options": options[:4],  # Limit to 4 options
+            "card": card_data,
+            "cta": None
+        }
+        
+    except json.JSONDecodeError:
+        # Fallback to old parsing if JSON parsing fails
+        logger.warning(f"Failed to parse JSON response, falling back to text parsing: {response_text[:100]}...")
+        
+        # Parse response to extract options (old method)
+        options = []
+        main_response = response_text
+        
+        # Simple parsing: look for "OPTIONS:" section
+        if "OPTIONS:" in response_text:
+            parts = response_text.split("OPTIONS:")
+            main_response = parts[0].strip()
+            options_text = parts[1].strip()
             
-            return {
-                "response": main_response,
-                "options": options[:4],
-                "card": None,
-                "cta": None
-            }
+            # Extract options (lines starting with -)
+            for line in options_text.split('\n'):
+                line = line.strip()
+                if line.startswith('-'):
+                    option = line[1:].strip()
+                    if option:
+                        options.append(option)
+        
+        # If no options found, provide default exploration options
+        if not options:
+            options = list(DEFAULT_CHAT_OPTIONS)
         
-    except Exception as e:
-        logger.error(f"Chat error: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        return {
+            "response": main_response,
+            "options": options[:4],
+            "card": None,
+            "cta": None
+        }
+
+@api_router.post("/chat/message")
+async def chat_message(request: dict, http_request: Request):
+    """Chat endpoint with RAG-enhanced contextual responses using GPT-5.1"""
+    try:
+        user_id = request.get("user_id", "guest")
+        message = request.get("message", "")
+        
+        # Near-duplicate question with unchanged data: reuse the earlier answer
+        probe, cached = await probe_semantic_cache(user_id, message)
+        if cached:
+            return cached
+        
+        context_prompt, from_rag = await build_chat_prompt(user_id, message)
         
+        # Professional advisor persona with structured output, via the shared LLM gateway
+        result = await llm_gateway.complete(
+            "professional_advisor", context_prompt,
+            user_id=rate_limit_key(user_id, http_request), session_id=f"chat_{user_id}"
+        )
+        response_text = result.text
+        
+        # Parse JSON response from LLM
+        parsed = parse_chat_response(response_text)
+        if probe and from_rag and not result.fallback:
+            semantic_cache.store(user_id, message, *probe, parsed)
+        return parsed
+        
+    except LLMRateLimited as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
-        logger.error(f"Chat error: {e}")
+        logger.error(f"Chat error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.post("/chat/message/stream")
+async def chat_message_stream(request: dict, http_request: Request):
+    """
+    Streaming variant of /chat/message as Server-Sent Events.
+    
+    Emits "summary" events with text as the model produces it, then one
+    "final" event carrying the same payload /chat/message returns (response,
+    options, card, cta) once the reply is complete, or an "error" event.
+    """
+    user_id = request.get("user_id", "guest")
+    message = request.get("message", "")
+    
+    async def event_stream():
+        try:
+            probe, cached = await probe_semantic_cache(user_id, message)
+            if cached:
+                yield sse_event("summary", {"text": cached["response"]})
+                yield sse_event("final", cached)
+                return
+            
+            context_prompt, from_rag = await build_chat_prompt(user_id, message)
+            
+            extractor = SummaryStreamExtractor()
+            async for token in llm_gateway.stream(
+                "professional_advisor", context_prompt,
+                user_id=rate_limit_key(user_id, http_request), session_id=f"chat_{user_id}"
+            ):
+                text = extractor.feed(token)
+                if text:
+                    yield sse_event("summary", {"text": text})
+            text = extractor.flush()
+            if text:
+                yield sse_event("summary", {"text": text})
+            
+            result = parse_chat_response(extractor.buffer)
+            if probe and from_rag and not llm_gateway.is_fallback("professional_advisor", extractor.buffer):
+                semantic_cache.store(user_id, message, *probe, result)
+            yield sse_event("final", result)
+        except LLMRateLimited as e:
+            yield sse_event("error", {"detail": str(e), "status": 429})
+        except Exception as e:
+            logger.error(f"Chat stream error: {str(e)}")
+            yield sse_event("error", {"detail": str(e)})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # ============= CHAT HISTORY ROUTES =============
 
 def detect_conversation_category(user_message: str, assistant_message: str, card_type: str = None) -> str:
@@ -1518,24 +1581,123 @@ async def delete_conversation(conversation_id: str, user_id: str):
 
 # ============= EMBEDDER & RAG SETUP =============
 from embedder_service import EmbedderAgent
-from rag_service import RAGService
+from embedding_refresher import EmbeddingRefresher
+from semantic_cache import SemanticResponseCache
+
+# "background": load the embedding model right after startup without blocking it;
+# "lazy": on first RAG use; "eager": before the API accepts traffic
+EMBEDDER_WARMUP = os.environ.get("EMBEDDER_WARMUP", "background").lower()
+# Writes remembered while the embedder warms up, replayed into the refresher once it starts
+EMBEDDER_PENDING_WRITES_MAX_USERS = int(os.environ.get("EMBEDDER_PENDING_WRITES_MAX_USERS", "10000"))
 
 # Global embedder agent and RAG service instances
 embedder_agent: EmbedderAgent = None
 rag_service: RAGService = None
+embedding_refresher: EmbeddingRefresher = None
+semantic_cache: SemanticResponseCache = None
+embedder_warmup: Optional[asyncio.Task] = None
+warmup_state = {"status": "cold", "started_at": None, "finished_at": None, "error": None}
+pending_writes: dict = {}
+
+def notify_data_changed(user_id: str, *collections: str):
+    """Write hook: drop cached responses and tell the embedding refresher which collections changed"""
+    dashboard_cache.invalidate(user_id)
+    if embedding_refresher:
+        embedding_refresher.notify_write(user_id, collections)
+    elif user_id and warmup_state["status"] in ("cold", "warming"):
+        if user_id in pending_writes or len(pending_writes) < EMBEDDER_PENDING_WRITES_MAX_USERS:
+            pending_writes.setdefault(user_id, set()).update(collections)
+
+async def warm_up_embedder():
+    """Load the model and vector store off the event loop, then start the refresher and pre-warm queries"""
+    global embedding_refresher
+    warmup_state.update(status="warming", started_at=datetime.utcnow().isoformat())
+    try:
+        await embedder_agent.ensure_loaded()
+        
+        # Keep vectors fresh as user data changes
+        if embedder_agent.is_rag_enabled() and os.environ.get("EMBEDDING_REFRESH_ENABLED", "true").lower() == "true":
+            embedding_refresher = EmbeddingRefresher(embedder_agent)
+            await embedding_refresher.start()
+            for user_id, collections in pending_writes.items():
+                embedding_refresher.notify_write(user_id, collections)
+        pending_writes.clear()
+        
+        # Pre-embed the fixed query expansion phrases so chats only encode the user's own text
+        if os.environ.get("EMBEDDING_CACHE_PREWARM", "true").lower() == "true":
+            await rag_service.run_blocking(
+                embedder_agent.warm_query_cache, RAGService.all_expansion_phrases()
+            )
+        warmup_state.update(status="ready", finished_at=datetime.utcnow().isoformat())
+        logger.info(f"Embedder warm-up finished: {embedder_agent.load_state}")
+    except Exception as e:
+        warmup_state.update(status="failed", finished_at=datetime.utcnow().isoformat(), error=str(e))
+        logger.error(f"Embedder warm-up failed: {str(e)}")
+
+def start_embedder_warmup() -> asyncio.Task:
+    """Start the warm-up task once (a failed warm-up is retried on the next call)"""
+    global embedder_warmup
+    if embedder_warmup is None or (embedder_warmup.done() and warmup_state["status"] == "failed"):
+        embedder_warmup = asyncio.create_task(warm_up_embedder())
+    return embedder_warmup
+
+async def ensure_embedder():
+    """Wait until the embedding model and vector store are loaded, starting warm-up if nobody has"""
+    start_embedder_warmup()
+    await embedder_agent.ensure_loaded()
 
 @api_router.on_event("startup")
 async def startup_embedder():
-    """Initialize embedder agent and RAG service on startup"""
-    global embedder_agent, rag_service
+    """Create the embedder agent and RAG service; the model itself loads per EMBEDDER_WARMUP"""
+    global embedder_agent, rag_service, semantic_cache
     embedder_agent = EmbedderAgent()
-    rag_service = RAGService(embedder_agent)
-    logger.info("Embedder agent and RAG service initialized")
+    rag_service = RAGService(embedder_agent, tools=analytics_tools)
+    semantic_cache = SemanticResponseCache(embedder_agent)
+    logger.info(f"Embedder agent and RAG service initialized (warm-up: {EMBEDDER_WARMUP})")
+    
+    if EMBEDDER_WARMUP == "eager":
+        await start_embedder_warmup()
+    elif EMBEDDER_WARMUP != "lazy":
+        start_embedder_warmup()
+
+@api_router.on_event("shutdown")
+async def shutdown_embedder():
+    """Stop the embedding refresher, release the RAG thread pool and close embedder connections"""
+    if embedder_warmup and not embedder_warmup.done():
+        embedder_warmup.cancel()
+    if embedding_refresher:
+        await embedding_refresher.stop()
+    if rag_service:
+        rag_service.close()
+    if embedder_agent:
+        await embedder_agent.close()
+
+@api_router.get("/ready")
+async def readiness(require_embedder: bool = False):
+    """
+    Readiness probe
+    
+    The API serves non-chat routes as soon as it starts; chat retrieval waits
+    for the embedder warm-up. With require_embedder=true this returns 503
+    until warm-up has finished.
+    """
+    embedder_ready = bool(embedder_agent and embedder_agent.is_loaded())
+    body = {
+        "ready": embedder_ready or not require_embedder,
+        "embedder_ready": embedder_ready,
+        "warmup_mode": EMBEDDER_WARMUP,
+        "warmup": dict(warmup_state),
+        "embedder": dict(embedder_agent.load_state) if embedder_agent else None
+    }
+    if not body["ready"]:
+        return JSONResponse(status_code=503, content=body)
+    return body
 
 @api_router.post("/embeddings/update/{user_id}")
 async def update_user_embeddings(user_id: str):
     """Manually trigger embedding update for a specific user"""
     try:
+        await ensure_embedder()
         transaction_id = await embedder_agent.update_user_embeddings(user_id)
         if transaction_id:
             return {
@@ -1551,14 +1713,25 @@ async def update_user_embeddings(user_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.post("/embeddings/update-all")
-async def update_all_user_embeddings():
-    """Update embeddings for all users"""
+async def update_all_user_embeddings(
+    fetch_concurrency: Optional[int] = None,
+    encode_batch_size: Optional[int] = None
+):
+    """Update embeddings for all users (pipelined bulk mode)"""
     try:
-        await embedder_agent.update_all_users()
+        options = {}
+        if fetch_concurrency:
+            options["fetch_concurrency"] = fetch_concurrency
+        if encode_batch_size:
+            options["encode_batch_size"] = encode_batch_size
+        
+        await ensure_embedder()
+        metrics = await embedder_agent.update_all_users(**options)
         return {
             "status": "success",
             "message": "All user embeddings updated",
-            "user_count": len(embedder_agent.get_user_transactions())
+            "user_count": len(embedder_agent.get_user_transactions()),
+            "metrics": metrics
         }
     except Exception as e:
         logger.error(f"Error updating all embeddings: {str(e)}")
@@ -1568,12 +1741,13 @@ async def update_all_user_embeddings():
 async def get_transaction_ids():
     """Get all users and their transaction IDs"""
     try:
+        await ensure_embedder()
         transactions = embedder_agent.get_user_transactions()
         return {
             "total_users": len(transactions),
-            "total_documents": embedder_agent.collection.count(),
-            "embedding_model": "all-MiniLM-L6-v2",
-            "vector_db": "ChromaDB",
+            "total_documents": await rag_service.run_blocking(embedder_agent.store.count),
+            "embedding_model": embedder_agent.model.model_name,
+            "vector_db": embedder_agent.store.backend_name,
             "transactions": [
                 {
                     "user_id": user_id,
@@ -1586,20 +1760,48 @@ async def get_transaction_ids():
         logger.error(f"Error fetching transactions: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/embeddings/refresh-status")
+async def get_embedding_refresh_status():
+    """Status of the event-driven embedding refresher"""
+    if not embedding_refresher:
+        return {"mode": None, "enabled": False}
+    return {"enabled": True, **embedding_refresher.get_status()}
+
+@api_router.get("/chat/cache-stats")
+async def get_chat_cache_stats():
+    """Hit rate and size of the semantic chat response cache, retrieval route counts and context packing"""
+    stats = semantic_cache.get_stats() if semantic_cache else {"enabled": False}
+    if rag_service:
+        stats["retrieval_routes"] = rag_service.get_routing_stats()
+        stats["context_packing"] = rag_service.get_packing_stats()
+    return stats
+
+@api_router.get("/embeddings/cache-stats")
+async def get_embedding_cache_stats():
+    """Hit/miss counters for the query embedding cache and query micro-batching"""
+    if not embedder_agent.is_loaded():
+        return {"model": None, "loaded": False}
+    return {**embedder_agent.get_query_cache_stats(), "batching": embedder_agent.get_batching_stats()}
+
 @api_router.get("/embeddings/search")
 async def search_embeddings(query: str, user_id: str = None, limit: int = 5):
-    """Search vector database with a query"""
+    """
+    Search vector database with a query
+    
+    Without user_id the numpy vector store scans every user's vectors, so
+    unfiltered searches are for debugging only.
+    """
     try:
-        # Generate query embedding
-        query_embedding = embedder_agent.model.encode([query])[0].tolist()
+        await ensure_embedder()
+        # Generate query embedding off the event loop, batched with concurrent chats
+        query_embedding = (await embedder_agent.query_model.encode_async([query]))[0]
         
         # Search with optional user filter
-        where_filter = {"user_id": user_id} if user_id else None
-        
-        results = embedder_agent.collection.query(
-            query_embeddings=[query_embedding],
+        results = await rag_service.run_blocking(
+            embedder_agent.store.query,
+            [query_embedding],
             n_results=limit,
-            where=where_filter
+            user_id=user_id
         )
         
         return {
@@ -1640,6 +1842,7 @@ async def add_bank_account(request: dict):
         }
         
         result = await db.bank_accounts.insert_one(account_data)
+        notify_data_changed(user_id, "bank_accounts")
         return {"id": str(result.inserted_id), **account_data}
     
     except Exception as e:
@@ -1672,6 +1875,7 @@ async def delete_bank_account(account_id: str, user_id: str):
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Account not found")
         
+        notify_data_changed(user_id, "bank_accounts")
         return {"message": "Account deleted successfully"}
     
     except Exception as e:
@@ -1683,47 +1887,54 @@ async def delete_bank_account(account_id: str, user_id: str):
 async def get_dashboard_data(user_id: str):
     """Get all data for the home dashboard"""
     try:
-        from bson import ObjectId
-        # Get user
-        try:
-            user = await db.users.find_one({"_id": ObjectId(user_id)})
-        except:
-            user = await db.users.find_one({"_id": user_id})
-            
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        # Get accounts
-        accounts = await db.bank_accounts.find({"user_id": user_id}).to_list(10)
-        
-        # Get recent transactions
-        recent_transactions = await db.transactions.find(
-            {"user_id": user_id}
-        ).sort("date", -1).limit(10).to_list(10)
-        
-        # Get insights
-        insights = await db.insights.find(
-            {"user_id": user_id}
-        ).sort("date", -1).limit(5).to_list(5)
-        
-        # Get category breakdown
-        category_data = await get_category_breakdown(user_id, months=1)
-        
-        # Get spend velocity
-        velocity_data = await get_spend_velocity(user_id)
-        
-        return {
-            "user": serialize_doc(user),
-            "accounts": [serialize_doc(acc) for acc in accounts],
-            "recent_transactions": [serialize_doc(txn) for txn in recent_transactions],
-            "insights": [serialize_doc(ins) for ins in insights],
-            "category_breakdown": category_data,
-            "spend_velocity": velocity_data
-        }
+        return await dashboard_cache.get_or_compute(user_id, lambda: compose_dashboard(user_id))
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Dashboard error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/dashboard/cache-stats")
+async def get_dashboard_cache_stats():
+    """Hit rate and size of the dashboard response cache"""
+    return dashboard_cache.stats()
+
+async def find_user_doc(user_id: str):
+    """Look a user up by ObjectId, falling back to a plain string _id"""
+    try:
+        return await db.users.find_one({"_id": ObjectId(user_id)})
+    except Exception:
+        return await db.users.find_one({"_id": user_id})
+
+async def compose_dashboard(user_id: str) -> dict:
+    """
+    Build the dashboard payload with every section fetched concurrently.
+    
+    The sections are independent reads, so the response costs about as much
+    as the slowest one instead of the sum of all six. Category breakdown and
+    spend velocity are summed in the database from the spending rollups.
+    """
+    user, accounts, recent_transactions, insights, category_data, velocity_data = await asyncio.gather(
+        find_user_doc(user_id),
+        db.bank_accounts.find({"user_id": user_id}).to_list(10),
+        db.transactions.find({"user_id": user_id}).sort("date", -1).limit(10).to_list(10),
+        db.insights.find({"user_id": user_id}).sort("date", -1).limit(5).to_list(5),
+        get_category_breakdown(user_id, months=1),
+        get_spend_velocity(user_id)
+    )
+    
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    return {
+        "user": serialize_doc(user),
+        "accounts": [serialize_doc(acc) for acc in accounts],
+        "recent_transactions": [serialize_doc(txn) for txn in recent_transactions],
+        "insights": [serialize_doc(ins) for ins in insights],
+        "category_breakdown": category_data,
+        "spend_velocity": velocity_data
+    }
+
 # ============= INVESTMENT ROUTES =============
 @api_router.get("/investments/portfolio")
 async def get_portfolio_summary(user_id: str):
@@ -1814,145 +2025,29 @@ async def get_other_investments(user_id: str, investment_type: Optional[str] = N
 async def get_investment_recommendations(user_id: str):
     """Get investment recommendations (AI + Rule-based ensemble)"""
     try:
-        recommendations = []
-        
-        # Get portfolio data for analysis
-        holdings = await db.investment_holdings.find({"user_id": user_id}).to_list(100)
-        mutual_funds = await db.mutual_funds.find({"user_id": user_id}).to_list(100)
-        other_investments = await db.other_investments.find({"user_id": user_id}).to_list(100)
-        
-        # Calculate current allocation
-        total_equity = sum(h["last_price"] * h["quantity"] for h in holdings)
-        total_mf = sum(m["last_price"] * m["quantity"] for m in mutual_funds)
-        total_other = sum(i["current_value"] for i in other_investments)
-        total_portfolio = total_equity + total_mf + total_other
-        
-        # Rule-based recommendations
-        rule_based = []
-        
-        # Check for missing asset classes
-        crypto_invested = sum(i["current_value"] for i in other_investments if i["type"] == "crypto")
-        if crypto_invested == 0 or crypto_invested < total_portfolio * 0.05:
-            rule_based.append({
-                "type": "rule",
-                "title": "Consider Crypto Allocation",
-                "description": "Allocate 5-10% to crypto for portfolio diversification",
-                "asset_class": "Cryptocurrency",
-                "priority": 3,
-                "reasoning": "You have minimal/no crypto exposure. Consider starting small."
-            })
-        
-        gold_invested = sum(i["current_value"] for i in other_investments if "gold" in i["name"].lower())
-        if gold_invested == 0:
-            rule_based.append({
-                "type": "rule",
-                "title": "Add Gold to Portfolio",
-                "description": "Invest in Gold ETF or Sovereign Gold Bonds",
-                "asset_class": "Gold",
-                "priority": 4,
-                "reasoning": "Gold provides hedge against inflation and market volatility."
-            })
-        
-        # Check equity concentration
-        if total_equity > total_portfolio * 0.7:
-            rule_based.append({
-                "type": "rule",
-                "title": "High Equity Concentration",
-                "description": "Consider adding debt/fixed income for stability",
-                "asset_class": "Debt",
-                "priority": 5,
-                "reasoning": "Your portfolio has >70% equity exposure, increasing risk."
-            })
-        
-        # AI-powered recommendations using GPT
-        try:
-            portfolio_summary = {
-                "total_value": total_portfolio,
-                "equity_pct": (total_equity / total_portfolio * 100) if total_portfolio > 0 else 0,
-                "mf_pct": (total_mf / total_portfolio * 100) if total_portfolio > 0 else 0,
-                "other_pct": (total_other / total_portfolio * 100) if total_portfolio > 0 else 0,
-                "holdings_count": len(holdings),
-                "age_group": "25-30",  # Mock data
-            }
-            
-            chat = LlmChat(
-                api_key=os.environ.get("EMERGENT_LLM_KEY"),
-                session_id=f"investment_rec_{user_id}",
-                system_message="""You are a financial advisor specializing in Indian investments. 
-                Analyze the portfolio and provide 2-3 specific, actionable investment recommendations.
-                Focus on:
-                - Asset allocation balance
-                - Diversification opportunities  
-                - Tax-saving instruments (80C, NPS)
-                - Risk-adjusted returns
-                
-                Return recommendations in this JSON format:
-                [
-                    {
-                        "title": "Short title",
-                        "description": "1-2 sentence description",
-                        "asset_class": "Asset class name",
-                        "priority": 1-10 (higher is more important),
-                        "reasoning": "Why this is recommended"
-                    }
-                ]
-                
-                Keep it practical and specific to Indian market."""
-            ).with_model("openai", "gpt-5.1")
-            
-            prompt = f"""Analyze this investment portfolio and provide recommendations:
-            
-            Portfolio Summary:
-            - Total Value: ₹{portfolio_summary['total_value']:,.2f}
-            - Equity: {portfolio_summary['equity_pct']:.1f}%
-            - Mutual Funds: {portfolio_summary['mf_pct']:.1f}%
-            - Other (FD/Bonds/Crypto): {portfolio_summary['other_pct']:.1f}%
-            - Number of Holdings: {portfolio_summary['holdings_count']}
-            - Investor Age: {portfolio_summary['age_group']}
-            
-            Provide 2-3 specific recommendations."""
-            
-            from emergentintegrations.llm.chat import UserMessage
-            response = await chat.send_message(UserMessage(text=prompt))
-            
-            # Parse AI response
-            import json
-            try:
-                ai_recommendations = json.loads(response)
-                for rec in ai_recommendations:
-                    rec["type"] = "ai"
-                    recommendations.append(rec)
-            except:
-                # If JSON parsing fails, create a default AI recommendation
-                recommendations.append({
-                    "type": "ai",
-                    "title": "Portfolio Review",
-                    "description": response[:150] + "...",
-                    "asset_class": "General",
-                    "priority": 8,
-                    "reasoning": "AI-powered analysis"
-                })
-        
-        except Exception as ai_error:
-            logger.error(f"AI recommendation error: {ai_error}")
-            # Continue with rule-based only
-        
-        # Merge recommendations (AI gets higher priority)
-        recommendations.extend(rule_based)
-        
-        # Sort by priority (AI recommendations get +2 bonus)
-        for rec in recommendations:
-            if rec["type"] == "ai":
-                rec["priority"] += 2
-        
-        recommendations.sort(key=lambda x: x["priority"], reverse=True)
-        
-        return recommendations[:5]  # Return top 5
-        
+        # Never waits on the LLM: AI picks come from cache and refresh in the background
+        return await recommendation_service.get_recommendations(user_id)
     except Exception as e:
         logger.error(f"Recommendations error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/investments/recommendations/cache-stats")
+async def get_recommendation_cache_stats():
+    """Hit/miss counters of the AI recommendation cache"""
+    return recommendation_service.get_stats()
+
+@api_router.on_event("shutdown")
+async def shutdown_recommendations():
+    """Cancel AI recommendation refreshes still in flight and close the LLM connection pool"""
+    await recommendation_service.close()
+    await llm_gateway.close()
+
+# ============= LLM GATEWAY ROUTES =============
+@api_router.get("/llm/metrics")
+async def get_llm_metrics():
+    """Per-persona LLM call counts, token totals and latency percentiles"""
+    return llm_gateway.get_metrics()
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -0,0 +1,640 @@
+"""
+Spending Rollups
+Per-user daily and monthly transaction totals maintained next to raw transactions
+
+Each document in `spending_rollups` holds total/count for one
+(user, granularity, period, transaction_type, category, merchant). Analytics
+read whole days and months from here and only scan raw `transactions` for the
+partial days at the edges of a range, so their cost no longer grows with the
+length of a user's history.
+
+Rollups are updated incrementally on transaction insert and can be rebuilt
+from raw transactions at any time:
+    python spending_rollups.py [--user-id <id>]
+
+A rebuild writes a new generation of rollup documents next to the current
+one and only then points the user's marker at it, so readers in every
+worker keep seeing a complete generation. The marker also holds a rebuild
+lease: transactions recorded while a rebuild runs mark it dirty instead of
+incrementing, and a dirty build is redone before it is published, so no
+transaction is lost or counted twice. The marker's _id is derived from the
+user id, so the lease is exclusive even if the secondary indexes are missing.
+"""
+import os
+import uuid
+import asyncio
+import argparse
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+ROLLUPS_COLLECTION = "spending_rollups"
+
+# Fields that identify one rollup document
+ROLLUP_KEY_FIELDS = ["user_id", "granularity", "generation", "period", "transaction_type", "category", "merchant"]
+
+# Per-user marker document (_id "built:<user_id>"): current_generation once rollups are
+# built, plus the rebuild lease. It has no generation/period/..., so rollup reads never match it.
+BUILT_MARKER = "built"
+
+# A rebuild lease not released by then (crashed worker) may be taken over
+ROLLUP_REBUILD_LEASE_SECONDS = int(os.environ.get("ROLLUP_REBUILD_LEASE_SECONDS", "600"))
+
+# (keys, options) for the rollups collection: the unique key used by upserts/$merge, and the read path
+ROLLUP_INDEXES = [
+    ([(field, 1) for field in ROLLUP_KEY_FIELDS], {"unique": True, "name": "rollup_generation_key"}),
+    ([("user_id", 1), ("generation", 1), ("granularity", 1), ("transaction_type", 1), ("period", 1)],
+     {"name": "rollup_generation_read"}),
+]
+
+# Pre-generation indexes; the old unique key would reject a second generation's documents
+ROLLUP_OBSOLETE_INDEXES = ["rollup_key", "rollup_read"]
+
+
+def to_naive_utc(dt: datetime) -> datetime:
+    """Stored dates and rollup periods are naive UTC; convert aware inputs to match"""
+    if dt.tzinfo is None:
+        return dt
+    return dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def day_floor(dt: datetime) -> datetime:
+    return datetime(dt.year, dt.month, dt.day)
+
+
+def day_ceil(dt: datetime) -> datetime:
+    floor = day_floor(dt)
+    return floor if floor == dt else floor + timedelta(days=1)
+
+
+def month_floor(dt: datetime) -> datetime:
+    return datetime(dt.year, dt.month, 1)
+
+
+def month_ceil(dt: datetime) -> datetime:
+    floor = month_floor(dt)
+    if floor == dt:
+        return floor
+    return datetime(dt.year + 1, 1, 1) if dt.month == 12 else datetime(dt.year, dt.month + 1, 1)
+
+
+def split_range(
+    start: datetime,
+    end: Optional[datetime],
+    use_months: bool = True
+) -> Tuple[List[tuple], List[tuple], List[tuple]]:
+    """
+    Split [start, end) into (raw, day, month) sub-ranges
+
+    Partial days at either edge must be read from raw transactions; whole days
+    come from daily rollups and, with use_months, whole months from monthly
+    rollups. end=None means open-ended. Aware bounds are converted to naive UTC.
+    """
+    start = to_naive_utc(start)
+    end = to_naive_utc(end) if end is not None else None
+    first_day = day_ceil(start)
+    last_day = day_floor(end) if end is not None else None
+
+    if last_day is not None and first_day >= last_day:
+        return [(start, end)], [], []
+
+    raw_ranges = []
+    if start < first_day:
+        raw_ranges.append((start, first_day))
+    if last_day is not None and last_day < end:
+        raw_ranges.append((last_day, end))
+
+    if not use_months:
+        return raw_ranges, [(first_day, last_day)], []
+
+    first_month = month_ceil(first_day)
+    last_month = month_floor(last_day) if last_day is not None else None
+
+    if last_month is not None and first_month >= last_month:
+        return raw_ranges, [(first_day, last_day)], []
+
+    day_ranges = []
+    if first_day < first_month:
+        day_ranges.append((first_day, first_month))
+    if last_month is not None and last_month < last_day:
+        day_ranges.append((last_month, last_day))
+
+    return raw_ranges, day_ranges, [(first_month, last_month)]
+
+
+def range_filter(start: datetime, end: Optional[datetime]) -> Dict:
+    """Mongo range condition for [start, end)"""
+    condition = {"$gte": start}
+    if end is not None:
+        condition["$lt"] = end
+    return condition
+
+
+class SpendingRollups:
+    """Maintains and queries the spending_rollups collection"""
+
+    def __init__(self, db):
+        self.db = db
+        self.collection = db[ROLLUPS_COLLECTION]
+        # user_id -> background rebuild started by record_transactions
+        self._rebuilding: Dict[str, asyncio.Task] = {}
+
+    async def ensure_indexes(self):
+        """Create the unique key index used by upserts/$merge and the read index"""
+        existing = await self.collection.index_information()
+        for name in ROLLUP_OBSOLETE_INDEXES:
+            if name in existing:
+                await self.collection.drop_index(name)
+        await self.migrate_markers()
+        for keys, options in ROLLUP_INDEXES:
+            await self.collection.create_index(keys, **options)
+
+    async def migrate_markers(self):
+        """Re-key markers written with a generated _id onto their "built:<user_id>" _id"""
+        async for marker in self.collection.find({"granularity": BUILT_MARKER, "_id": {"$type": "objectId"}}):
+            await self.collection.delete_one({"_id": marker["_id"]})
+            marker["_id"] = self._marker_id(marker["user_id"])
+            try:
+                await self.collection.insert_one(marker)
+            except DuplicateKeyError:
+                pass
+
+    # ============= MAINTENANCE =============
+
+    @staticmethod
+    def _marker_id(user_id: str) -> str:
+        return f"{BUILT_MARKER}:{user_id}"
+
+    def _marker_filter(self, user_id: str) -> Dict:
+        return {"_id": self._marker_id(user_id)}
+
+    async def _marker(self, user_id: str) -> Optional[Dict]:
+        return await self.collection.find_one(self._marker_filter(user_id))
+
+    @staticmethod
+    def _lease_active(marker: Optional[Dict]) -> bool:
+        return bool(marker and marker.get("rebuild_id") and marker.get("rebuilding_until", datetime.min) > datetime.utcnow())
+
+    async def current_generation(self, user_id: str) -> Optional[str]:
+        """
+        Generation readers should use, or None if rollups were never built
+
+        Read from the marker on every call rather than cached per process, so
+        a rebuild finished by another worker is seen immediately.
+        """
+        marker = await self.collection.find_one(self._marker_filter(user_id), {"current_generation": 1})
+        return marker.get("current_generation") if marker else None
+
+    async def _acquire_lease(self, user_id: str, lease_id: str) -> bool:
+        """Take the user's rebuild lease; False if another rebuild holds it"""
+        # Create the marker first: concurrent upserts of one _id cannot produce two markers
+        try:
+            await self.collection.update_one(
+                self._marker_filter(user_id),
+                {"$setOnInsert": {"user_id": user_id, "granularity": BUILT_MARKER}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            pass   # another worker inserted it first
+
+        # Then claim it only if no lease is live, atomically on the one document
+        now = datetime.utcnow()
+        marker = await self.collection.find_one_and_update(
+            {
+                **self._marker_filter(user_id),
+                "$or": [{"rebuilding_until": {"$exists": False}}, {"rebuilding_until": {"$lt": now}}]
+            },
+            {"$set": {
+                "rebuild_id": lease_id,
+                "rebuilding_until": now + timedelta(seconds=ROLLUP_REBUILD_LEASE_SECONDS),
+                "dirty": False
+            }},
+            projection={"rebuild_id": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        return marker is not None and marker.get("rebuild_id") == lease_id
+
+    async def _mark_dirty(self, user_id: str) -> bool:
+        """Ask the running rebuild to build again; False if no rebuild is running"""
+        marker = await self._marker(user_id)
+        if not self._lease_active(marker):
+            return False
+        result = await self.collection.update_one(
+            {**self._marker_filter(user_id), "rebuild_id": marker["rebuild_id"]},
+            {"$set": {"dirty": True}}
+        )
+        return result.matched_count == 1
+
+    async def _build_generation(self, user_id: str, generation: str):
+        """Aggregate raw transactions into a new, unpublished generation of rollups"""
+        for granularity, period_parts in [
+            ("day", {"year": {"$year": "$date"}, "month": {"$month": "$date"}, "day": {"$dayOfMonth": "$date"}}),
+            ("month", {"year": {"$year": "$date"}, "month": {"$month": "$date"}, "day": 1})
+        ]:
+            pipeline = [
+                {"$match": {"user_id": user_id}},
+                {"$group": {
+                    "_id": {
+                        "period": {"$dateFromParts": period_parts},
+                        "transaction_type": "$transaction_type",
+                        "category": "$category",
+                        "merchant": "$merchant"
+                    },
+                    "total": {"$sum": "$amount"},
+                    "count": {"$sum": 1}
+                }},
+                {"$project": {
+                    "_id": 0,
+                    "user_id": user_id,
+                    "granularity": granularity,
+                    "generation": {"$literal": generation},
+                    "period": "$_id.period",
+                    "transaction_type": "$_id.transaction_type",
+                    "category": "$_id.category",
+                    "merchant": "$_id.merchant",
+                    "total": 1,
+                    "count": 1,
+                    "updated_at": "$$NOW"
+                }},
+                {"$merge": {
+                    "into": ROLLUPS_COLLECTION,
+                    "on": ROLLUP_KEY_FIELDS,
+                    "whenMatched": "replace",
+                    "whenNotMatched": "insert"
+                }}
+            ]
+            await self.db.transactions.aggregate(pipeline).to_list(None)
+
+    async def rebuild_user(self, user_id: str):
+        """
+        Recompute a user's daily and monthly rollups from raw transactions
+
+        If another worker is already rebuilding this user, it is marked dirty
+        (so it builds again and includes anything inserted since it started)
+        and this call returns without building.
+        """
+        lease_id = uuid.uuid4().hex
+        while not await self._acquire_lease(user_id, lease_id):
+            if await self._mark_dirty(user_id):
+                return
+            # That rebuild finished between the two calls; try to take the lease again
+
+        marker_filter = {**self._marker_filter(user_id), "rebuild_id": lease_id}
+        generation = None
+        try:
+            while True:
+                generation = uuid.uuid4().hex
+                await self._build_generation(user_id, generation)
+
+                # Publish only if no transactions were recorded while building
+                replaced = await self.collection.find_one_and_update(
+                    {**marker_filter, "dirty": {"$ne": True}},
+                    {
+                        "$set": {"current_generation": generation, "built_at": datetime.utcnow()},
+                        "$unset": {"rebuild_id": "", "rebuilding_until": "", "dirty": ""}
+                    },
+                    projection={"current_generation": 1}
+                )
+                if replaced is not None:
+                    break
+
+                await self.collection.delete_many({"user_id": user_id, "generation": generation})
+                # Clear the flag before aggregating again, so later transactions set it anew
+                retry = await self.collection.update_one(marker_filter, {"$set": {"dirty": False}})
+                if not retry.matched_count:
+                    # Lease lost (expired and taken over, or the user was cleared)
+                    generation = None
+                    return
+        except Exception:
+            if generation:
+                await self.collection.delete_many({"user_id": user_id, "generation": generation})
+            await self.collection.update_one(
+                marker_filter, {"$unset": {"rebuild_id": "", "rebuilding_until": "", "dirty": ""}}
+            )
+            raise
+
+        # Keep the generation just replaced for reads already in flight; older ones
+        # (and stray increments into them) are no longer read
+        await self.collection.delete_many({
+            "user_id": user_id,
+            "granularity": {"$ne": BUILT_MARKER},
+            "generation": {"$nin": [generation, replaced.get("current_generation")]}
+        })
+
+    async def rebuild_all(self) -> int:
+        """Backfill job: rebuild rollups for every user; returns users processed"""
+        count = 0
+        async for user in self.db.users.find({}, {"_id": 1}):
+            await self.rebuild_user(str(user["_id"]))
+            count += 1
+            if count % 100 == 0:
+                logger.info(f"Rebuilt spending rollups for {count} users")
+        logger.info(f"Rebuilt spending rollups for {count} users")
+        return count
+
+    def schedule_rebuild(self, user_id: str):
+        """Rebuild a user's rollups in the background unless this process already is"""
+        if user_id in self._rebuilding:
+            return
+        task = asyncio.create_task(self._rebuild_in_background(user_id))
+        self._rebuilding[user_id] = task
+        task.add_done_callback(lambda _: self._rebuilding.pop(user_id, None))
+
+    async def _rebuild_in_background(self, user_id: str):
+        try:
+            await self.rebuild_user(user_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Background rollup rebuild failed for user {user_id}: {e}")
+
+    async def close(self):
+        """Cancel background rebuilds; their leases expire and the next rebuild takes over"""
+        for task in list(self._rebuilding.values()):
+            task.cancel()
+
+    async def record_transactions(self, transactions: List[Dict]):
+        """
+        Fold newly inserted transactions into the rollups
+
+        A rebuild running right now may or may not have seen these
+        transactions, so it is marked dirty (and builds again) instead of
+        being incremented. Users whose rollups were never built get a
+        background rebuild; until it publishes, their reads scan raw
+        transactions, so the caller never waits on the aggregation.
+        """
+        by_user: Dict[str, List[Dict]] = {}
+        for txn in transactions:
+            by_user.setdefault(txn["user_id"], []).append(txn)
+
+        for user_id, user_txns in by_user.items():
+            marker = await self._marker(user_id)
+            if self._lease_active(marker):
+                if await self._mark_dirty(user_id):
+                    continue
+                # That rebuild published in the meantime; increment what it published
+                marker = await self._marker(user_id)
+            generation = marker.get("current_generation") if marker else None
+            if generation is None:
+                self.schedule_rebuild(user_id)
+                continue
+
+            increments: Dict[tuple, List[float]] = {}
+            for txn in user_txns:
+                for granularity, period in [("day", day_floor(txn["date"])), ("month", month_floor(txn["date"]))]:
+                    key = (granularity, period, txn.get("transaction_type"), txn.get("category"), txn.get("merchant"))
+                    totals = increments.setdefault(key, [0, 0])
+                    totals[0] += txn.get("amount", 0)
+                    totals[1] += 1
+
+            # A rebuild that starts after this point aggregates these (already inserted)
+            # transactions itself; increments landing in the generation it replaces are dropped with it
+            now = datetime.utcnow()
+            operations = [
+                UpdateOne(
+                    {
+                        "user_id": user_id,
+                        "granularity": granularity,
+                        "generation": generation,
+                        "period": period,
+                        "transaction_type": transaction_type,
+                        "category": category,
+                        "merchant": merchant
+                    },
+                    {"$inc": {"total": total, "count": count}, "$set": {"updated_at": now}},
+                    upsert=True
+                )
+                for (granularity, period, transaction_type, category, merchant), (total, count) in increments.items()
+            ]
+            await self.collection.bulk_write(operations, ordered=False)
+
+    async def clear_user(self, user_id: str):
+        """Remove all rollups for a deleted user"""
+        await self.collection.delete_many({"user_id": user_id})
+
+    # ============= QUERIES =============
+
+    def _type_filter(self, transaction_type: Optional[str]) -> Dict:
+        return {"transaction_type": transaction_type} if transaction_type else {}
+
+    async def totals_by(
+        self,
+        user_id: str,
+        start: datetime,
+        end: Optional[datetime],
+        group_field: Optional[str],
+        transaction_type: Optional[str] = "expense"
+    ) -> Dict:
+        """
+        Total/count per group_field value (None = one overall group) over [start, end)
+
+        Returns {key: {"total", "count", "category"}}; "category" is one
+        category seen for the key, used by the merchant leaderboard.
+        """
+        generation = await self.current_generation(user_id)
+        if generation:
+            raw_ranges, day_ranges, month_ranges = split_range(start, end)
+        else:
+            raw_ranges, day_ranges, month_ranges = [(start, end)], [], []
+
+        group_id = f"${group_field}" if group_field else None
+        group_stage = {
+            "_id": group_id,
+            "total": {"$sum": "$amount"},
+            "count": {"$sum": 1},
+            "category": {"$first": "$category"}
+        }
+        queries = []
+
+        if raw_ranges:
+            queries.append(self.db.transactions.aggregate([
+                {"$match": {
+                    "user_id": user_id,
+                    **self._type_filter(transaction_type),
+                    "$or": [{"date": range_filter(s, e)} for s, e in raw_ranges]
+                }},
+                {"$group": group_stage}
+            ]).to_list(None))
+
+        rollup_ranges = (
+            [{"granularity": "day", "period": range_filter(s, e)} for s, e in day_ranges] +
+            [{"granularity": "month", "period": range_filter(s, e)} for s, e in month_ranges]
+        )
+        if rollup_ranges:
+            queries.append(self.collection.aggregate([
+                {"$match": {
+                    "user_id": user_id,
+                    "generation": generation,
+                    **self._type_filter(transaction_type),
+                    "$or": rollup_ranges
+                }},
+                {"$group": {**group_stage, "total": {"$sum": "$total"}, "count": {"$sum": "$count"}}}
+            ]).to_list(None))
+
+        merged: Dict = {}
+        for rows in await asyncio.gather(*queries):
+            for row in rows:
+                entry = merged.setdefault(row["_id"], {"total": 0, "count": 0, "category": row.get("category")})
+                entry["total"] += row["total"]
+                entry["count"] += row["count"]
+        return merged
+
+    async def bucket_totals(
+        self,
+        user_id: str,
+        buckets: List[tuple],
+        transaction_type: Optional[str] = "expense"
+    ) -> List[Dict]:
+        """
+        Total/count for each [start, end) bucket, in bucket order
+
+        At most two queries regardless of bucket count: one over daily rollups
+        for the whole days, one conditional-sum aggregation over raw
+        transactions for the partial days at bucket edges. Buckets may overlap.
+        """
+        results = [{"total": 0, "count": 0} for _ in buckets]
+        if not buckets:
+            return results
+
+        generation = await self.current_generation(user_id)
+        raw_pieces = []   # (bucket index, start, end)
+        day_pieces = []
+        for idx, (bucket_start, bucket_end) in enumerate(buckets):
+            if generation:
+                raw_ranges, day_ranges, _ = split_range(bucket_start, bucket_end, use_months=False)
+            else:
+                raw_ranges, day_ranges = [(bucket_start, bucket_end)], []
+            raw_pieces.extend((idx, s, e) for s, e in raw_ranges)
+            day_pieces.extend((idx, s, e) for s, e in day_ranges)
+
+        queries = []
+        if raw_pieces:
+            group_stage = {"_id": None}
+            for piece_idx, (_, piece_start, piece_end) in enumerate(raw_pieces):
+                in_piece = {"$and": [
+                    {"$gte": ["$date", piece_start]},
+                    {"$lt": ["$date", piece_end]}
+                ]}
+                group_stage[f"total_{piece_idx}"] = {"$sum": {"$cond": [in_piece, "$amount", 0]}}
+                group_stage[f"count_{piece_idx}"] = {"$sum": {"$cond": [in_piece, 1, 0]}}
+            queries.append(self.db.transactions.aggregate([
+                {"$match": {
+                    "user_id": user_id,
+                    **self._type_filter(transaction_type),
+                    "$or": [{"date": range_filter(s, e)} for _, s, e in raw_pieces]
+                }},
+                {"$group": group_stage}
+            ]).to_list(1))
+
+        if day_pieces:
+            queries.append(self.collection.aggregate([
+                {"$match": {
+                    "user_id": user_id,
+                    "generation": generation,
+                    "granularity": "day",
+                    **self._type_filter(transaction_type),
+                    "period": range_filter(min(s for _, s, _ in day_pieces), max(e for _, _, e in day_pieces))
+                }},
+                {"$group": {"_id": "$period", "total": {"$sum": "$total"}, "count": {"$sum": "$count"}}}
+            ]).to_list(None))
+
+        rows = await asyncio.gather(*queries)
+
+        if raw_pieces:
+            raw_row = rows[0][0] if rows[0] else {}
+            for piece_idx, (bucket_idx, _, _) in enumerate(raw_pieces):
+                results[bucket_idx]["total"] += raw_row.get(f"total_{piece_idx}", 0)
+                results[bucket_idx]["count"] += raw_row.get(f"count_{piece_idx}", 0)
+
+        if day_pieces:
+            for day in rows[-1]:
+                for bucket_idx, piece_start, piece_end in day_pieces:
+                    if piece_start <= day["_id"] < piece_end:
+                        results[bucket_idx]["total"] += day["total"]
+                        results[bucket_idx]["count"] += day["count"]
+
+        return results
+
+    async def daily_totals(
+        self,
+        user_id: str,
+        start: datetime,
+        end: Optional[datetime] = None,
+        transaction_type: Optional[str] = "expense"
+    ) -> Dict[datetime, Dict]:
+        """Total/count per calendar day over [start, end), keyed by the day's midnight"""
+        generation = await self.current_generation(user_id)
+        if generation:
+            raw_ranges, day_ranges, _ = split_range(start, end, use_months=False)
+        else:
+            raw_ranges, day_ranges = [(start, end)], []
+
+        day_of_txn = {"$dateFromParts": {
+            "year": {"$year": "$date"}, "month": {"$month": "$date"}, "day": {"$dayOfMonth": "$date"}
+        }}
+        queries = []
+        if raw_ranges:
+            queries.append(self.db.transactions.aggregate([
+                {"$match": {
+                    "user_id": user_id,
+                    **self._type_filter(transaction_type),
+                    "$or": [{"date": range_filter(s, e)} for s, e in raw_ranges]
+                }},
+                {"$project": {"_id": 0, "date": 1, "amount": 1}},
+                {"$group": {"_id": day_of_txn, "total": {"$sum": "$amount"}, "count": {"$sum": 1}}}
+            ]).to_list(None))
+        if day_ranges:
+            queries.append(self.collection.aggregate([
+                {"$match": {
+                    "user_id": user_id,
+                    "generation": generation,
+                    "granularity": "day",
+                    **self._type_filter(transaction_type),
+                    "$or": [{"period": range_filter(s, e)} for s, e in day_ranges]
+                }},
+                {"$group": {"_id": "$period", "total": {"$sum": "$total"}, "count": {"$sum": "$count"}}}
+            ]).to_list(None))
+
+        days: Dict[datetime, Dict] = {}
+        for rows in await asyncio.gather(*queries):
+            for row in rows:
+                entry = days.setdefault(row["_id"], {"total": 0, "count": 0})
+                entry["total"] += row["total"]
+                entry["count"] += row["count"]
+        return days
+
+
+async def main():
+    """Backfill job: rebuild spending rollups for one or all users"""
+    from pathlib import Path
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Rebuild spending rollups from raw transactions")
+    parser.add_argument("--user-id", help="rebuild a single user (default: all users)")
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    rollups = SpendingRollups(client[os.environ['DB_NAME']])
+    try:
+        await rollups.ensure_indexes()
+        if args.user_id:
+            await rollups.rebuild_user(args.user_id)
+            print(f"Rebuilt spending rollups for user {args.user_id}")
+        else:
+            count = await rollups.rebuild_all()
+            print(f"Rebuilt spending rollups for {count} users")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
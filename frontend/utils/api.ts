@@ -28,6 +28,28 @@ export const api = {
     return response.json();
   },
   
+  // Get a page of transactions ({ transactions, next_cursor }); pass next_cursor back for the next page
+  getTransactionsPage: async (
+    userId: string,
+    limit = 100,
+    cursor?: string,
+    filters: {
+      category?: string;
+      merchant?: string;
+      transaction_type?: 'income' | 'expense';
+      min_amount?: number;
+      max_amount?: number;
+    } = {}
+  ) => {
+    let url = `${API_URL}/api/transactions/page?user_id=${userId}&limit=${limit}`;
+    if (cursor) url += `&cursor=${encodeURIComponent(cursor)}`;
+    Object.entries(filters).forEach(([key, value]) => {
+      if (value !== undefined && value !== '') url += `&${key}=${encodeURIComponent(String(value))}`;
+    });
+    const response = await fetch(url);
+    return response.json();
+  },
+  
   // Get category breakdown
   getCategoryBreakdown: async (userId: string, months = 1) => {
     const response = await fetch(`${API_URL}/api/transactions/category-breakdown?user_id=${userId}&months=${months}`);
@@ -0,0 +1,25 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# Backend modules import each other as top-level modules (run from backend/)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+
+def _merge_stage(in_collection, database, options):
+    """The subset of $merge spending_rollups uses (mongomock does not implement the stage)"""
+    assert options.get("whenMatched") == "replace" and options.get("whenNotMatched") == "insert"
+    target = database.get_collection(options["into"])
+    for doc in in_collection:
+        target.replace_one({field: doc.get(field) for field in options["on"]}, doc, upsert=True)
+    return []
+
+
+@pytest.fixture
+def mongo_db(monkeypatch):
+    """In-memory Motor-compatible database"""
+    mongomock_aggregate = pytest.importorskip("mongomock.aggregate")
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    monkeypatch.setitem(mongomock_aggregate._PIPELINE_HANDLERS, "$merge", _merge_stage)
+    return mongomock_motor.AsyncMongoMockClient()["test"]
@@ -0,0 +1,37 @@
+import json
+
+from chat_streaming import SummaryStreamExtractor, sse_event
+
+
+def stream(text: str, step: int = 1) -> str:
+    extractor = SummaryStreamExtractor()
+    out = "".join(extractor.feed(text[i:i + step]) for i in range(0, len(text), step))
+    return out + extractor.flush()
+
+
+def test_escaped_emoji_fed_one_character_at_a_time():
+    summary = "Spending up 📊 this month — see 💸"
+    reply = json.dumps({"summary": summary, "options": ["More"]})
+    assert "\\ud83d\\udcca" in reply
+
+    extracted = stream(reply)
+
+    assert extracted == summary
+    sse_event("token", {"text": extracted}).encode("utf-8")
+
+
+def test_plain_escapes_and_bmp_characters():
+    summary = 'Line one\n"quoted" ₹450 \\ done'
+    assert stream(json.dumps({"summary": summary})) == summary
+    assert stream(json.dumps({"summary": summary}), step=3) == summary
+
+
+def test_lone_surrogates_are_replaced():
+    assert stream('{"summary": "a\\ud83db"}') == "a�b"
+    assert stream('{"summary": "a\\udcca"}') == "a�"
+    assert stream('{"summary": "a\\ud83d\\n"}') == "a�\n"
+    sse_event("token", {"text": stream('{"summary": "\\ud83d"}')}).encode("utf-8")
+
+
+def test_invalid_hex_escape_is_kept_as_text():
+    assert stream('{"summary": "bad \\uZZ12 escape"}') == "bad \\uZZ12 escape"
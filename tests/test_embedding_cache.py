@@ -0,0 +1,84 @@
+import asyncio
+
+import numpy as np
+
+from embedder_service import BaseEmbedder, CachedEmbedder, EmbeddingCache, MicroBatchEmbedder
+
+
+class CountingEmbedder(BaseEmbedder):
+    model_name = "counting"
+    dimensions = 2
+
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, texts, show_progress_bar=False):
+        self.calls.append(list(texts))
+        return np.array([[len(text), 1.0] for text in texts], dtype=np.float32)
+
+
+def test_lru_evicts_least_recently_used():
+    cache = EmbeddingCache(max_size=2)
+    cache.put("m", "a", [1.0])
+    cache.put("m", "b", [2.0])
+    assert cache.get("m", "a") == [1.0]
+
+    cache.put("m", "c", [3.0])
+
+    assert cache.get("m", "b") is None
+    assert cache.get("m", "a") == [1.0] and cache.get("m", "c") == [3.0]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_keys_include_the_model_name():
+    cache = EmbeddingCache(max_size=10)
+    cache.put("model-a", "text", [1.0])
+
+    assert cache.get("model-b", "text") is None
+    assert cache.get("model-a", "text") == [1.0]
+
+
+def test_only_distinct_misses_reach_the_model_in_one_batch():
+    model = CountingEmbedder()
+    embedder = CachedEmbedder(model, EmbeddingCache(max_size=100))
+    embedder.encode(["budget"])
+
+    result = embedder.encode(["budget", "goa trip", "budget", "salary", "goa trip"])
+
+    assert model.calls == [["budget"], ["goa trip", "salary"]]
+    assert result == [[6.0, 1.0], [8.0, 1.0], [6.0, 1.0], [6.0, 1.0], [8.0, 1.0]]
+    # Cached as plain lists, not arrays
+    assert all(isinstance(embedding, list) for embedding in result)
+    stats = embedder.cache.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 4)
+
+
+def test_warm_prefills_the_cache():
+    model = CountingEmbedder()
+    embedder = CachedEmbedder(model, EmbeddingCache(max_size=100))
+
+    assert embedder.warm(["monthly budget", "travel goals", "monthly budget"]) == 2
+    assert embedder.warm(["monthly budget"]) == 0
+
+    embedder.encode(["travel goals"])
+    assert model.calls == [["monthly budget", "travel goals"]]
+
+
+def test_encode_async_sends_misses_through_the_batcher():
+    async def scenario():
+        model = CountingEmbedder()
+        batcher = MicroBatchEmbedder(model, max_batch_size=64, max_wait_ms=10)
+        embedder = CachedEmbedder(batcher, EmbeddingCache(max_size=100))
+        try:
+            first, second = await asyncio.gather(
+                embedder.encode_async(["a", "bb"]),
+                embedder.encode_async(["ccc"]),
+            )
+            again = await embedder.encode_async(["bb", "ccc"])
+        finally:
+            batcher.close()
+
+        assert (first, second, again) == ([[1.0, 1.0], [2.0, 1.0]], [[3.0, 1.0]], [[2.0, 1.0], [3.0, 1.0]])
+        assert model.calls == [["a", "bb", "ccc"]]
+
+    asyncio.run(scenario())
@@ -0,0 +1,119 @@
+import base64
+
+import numpy as np
+import pytest
+
+pytest.importorskip("fastapi")
+httpx = pytest.importorskip("httpx")
+from fastapi.testclient import TestClient  # noqa: E402
+
+import embedding_sidecar  # noqa: E402
+from embedder_service import (  # noqa: E402
+    BaseEmbedder, CachedEmbedder, EmbedderAgent, EmbeddingCache, MicroBatchEmbedder, NumpyVectorStore
+)
+from embedding_sidecar import (  # noqa: E402
+    RemoteEmbedder, RemoteQueryEmbedder, RemoteVectorStore, SidecarClient, pack_vectors, unpack_vectors
+)
+
+
+class CountingEmbedder(BaseEmbedder):
+    model_name = "counting"
+    dimensions = 2
+
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, texts, show_progress_bar=False):
+        self.calls.append(list(texts))
+        return np.array([[len(text), 0.5] for text in texts], dtype=np.float32)
+
+
+@pytest.fixture
+def sidecar(monkeypatch, tmp_path):
+    """SidecarClient talking to the sidecar app in-process, backed by a NumPy store"""
+    monkeypatch.setenv("MONGO_URL", "mongodb://localhost:27017")
+    monkeypatch.setenv("DB_NAME", "test")
+    agent = EmbedderAgent(use_sidecar=False)
+    agent._store = NumpyVectorStore(tmp_path)
+    agent._model = CountingEmbedder()
+    agent._query_model = CachedEmbedder(MicroBatchEmbedder(agent._model), EmbeddingCache(100))
+    agent._rag_enabled = True
+    agent._loaded = True
+    monkeypatch.setattr(embedding_sidecar, "EmbedderAgent", lambda use_sidecar: agent)
+
+    client = SidecarClient(url="http://testserver")
+    client.http.close()
+    with TestClient(embedding_sidecar.app) as http:
+        client.http = http
+        yield client, agent
+    agent._query_model.embedder.close()
+    agent.mongo_client.close()
+
+
+def test_vectors_travel_as_base64_float32():
+    vectors = [[0.1, -2.5, 3.0], [4.0, 5.25, -6.0]]
+
+    payload = pack_vectors(vectors)
+
+    assert payload["shape"] == [2, 3]
+    assert len(base64.b64decode(payload["data"])) == 2 * 3 * 4
+    np.testing.assert_array_equal(unpack_vectors(payload), np.asarray(vectors, dtype=np.float32))
+    assert unpack_vectors(pack_vectors(np.ones((1, 3)))) == [[1.0, 1.0, 1.0]]
+    assert unpack_vectors(pack_vectors([])) == []
+
+
+def test_client_requires_a_url():
+    with pytest.raises(ValueError, match="EMBEDDING_SIDECAR_URL"):
+        SidecarClient(url="")
+
+
+def test_remote_embedder_encodes_in_the_sidecar(sidecar):
+    client, agent = sidecar
+    embedder = RemoteEmbedder(client)
+
+    assert (embedder.model_name, embedder.dimensions, embedder.rag_enabled) == ("counting", 2, True)
+    assert embedder.store_backend == agent.store.backend_name
+    assert embedder.encode(["abc", "hello"]) == [[3.0, 0.5], [5.0, 0.5]]
+    assert embedder.encode([]) == []
+
+    # Query encodes go through the sidecar's cache: the repeat never reaches the model
+    query_embedder = RemoteQueryEmbedder(embedder)
+    assert query_embedder.encode(["budget"]) == [[6.0, 0.5]]
+    assert query_embedder.encode(["budget"]) == [[6.0, 0.5]]
+    assert agent.model.calls == [["abc", "hello"], ["budget"]]
+
+
+def test_remote_vector_store_round_trip(sidecar):
+    client, agent = sidecar
+    store = RemoteVectorStore(client, "numpy")
+
+    store.upsert(
+        ["u1_a", "u1_b"],
+        [[1.0, 0.0], [0.0, 1.0]],
+        ["doc a", "doc b"],
+        [{"user_id": "u1", "chunk_type": "goal"}, {"user_id": "u1", "chunk_type": "insight"}],
+    )
+
+    assert store.count() == agent.store.count() == 2
+    assert store.get("u1")["ids"] == ["u1_a", "u1_b"]
+    result = store.query([[0.0, 0.9]], n_results=1, user_id="u1")
+    assert result["ids"] == [["u1_b"]] and result["documents"] == [["doc b"]]
+
+    store.delete("u1", ["u1_a"])
+    assert agent.store.get("u1")["ids"] == ["u1_b"]
+    assert store.delete_user("u1") == 1
+    assert store.count() == 0
+    assert store.backend_name == "numpy (sidecar)"
+
+
+def test_sidecar_errors_reach_the_worker(sidecar):
+    client, agent = sidecar
+    store = RemoteVectorStore(client, "numpy")
+
+    def broken(*args):
+        raise RuntimeError("disk full")
+
+    agent._store.upsert = broken
+
+    with pytest.raises(httpx.HTTPStatusError):
+        store.upsert(["u1_a"], [[1.0, 0.0]], ["doc a"], [{"user_id": "u1"}])
@@ -0,0 +1,258 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from bson import ObjectId
+
+from embedder_service import BaseEmbedder, EmbedderAgent, NumpyVectorStore, chunk_content_hash
+
+
+class CountingEmbedder(BaseEmbedder):
+    model_name = "counting"
+    dimensions = 2
+
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, texts, show_progress_bar=False):
+        self.calls.append(list(texts))
+        return np.array([[len(text), 1.0] for text in texts], dtype=np.float32)
+
+
+@pytest.fixture
+def agent(monkeypatch, mongo_db, tmp_path):
+    """EmbedderAgent on the in-memory database, a NumPy store and a counting model"""
+    monkeypatch.setenv("MONGO_URL", "mongodb://localhost:27017")
+    monkeypatch.setenv("DB_NAME", "test")
+    agent = EmbedderAgent(use_sidecar=False)
+    agent.mongo_client.close()
+    agent.db = mongo_db
+    agent._store = NumpyVectorStore(tmp_path)
+    agent._model = CountingEmbedder()
+    agent._rag_enabled = True
+    agent._loaded = True
+    return agent
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def add_user(db, name="Asha", transactions=3, goals=1):
+    user_id = (await db.users.insert_one({"name": name, "email": f"{name.lower()}@example.com"})).inserted_id
+    user_id = str(user_id)
+    for i in range(transactions):
+        await db.transactions.insert_one({
+            "user_id": user_id,
+            "date": datetime(2025, 1, 1) + timedelta(days=i),
+            "amount": 100 * (i + 1),
+            "transaction_type": "expense",
+            "category": "Food",
+            "merchant": f"Shop {i}",
+            "description": f"Order {i}",
+        })
+    for i in range(goals):
+        await db.goals.insert_one({"user_id": user_id, "name": f"Goal {i}", "target_amount": 1000, "saved_amount": 100})
+    return user_id
+
+
+def encoded_texts(agent):
+    return [text for call in agent.model.calls for text in call]
+
+
+# ============= CHANGED-CHUNK RE-EMBEDDING =============
+
+def test_first_update_encodes_every_chunk_and_stores_content_hashes(agent):
+    async def scenario():
+        user_id = await add_user(agent.db)
+        assert await agent.update_user_embeddings(user_id)
+
+        stored = agent.store.get(user_id)
+        # profile, summary, 3 transactions, 1 goal
+        assert len(stored["ids"]) == 6
+        assert len(encoded_texts(agent)) == 6
+        for metadata in stored["metadatas"]:
+            assert metadata["content_hash"] and metadata["transaction_id"]
+
+    run(scenario())
+
+
+def test_unchanged_data_is_not_re_encoded(agent):
+    async def scenario():
+        user_id = await add_user(agent.db)
+        await agent.update_user_embeddings(user_id)
+        agent.model.calls.clear()
+
+        update = await agent.prepare_user_update(user_id)
+        await agent.update_user_embeddings(user_id)
+
+        assert update["changed"] == [] and update["stale_ids"] == [] and update["unchanged"] == 6
+        assert agent.model.calls == []
+
+    run(scenario())
+
+
+def test_only_new_and_changed_chunks_are_encoded(agent):
+    async def scenario():
+        user_id = await add_user(agent.db)
+        await agent.update_user_embeddings(user_id)
+        ids_before = set(agent.store.get(user_id)["ids"])
+        agent.model.calls.clear()
+
+        edited = await agent.db.transactions.find_one({"user_id": user_id, "merchant": "Shop 1"})
+        await agent.db.transactions.update_one({"_id": edited["_id"]}, {"$set": {"amount": 999}})
+        new_id = (await agent.db.transactions.insert_one({
+            "user_id": user_id, "date": datetime(2025, 2, 1), "amount": 50,
+            "transaction_type": "expense", "category": "Travel", "merchant": "Uber", "description": "Ride",
+        })).inserted_id
+        await agent.update_user_embeddings(user_id)
+
+        # Transaction chunks are keyed by _id: a new transaction doesn't shift the others
+        assert set(agent.store.get(user_id)["ids"]) == ids_before | {f"{user_id}_txn_{new_id}"}
+        texts = encoded_texts(agent)
+        assert len(texts) == 3
+        assert any("999" in text for text in texts)
+        assert any("Ride" in text for text in texts)
+        assert any(text.startswith("Transaction history: 4") for text in texts)
+
+        stored = agent.store.get(user_id)
+        hashes = {metadata["chunk_type"]: metadata["content_hash"] for metadata in stored["metadatas"]}
+        assert hashes["transactions_summary"] == chunk_content_hash(
+            next(text for text in texts if text.startswith("Transaction history"))
+        )
+
+    run(scenario())
+
+
+def test_chunks_that_no_longer_exist_are_deleted(agent):
+    async def scenario():
+        user_id = await add_user(agent.db, goals=2)
+        await agent.update_user_embeddings(user_id)
+        goal = await agent.db.goals.find_one({"user_id": user_id, "name": "Goal 0"})
+        await agent.db.goals.delete_one({"_id": goal["_id"]})
+        agent.model.calls.clear()
+
+        update = await agent.prepare_user_update(user_id)
+        await asyncio.to_thread(agent.apply_user_updates, [update])
+
+        assert update["stale_ids"] == [f"{user_id}_goal_{goal['_id']}"]
+        assert update["changed"] == []
+        assert f"{user_id}_goal_{goal['_id']}" not in agent.store.get(user_id)["ids"]
+        assert agent.model.calls == []
+
+    run(scenario())
+
+
+def test_section_refresh_leaves_other_sections_alone(agent):
+    async def scenario():
+        user_id = await add_user(agent.db, goals=1)
+        await agent.update_user_embeddings(user_id)
+        await agent.db.goals.delete_many({"user_id": user_id})
+        await agent.db.transactions.delete_many({"user_id": user_id})
+        agent.model.calls.clear()
+
+        # Only goals are re-read; the transactions that disappeared stay stored
+        await agent.update_user_embeddings(user_id, sections=["goals"])
+
+        types = sorted(metadata["chunk_type"] for metadata in agent.store.get(user_id)["metadatas"])
+        assert types == ["profile", "transaction", "transaction", "transaction", "transactions_summary"]
+        assert agent.model.calls == []
+
+    run(scenario())
+
+
+def test_diff_chunks_reads_stored_hashes(agent):
+    agent.store.upsert(
+        ["u1_a", "u1_b"],
+        [[1.0, 0.0], [0.0, 1.0]],
+        ["old a", "b"],
+        [
+            {"user_id": "u1", "chunk_type": "goal", "content_hash": chunk_content_hash("old a")},
+            {"user_id": "u1", "chunk_type": "goal", "content_hash": chunk_content_hash("b")},
+        ],
+    )
+    chunks = [
+        {"id": "u1_a", "text": "new a", "metadata": {"user_id": "u1", "chunk_type": "goal"}},
+        {"id": "u1_c", "text": "c", "metadata": {"user_id": "u1", "chunk_type": "goal"}},
+    ]
+
+    changed, stale_ids = agent.diff_chunks("u1", chunks)
+
+    assert [chunk["id"] for chunk in changed] == ["u1_a", "u1_c"]
+    assert stale_ids == ["u1_b"]
+    assert chunks[0]["metadata"]["content_hash"] == chunk_content_hash("new a")
+
+
+# ============= PIPELINED BULK RE-EMBEDDING =============
+
+def test_bulk_update_streams_every_user(agent):
+    async def scenario():
+        await agent.db.users.insert_many([{"name": f"User {i}"} for i in range(1050)])
+
+        metrics = await agent.update_all_users(fetch_concurrency=32, encode_batch_size=256)
+
+        # Not capped at the old 1000-user to_list limit
+        assert metrics["users_total"] == metrics["users_updated"] == 1050
+        assert metrics["chunks_encoded"] == 1050
+        assert len(agent.user_transactions) == 1050
+        assert agent.store.count() == 1050
+
+    run(scenario())
+
+
+def test_bulk_update_pools_chunks_across_users(agent):
+    async def scenario():
+        user_ids = [await add_user(agent.db, name=f"User{i}") for i in range(8)]
+
+        metrics = await agent.update_all_users(fetch_concurrency=4, encode_batch_size=12)
+
+        # 6 chunks per user, flushed once at least 12 texts are pending
+        assert metrics["chunks_encoded"] == 48
+        assert metrics["encode_batches"] == len(agent.model.calls) < len(user_ids)
+        assert all(len(call) >= 12 for call in agent.model.calls)
+        assert all(len(agent.store.get(user_id)["ids"]) == 6 for user_id in user_ids)
+
+        agent.model.calls.clear()
+        again = await agent.update_all_users(fetch_concurrency=4, encode_batch_size=12)
+        assert (again["chunks_encoded"], again["chunks_unchanged"]) == (0, 48)
+        assert agent.model.calls == []
+
+    run(scenario())
+
+
+def test_bulk_update_counts_failed_users_and_keeps_going(agent, monkeypatch):
+    async def scenario():
+        user_ids = [await add_user(agent.db, name=f"User{i}") for i in range(4)]
+        prepare = agent.prepare_user_update
+
+        async def flaky(user_id, sections=None):
+            if user_id == user_ids[1]:
+                raise RuntimeError("fetch failed")
+            return await prepare(user_id, sections)
+
+        monkeypatch.setattr(agent, "prepare_user_update", flaky)
+        metrics = await agent.update_all_users(fetch_concurrency=2, encode_batch_size=100)
+
+        assert metrics["users_total"] == 4
+        assert (metrics["users_updated"], metrics["users_failed"]) == (3, 1)
+        assert agent.store.get(user_ids[1])["ids"] == []
+        assert metrics["users_per_second"] > 0
+
+    run(scenario())
+
+
+def test_one_apply_call_writes_many_users(agent):
+    async def scenario():
+        user_ids = [await add_user(agent.db, name=f"User{i}", transactions=1, goals=0) for i in range(3)]
+        updates = [await agent.prepare_user_update(user_id) for user_id in user_ids]
+
+        result = agent.apply_user_updates(updates)
+
+        assert result == {"encoded": 9, "deleted": 0}
+        assert len(agent.model.calls) == 1
+        for update in updates:
+            stored = agent.store.get(update["user_id"])
+            assert {metadata["transaction_id"] for metadata in stored["metadatas"]} == {update["transaction_id"]}
+
+    run(scenario())
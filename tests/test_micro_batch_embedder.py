@@ -0,0 +1,120 @@
+import asyncio
+import threading
+
+import pytest
+
+from embedder_service import BaseEmbedder, MicroBatchEmbedder
+
+
+class RecordingEmbedder(BaseEmbedder):
+    """Embeds each text as [its length]; "boom" fails the batch, "short" drops a row"""
+
+    model_name = "recording"
+    dimensions = 1
+
+    def __init__(self, release: threading.Event = None):
+        self.batches = []
+        self.release = release
+
+    def encode(self, texts, show_progress_bar=False):
+        if self.release:
+            self.release.wait(5)
+        self.batches.append(list(texts))
+        if "boom" in texts:
+            raise ValueError("model exploded")
+        embeddings = [[float(len(text))] for text in texts]
+        return embeddings[:-1] if "short" in texts else embeddings
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_requests_share_one_forward_pass():
+    async def scenario():
+        embedder = RecordingEmbedder()
+        batcher = MicroBatchEmbedder(embedder, max_batch_size=64, max_wait_ms=20)
+        try:
+            results = await asyncio.gather(
+                batcher.encode_async(["a", "bb"]),
+                batcher.encode_async(["ccc"]),
+                batcher.encode_async(["dddd", "e"]),
+            )
+        finally:
+            batcher.close()
+
+        assert results == [[[1.0], [2.0]], [[3.0]], [[4.0], [1.0]]]
+        assert embedder.batches == [["a", "bb", "ccc", "dddd", "e"]]
+        assert batcher.get_stats()["batches"] == 1
+
+    run(scenario())
+
+
+def test_batches_respect_max_size_and_keep_order():
+    async def scenario():
+        embedder = RecordingEmbedder()
+        batcher = MicroBatchEmbedder(embedder, max_batch_size=3, max_wait_ms=20)
+        try:
+            results = await asyncio.gather(*(batcher.encode_async([str(i) * (i + 1), "x"]) for i in range(4)))
+        finally:
+            batcher.close()
+
+        assert results == [[[float(i + 1)], [1.0]] for i in range(4)]
+        # A request that would overflow a batch starts the next one instead of being split
+        assert all(len(batch) <= 3 for batch in embedder.batches)
+        assert [text for batch in embedder.batches for text in batch] == \
+            [text for i in range(4) for text in (str(i) * (i + 1), "x")]
+
+    run(scenario())
+
+
+@pytest.mark.parametrize("poison, error", [("boom", ValueError), ("short", RuntimeError)])
+def test_failed_batch_fails_its_callers_and_worker_keeps_serving(poison, error):
+    async def scenario():
+        batcher = MicroBatchEmbedder(RecordingEmbedder(), max_batch_size=64, max_wait_ms=5)
+        try:
+            with pytest.raises(error):
+                await asyncio.wait_for(batcher.encode_async([poison]), 2)
+            worker = batcher._worker
+            assert not worker.done()
+
+            assert await asyncio.wait_for(batcher.encode_async(["ok"]), 2) == [[2.0]]
+            assert batcher._worker is worker
+        finally:
+            batcher.close()
+
+    run(scenario())
+
+
+def test_dead_worker_is_restarted_on_submit():
+    async def scenario():
+        batcher = MicroBatchEmbedder(RecordingEmbedder(), max_batch_size=64, max_wait_ms=1)
+        try:
+            assert await batcher.encode_async(["a"]) == [[1.0]]
+            batcher._worker.cancel()
+            await asyncio.sleep(0)
+            assert batcher._worker.done()
+
+            assert await asyncio.wait_for(batcher.encode_async(["abc"]), 2) == [[3.0]]
+        finally:
+            batcher.close()
+
+    run(scenario())
+
+
+def test_close_fails_queued_requests():
+    async def scenario():
+        release = threading.Event()
+        batcher = MicroBatchEmbedder(RecordingEmbedder(release), max_batch_size=1, max_wait_ms=0)
+        running = asyncio.ensure_future(batcher.encode_async(["first"]))
+        queued = asyncio.ensure_future(batcher.encode_async(["second"]))
+        await asyncio.sleep(0.05)
+
+        batcher.close()
+        release.set()
+
+        for request in (running, queued):
+            with pytest.raises(RuntimeError, match="closed"):
+                await asyncio.wait_for(request, 2)
+
+    run(scenario())
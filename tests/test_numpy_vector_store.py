@@ -0,0 +1,237 @@
+import json
+import threading
+
+import numpy as np
+import pytest
+
+import embedder_service
+from embedder_service import NumpyVectorStore, quantize_int8
+
+DIMENSIONS = 16
+
+
+def vectors(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.normal(size=(count, DIMENSIONS)).astype(np.float32)
+
+
+def upsert(store, user_id, ids, embeddings):
+    store.upsert(
+        ids,
+        [list(map(float, vector)) for vector in embeddings],
+        [f"doc {chunk_id}" for chunk_id in ids],
+        [{"user_id": user_id, "chunk": chunk_id} for chunk_id in ids],
+    )
+
+
+def test_query_returns_nearest_rows_for_the_user(tmp_path):
+    store = NumpyVectorStore(tmp_path)
+    data = vectors(20)
+    upsert(store, "u1", [f"c{i}" for i in range(20)], data)
+    upsert(store, "u2", ["other"], data[:1])
+
+    result = store.query([data[3].tolist(), data[7].tolist()], n_results=3, user_id="u1")
+
+    assert [ids[0] for ids in result["ids"]] == ["c3", "c7"]
+    assert result["documents"][0][0] == "doc c3"
+    assert result["metadatas"][1][0] == {"user_id": "u1", "chunk": "c7"}
+    assert result["distances"][0][0] == pytest.approx(0.0, abs=1e-4)
+    assert all(len(ids) == 3 for ids in result["ids"])
+
+
+def test_write_by_another_worker_is_picked_up(tmp_path):
+    reader = NumpyVectorStore(tmp_path)
+    writer = NumpyVectorStore(tmp_path)
+    upsert(writer, "u1", ["a"], vectors(1))
+    assert reader.get("u1")["ids"] == ["a"]
+
+    upsert(writer, "u1", ["b"], vectors(1, seed=1))
+    writer.delete("u1", ["a"])
+
+    # The reader's cached snapshot is stale by stamp, not by time
+    assert reader.get("u1")["ids"] == ["b"]
+    writer.delete_user("u1")
+    assert reader.get("u1") == {"ids": [], "metadatas": []}
+
+
+def test_each_write_leaves_one_versioned_matrix(tmp_path):
+    store = NumpyVectorStore(tmp_path)
+    for i in range(3):
+        upsert(store, "u1", [f"c{i}"], vectors(1, seed=i))
+
+    matrices = list(tmp_path.glob("*/*.npy"))
+    (meta_path,) = tmp_path.glob("*/*.json")
+    meta = json.loads(meta_path.read_text())
+    assert [path.name for path in matrices] == [meta["matrix"]]
+    assert store.count() == 3
+
+
+def test_legacy_unversioned_matrix_is_readable(tmp_path):
+    store = NumpyVectorStore(tmp_path)
+    data = vectors(2)
+    upsert(store, "u1", ["a", "b"], data)
+    (meta_path,) = tmp_path.glob("*/*.json")
+    meta = json.loads(meta_path.read_text())
+    stem = meta_path.stem
+    (meta_path.parent / meta.pop("matrix")).rename(meta_path.parent / f"{stem}.npy")
+    meta_path.write_text(json.dumps(meta))
+
+    fresh = NumpyVectorStore(tmp_path)
+    assert fresh.query([data[1].tolist()], n_results=1, user_id="u1")["ids"] == [["b"]]
+
+    # The next write moves the user to a versioned matrix and drops the legacy file
+    upsert(fresh, "u1", ["c"], vectors(1, seed=5))
+    assert not (meta_path.parent / f"{stem}.npy").exists()
+    assert fresh.get("u1")["ids"] == ["a", "b", "c"]
+
+
+def test_readers_never_see_rows_from_another_snapshot(tmp_path):
+    writer = NumpyVectorStore(tmp_path)
+    reader = NumpyVectorStore(tmp_path, max_cached_users=1)
+    upsert(writer, "u1", ["c0"], vectors(1))
+    stop = threading.Event()
+    errors = []
+
+    def write():
+        for i in range(1, 40):
+            upsert(writer, "u1", [f"c{i}"], vectors(1, seed=i))
+        stop.set()
+
+    def read():
+        while not stop.is_set():
+            try:
+                snapshot = reader._load("u1")
+                assert snapshot["matrix"].shape[0] == len(snapshot["ids"]) == len(snapshot["documents"])
+                assert snapshot["documents"] == [f"doc {chunk_id}" for chunk_id in snapshot["ids"]]
+            except Exception as e:
+                errors.append(e)
+                return
+
+    threads = [threading.Thread(target=write), threading.Thread(target=read), threading.Thread(target=read)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert len(reader.get("u1")["ids"]) == 40
+
+
+@pytest.mark.skipif(embedder_service.fcntl is None, reason="no flock on this platform")
+def test_workers_writing_one_user_do_not_lose_rows(tmp_path):
+    # Separate instances share no threading lock, like separate uvicorn workers
+    stores = [NumpyVectorStore(tmp_path) for _ in range(4)]
+
+    def write(worker, store):
+        for i in range(10):
+            upsert(store, "u1", [f"w{worker}-{i}"], vectors(1, seed=worker * 100 + i))
+
+    threads = [threading.Thread(target=write, args=(worker, store)) for worker, store in enumerate(stores)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(NumpyVectorStore(tmp_path).get("u1")["ids"]) == sorted(
+        f"w{worker}-{i}" for worker in range(4) for i in range(10)
+    )
+
+
+def test_admin_scan_skips_users_deleted_during_listing(tmp_path):
+    store = NumpyVectorStore(tmp_path)
+    data = vectors(2)
+    upsert(store, "u1", ["a"], data[:1])
+    upsert(store, "u2", ["b"], data[1:])
+    listed = list(tmp_path.glob("*/*.json"))
+    store.delete_user("u2")
+
+    class StaleListing(type(tmp_path)):
+        def glob(self, pattern):
+            return iter(listed)
+
+    store.path = StaleListing(tmp_path)
+
+    assert store._all_user_ids() == ["u1"]
+    assert store.query([data[1].tolist()], n_results=2)["ids"] == [["a"]]
+
+
+# ============= QUANTIZATION =============
+
+def normalized(count, seed=0):
+    data = vectors(count, seed)
+    return data / np.linalg.norm(data, axis=1, keepdims=True)
+
+
+def test_quantize_int8_round_trip():
+    data = vectors(50)
+    data[0] = 0.0
+
+    codes, scales = quantize_int8(data)
+
+    assert codes.dtype == np.int8 and scales.dtype == np.float32
+    assert np.abs(codes).max() <= 127
+    # Per-vector scale: error bounded by half a step of that vector's scale
+    assert (np.abs(codes * scales[:, None] - data) <= scales[:, None] / 2 + 1e-6).all()
+    assert scales[0] == 1.0 and not codes[0].any()
+
+
+@pytest.mark.parametrize("quantization", ["float16", "int8"])
+def test_quantized_search_matches_float32(tmp_path, quantization):
+    data = normalized(200)
+    queries = normalized(10, seed=1)
+    ids = [f"c{i}" for i in range(200)]
+    exact = NumpyVectorStore(tmp_path / "none")
+    quantized = NumpyVectorStore(tmp_path / quantization, quantization=quantization)
+    upsert(exact, "u1", ids, data)
+    upsert(quantized, "u1", ids, data)
+
+    expected = exact.query(queries.tolist(), n_results=5, user_id="u1")
+    result = quantized.query(queries.tolist(), n_results=5, user_id="u1")
+
+    assert [row[0] for row in result["ids"]] == [row[0] for row in expected["ids"]]
+    recall = np.mean([len(set(a) & set(b)) / 5 for a, b in zip(result["ids"], expected["ids"])])
+    assert recall >= 0.8
+    # Distances stay on the float32 scale (int8 keeps the original squared norms)
+    np.testing.assert_allclose(
+        [d[0] for d in result["distances"]], [d[0] for d in expected["distances"]], atol=0.02
+    )
+
+
+def test_int8_rescoring_reorders_coarse_candidates(tmp_path, monkeypatch):
+    data = normalized(100)
+    query = normalized(1, seed=3)
+    store = NumpyVectorStore(tmp_path, quantization="int8", rescore_factor=4)
+    upsert(store, "u1", [f"c{i}" for i in range(100)], data)
+    rescored = []
+    dequantize = NumpyVectorStore._dequantize
+
+    def spy(snapshot, rows=slice(None)):
+        rescored.append(np.shape(rows))
+        return dequantize(snapshot, rows)
+
+    monkeypatch.setattr(NumpyVectorStore, "_dequantize", staticmethod(spy))
+    result = store.query(query.tolist(), n_results=3, user_id="u1")
+
+    # Only rescore_factor x n_results candidates are rescored, at full precision
+    assert rescored == [(1, 12)]
+    exact_order = np.argsort(((data - query) ** 2).sum(axis=1))[:3]
+    assert result["ids"][0] == [f"c{i}" for i in exact_order]
+
+
+def test_rows_written_in_another_mode_are_read_and_converted(tmp_path):
+    data = normalized(5)
+    upsert(NumpyVectorStore(tmp_path), "u1", [f"c{i}" for i in range(5)], data)
+
+    int8_store = NumpyVectorStore(tmp_path, quantization="int8")
+    assert int8_store.query(data[2:3].tolist(), n_results=1, user_id="u1")["ids"] == [["c2"]]
+
+    upsert(int8_store, "u1", ["c5"], normalized(1, seed=9))
+    (meta_path,) = tmp_path.glob("*/*.json")
+    meta = json.loads(meta_path.read_text())
+    assert np.load(meta_path.parent / meta["matrix"]).dtype == np.int8
+    assert len(meta["scales"]) == len(meta["sq_norms"]) == 6
+
+
+def test_unknown_quantization_is_rejected(tmp_path):
+    with pytest.raises(ValueError, match="VECTOR_STORE_QUANTIZATION"):
+        NumpyVectorStore(tmp_path, quantization="int4")
@@ -0,0 +1,66 @@
+"""ONNX int8 embedder vs the sentence-transformers model it was exported from
+
+Skipped unless the exported model is present (python export_onnx_embedder.py).
+"""
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from benchmarks.onnx_embedder import DOCUMENTS, QUERIES
+from embedder_service import ONNX_EMBEDDER_DIR, ONNX_MODEL_FILE
+
+# Same thresholds the benchmark script gates on
+MIN_COSINE = 0.98
+MAX_SIMILARITY_DELTA = 0.05
+
+pytestmark = pytest.mark.skipif(
+    not (Path(ONNX_EMBEDDER_DIR) / ONNX_MODEL_FILE).exists()
+    or not (Path(ONNX_EMBEDDER_DIR) / "tokenizer.json").exists(),
+    reason=f"no exported ONNX embedder in {ONNX_EMBEDDER_DIR}"
+)
+
+
+@pytest.fixture(scope="module")
+def onnx_embedder():
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("tokenizers")
+    from embedder_service import OnnxEmbedder
+    return OnnxEmbedder()
+
+
+@pytest.fixture(scope="module")
+def reference_embedder():
+    pytest.importorskip("sentence_transformers")
+    from embedder_service import SentenceTransformerEmbedder
+    return SentenceTransformerEmbedder()
+
+
+def test_embeddings_are_normalized_and_independent_of_batching(onnx_embedder):
+    texts = DOCUMENTS + QUERIES
+    together = np.asarray(onnx_embedder.encode(texts), dtype=np.float32)
+    one_by_one = np.asarray([onnx_embedder.encode([text])[0] for text in texts], dtype=np.float32)
+
+    assert together.shape == (len(texts), onnx_embedder.dimensions)
+    np.testing.assert_allclose(np.linalg.norm(together, axis=1), 1.0, atol=1e-4)
+    # Length-sorted, padded batches must map back to the caller's order
+    np.testing.assert_allclose(together, one_by_one, atol=1e-4)
+
+
+def test_matches_sentence_transformers(onnx_embedder, reference_embedder):
+    texts = DOCUMENTS + QUERIES
+    reference = np.asarray(reference_embedder.encode(texts), dtype=np.float32)
+    candidate = np.asarray(onnx_embedder.encode(texts), dtype=np.float32)
+
+    per_text = np.einsum("ij,ij->i", reference, candidate) / (
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1)
+    )
+    assert per_text.min() >= MIN_COSINE
+
+    docs, queries = slice(0, len(DOCUMENTS)), slice(len(DOCUMENTS), len(texts))
+    reference_similarity = reference[queries] @ reference[docs].T
+    candidate_similarity = candidate[queries] @ candidate[docs].T
+    assert np.abs(reference_similarity - candidate_similarity).max() <= MAX_SIMILARITY_DELTA
+
+    # Every query still retrieves the same best document
+    assert (reference_similarity.argmax(axis=1) == candidate_similarity.argmax(axis=1)).all()
@@ -0,0 +1,66 @@
+from datetime import datetime
+
+import pytest
+
+from rag_service import QueryRouter, RAGService
+
+NOW = datetime(2025, 3, 12, 15, 30)
+
+
+def classify(query: str) -> dict:
+    return QueryRouter().classify(query, NOW)
+
+
+@pytest.mark.parametrize("query", [
+    "How do I learn about mutual funds?",          # "earn" inside "learn"
+    "Is my insurance premium due?",                # "emi" inside "premium"
+    "When will I get my refund?",                  # "fund" inside "refund"
+    "Why is my account balance lower?",
+    "Tell me about my goals",
+])
+def test_substrings_do_not_trigger_structured_routes(query):
+    assert classify(query)["route"] == "vector"
+
+
+def test_substring_does_not_hide_spending_question():
+    # "fund" in "refund" used to count as another topic and suppress the spending intent
+    result = classify("How much did I get in refunds this month?")
+    assert result["route"] == "structured"
+    assert result["intents"] == ["spending"]
+
+
+def test_credited_is_income_but_credit_card_is_not():
+    assert classify("How much salary was credited last month?")["intents"] == ["income"]
+    assert classify("How much is on my credit card?")["route"] == "vector"
+
+
+def test_spending_question_with_window():
+    result = classify("What did I spend on Food last week?")
+    assert result["route"] == "structured"
+    assert result["intents"] == ["spending"]
+    assert result["window"]["start"] == datetime(2025, 3, 3)
+    assert result["window"]["end"] == datetime(2025, 3, 10)
+
+
+def test_plural_keywords_match():
+    assert classify("Show my expenses by categories")["intents"] == ["spending"]
+    assert classify("Any tips to cut my expenses?")["route"] == "hybrid"
+
+
+def test_open_ended_spending_question_is_hybrid():
+    result = classify("Should I reduce my spending this month?")
+    assert result["route"] == "hybrid"
+    assert result["intents"] == ["spending"]
+
+
+def test_rag_service_routes_everything_to_vector_without_tools():
+    plain = RAGService(embedder_agent=None)
+    with_tools = RAGService(embedder_agent=None, tools=object())
+    try:
+        # probe_semantic_cache only caches vector-routed questions
+        assert plain.classify("How much did I spend today?")["route"] == "vector"
+        assert with_tools.classify("How much did I spend today?")["route"] == "structured"
+        assert with_tools.classify("Tell me about my loans")["route"] == "vector"
+    finally:
+        plain.close()
+        with_tools.close()
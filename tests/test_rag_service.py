@@ -0,0 +1,166 @@
+import asyncio
+import hashlib
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from rag_service import RAGService
+
+
+def embed(text):
+    """Deterministic 8-dimensional stand-in for a sentence embedding"""
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    return [byte / 255 for byte in digest[:8]]
+
+
+class RecordingModel:
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, texts, show_progress_bar=False):
+        self.calls.append(list(texts))
+        return [embed(text) for text in texts]
+
+
+class RecordingStore:
+    """Returns the same two chunks for every query, closer for later queries"""
+
+    def __init__(self):
+        self.calls = []
+
+    def query(self, query_embeddings, n_results, user_id=None):
+        self.calls.append((len(query_embeddings), n_results, user_id))
+        count = len(query_embeddings)
+        return {
+            "ids": [["c1", "c2"] for _ in range(count)],
+            "documents": [["chunk one", "chunk two"] for _ in range(count)],
+            "metadatas": [[{"chunk_type": "goal"}, {"chunk_type": "transaction"}] for _ in range(count)],
+            "distances": [[1.0 - q * 0.1, 2.0] for q in range(count)],
+        }
+
+
+@pytest.fixture
+def rag():
+    agent = SimpleNamespace(query_model=RecordingModel(), store=RecordingStore())
+    service = RAGService(agent)
+    yield service
+    service.close()
+
+
+def test_expanded_queries_are_encoded_and_searched_in_one_call(rag):
+    queries = rag.expand_queries("Can I afford a trip to Goa?")
+    assert len(queries) > 5
+
+    chunks = rag.fetch_relevant_chunks("u1", "Can I afford a trip to Goa?")
+
+    assert rag.embedder.query_model.calls == [queries]
+    assert rag.embedder.store.calls == [(len(queries), 3, "u1")]
+    assert [chunk["id"] for chunk in chunks] == ["c1", "c2"]
+
+
+def test_precomputed_query_embeddings_skip_encoding(rag):
+    queries = rag.expand_queries("How much did I spend?")
+
+    rag.fetch_relevant_chunks("u1", "How much did I spend?", query_embeddings=[embed(q) for q in queries])
+
+    assert rag.embedder.query_model.calls == []
+    assert rag.embedder.store.calls == [(len(queries), 3, "u1")]
+
+
+def test_merge_keeps_each_chunk_once_with_its_closest_query(rag):
+    queries = ["q0", "q1", "q2"]
+    results = rag.embedder.store.query([embed(q) for q in queries], n_results=3)
+
+    chunks = rag.merge_query_results(queries, results, max_chunks=10)
+
+    assert [chunk["id"] for chunk in chunks] == ["c1", "c2"]
+    assert chunks[0]["distance"] == pytest.approx(0.8)
+    assert chunks[0]["query"] == "q2"
+    assert chunks[1]["query"] == "q0"
+    assert rag.merge_query_results(queries, results, max_chunks=1)[0]["id"] == "c1"
+
+
+def test_search_failure_returns_no_chunks(rag):
+    def broken(*args, **kwargs):
+        raise RuntimeError("vector store down")
+
+    rag.embedder.store.query = broken
+
+    assert rag.fetch_relevant_chunks("u1", "What is my balance?") == []
+
+
+# ============= BOUNDED EXECUTOR =============
+
+def test_blocking_work_is_capped_and_keeps_the_loop_responsive():
+    async def scenario():
+        rag = RAGService(embedder_agent=None, max_workers=2, max_concurrency=3)
+        lock = threading.Lock()
+        state = {"running": 0, "max_running": 0, "admitted": 0, "max_admitted": 0, "threads": set()}
+
+        def blocking():
+            with lock:
+                state["running"] += 1
+                state["max_running"] = max(state["max_running"], state["running"])
+                state["threads"].add(threading.current_thread().name)
+            time.sleep(0.02)
+            with lock:
+                state["running"] -= 1
+
+        original_acquire = rag.semaphore.acquire
+
+        async def counting_acquire():
+            await original_acquire()
+            state["admitted"] = rag.max_concurrency - rag.semaphore._value
+            state["max_admitted"] = max(state["max_admitted"], state["admitted"])
+            return True
+
+        rag.semaphore.acquire = counting_acquire
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        ticking = asyncio.ensure_future(ticker())
+        try:
+            await asyncio.gather(*(rag.run_blocking(blocking) for _ in range(10)))
+        finally:
+            ticking.cancel()
+            rag.close()
+
+        assert state["max_running"] <= 2
+        assert state["max_admitted"] <= 3
+        assert all(name.startswith("rag") for name in state["threads"])
+        # 10 x 20 ms on two threads is ~100 ms; the loop kept ticking throughout
+        assert ticks >= 5
+
+    asyncio.run(scenario())
+
+
+def test_vector_context_is_retrieved_on_the_rag_pool():
+    class AsyncModel(RecordingModel):
+        async def encode_async(self, texts):
+            return self.encode(texts)
+
+    class ThreadRecordingStore(RecordingStore):
+        def query(self, query_embeddings, n_results, user_id=None):
+            self.thread = threading.current_thread().name
+            return super().query(query_embeddings, n_results, user_id)
+
+    async def scenario():
+        agent = SimpleNamespace(query_model=AsyncModel(), store=ThreadRecordingStore())
+        rag = RAGService(agent)
+        try:
+            context = await rag.get_rag_context("u1", "Tell me about my goals")
+        finally:
+            rag.close()
+
+        assert "chunk one" in context
+        assert agent.store.thread.startswith("rag")
+        assert rag.get_routing_stats()["vector"] == 1
+
+    asyncio.run(scenario())
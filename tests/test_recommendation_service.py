@@ -0,0 +1,154 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("emergentintegrations")
+
+from recommendation_service import RecommendationService, portfolio_fingerprint  # noqa: E402
+
+SUMMARY = {
+    "total_value": 100000.0, "total_equity": 80000.0, "equity_pct": 80.0, "mf_pct": 20.0,
+    "other_pct": 0.0, "crypto_invested": 0, "gold_invested": 0, "holdings_count": 3, "age_group": "25-30",
+}
+
+
+class FakeGateway:
+    """Answers investment_advisor prompts once released, or raises"""
+
+    def __init__(self, fail=False):
+        self.calls = 0
+        self.fail = fail
+        self.release = asyncio.Event()
+
+    async def complete(self, route, prompt, session_id=None):
+        self.calls += 1
+        await self.release.wait()
+        if self.fail:
+            raise RuntimeError("LLM timed out")
+        return SimpleNamespace(text=json.dumps([{"title": f"Idea {self.calls}", "priority": 6}]))
+
+
+async def settle(service):
+    while service._refreshing:
+        await asyncio.sleep(0)
+
+
+def test_miss_returns_immediately_and_refreshes_once():
+    async def scenario():
+        llm = FakeGateway()
+        service = RecommendationService(db=None, llm_gateway=llm)
+
+        first = [service.cached_ai_recommendations("u1", "fp", SUMMARY) for _ in range(5)]
+        await asyncio.sleep(0)
+
+        assert first == [[]] * 5
+        assert llm.calls == 1 and len(service._refreshing) == 1
+        llm.release.set()
+        await settle(service)
+
+        assert service.cached_ai_recommendations("u1", "fp", SUMMARY) == [
+            {"title": "Idea 1", "priority": 6, "type": "ai"}
+        ]
+        assert service.get_stats()["misses"] == 5
+        assert service.get_stats()["hits"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_expired_entry_is_served_while_it_refreshes():
+    async def scenario():
+        llm = FakeGateway()
+        llm.release.set()
+        service = RecommendationService(db=None, llm_gateway=llm, ttl_seconds=-1)
+        service.cached_ai_recommendations("u1", "fp", SUMMARY)
+        await settle(service)
+
+        stale = service.cached_ai_recommendations("u1", "fp", SUMMARY)
+        assert stale[0]["title"] == "Idea 1"
+        await settle(service)
+        assert service.cached_ai_recommendations("u1", "fp", SUMMARY)[0]["title"] == "Idea 2"
+        assert service.get_stats()["stale_hits"] == 2
+
+        # A different portfolio never gets the old portfolio's recommendations
+        assert service.cached_ai_recommendations("u1", "other", SUMMARY) == []
+        await settle(service)
+
+    asyncio.run(scenario())
+
+
+def test_failed_refresh_keeps_previous_and_backs_off():
+    async def scenario():
+        llm = FakeGateway()
+        llm.release.set()
+        service = RecommendationService(db=None, llm_gateway=llm, ttl_seconds=-1, retry_seconds=60)
+        service.cached_ai_recommendations("u1", "fp", SUMMARY)
+        await settle(service)
+
+        llm.fail = True
+        service.cached_ai_recommendations("u1", "fp", SUMMARY)
+        await settle(service)
+
+        # Previous recommendations kept, and no new LLM call until the back-off passes
+        assert service.cached_ai_recommendations("u1", "fp", SUMMARY)[0]["title"] == "Idea 1"
+        await asyncio.sleep(0)
+        assert llm.calls == 2
+        assert service.get_stats()["refresh_failures"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_close_cancels_pending_refreshes():
+    async def scenario():
+        llm = FakeGateway()
+        service = RecommendationService(db=None, llm_gateway=llm)
+        service.cached_ai_recommendations("u1", "fp", SUMMARY)
+        service.cached_ai_recommendations("u2", "fp", SUMMARY)
+        tasks = list(service._refreshing.values())
+        await asyncio.sleep(0)
+
+        await service.close()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        assert all(task.cancelled() for task in tasks)
+        assert not service._refreshing and not service._cache
+
+    asyncio.run(scenario())
+
+
+def test_priority_bonus_does_not_inflate_cached_entries():
+    async def scenario():
+        llm = FakeGateway()
+        llm.release.set()
+        service = RecommendationService(db=None, llm_gateway=llm)
+        portfolio = ([], [], [])
+
+        async def load_portfolio(user_id):
+            return portfolio
+
+        service.load_portfolio = load_portfolio
+        # Empty portfolio: the summary has no holdings and the refresh still caches
+        service.cached_ai_recommendations("u1", portfolio_fingerprint(*portfolio), SUMMARY)
+        await settle(service)
+
+        for _ in range(3):
+            recommendations = await service.get_recommendations("u1")
+            assert recommendations[0] == {"title": "Idea 1", "priority": 8, "type": "ai"}
+        assert service._cache["u1"]["recommendations"][0]["priority"] == 6
+
+    asyncio.run(scenario())
+
+
+def test_cache_is_bounded():
+    async def scenario():
+        llm = FakeGateway()
+        llm.release.set()
+        service = RecommendationService(db=None, llm_gateway=llm, max_users=2)
+        for user_id in ["u1", "u2", "u3"]:
+            service.cached_ai_recommendations(user_id, "fp", SUMMARY)
+            await settle(service)
+
+        assert list(service._cache) == ["u2", "u3"]
+
+    asyncio.run(scenario())
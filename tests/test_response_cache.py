@@ -0,0 +1,82 @@
+import asyncio
+
+from response_cache import UserResponseCache
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_misses_share_one_computation():
+    async def scenario():
+        cache = UserResponseCache(ttl_seconds=60, max_users=10)
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"balance": 100}
+
+        results = await asyncio.gather(*(cache.get_or_compute("u1", compute) for _ in range(5)))
+
+        assert results == [{"balance": 100}] * 5
+        assert len(calls) == 1
+        assert await cache.get_or_compute("u1", compute) == {"balance": 100}
+        assert len(calls) == 1
+        assert cache.stats()["hits"] == 1
+
+    run(scenario())
+
+
+def test_result_computed_across_an_invalidation_is_not_stored():
+    async def scenario():
+        cache = UserResponseCache(ttl_seconds=60, max_users=10)
+        started = asyncio.Event()
+        finish = asyncio.Event()
+
+        async def compute():
+            started.set()
+            await finish.wait()
+            return "before write"
+
+        request = asyncio.ensure_future(cache.get_or_compute("u1", compute))
+        await started.wait()
+        cache.invalidate("u1")
+        finish.set()
+
+        assert await request == "before write"
+        assert cache.get("u1") is None
+
+        # The next computation is stored as usual
+        async def fresh():
+            return "after write"
+        assert await cache.get_or_compute("u1", fresh) == "after write"
+        assert cache.get("u1") == "after write"
+
+    run(scenario())
+
+
+def test_invalidations_do_not_accumulate_per_user_state():
+    cache = UserResponseCache(ttl_seconds=60, max_users=10)
+    for i in range(10000):
+        cache.set(f"user-{i % 20}", i)
+        cache.invalidate(f"user-{i}")
+
+    assert len(cache._entries) <= 10
+    assert not cache._invalidated_inflight
+    assert not cache._inflight
+
+
+def test_lru_bound_and_ttl():
+    cache = UserResponseCache(ttl_seconds=60, max_users=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+
+    expired = UserResponseCache(ttl_seconds=-1, max_users=2)
+    expired.set("a", 1)
+    assert expired.get("a") is None
@@ -0,0 +1,255 @@
+import asyncio
+import random
+from datetime import datetime, timedelta, timezone
+
+from spending_rollups import (
+    BUILT_MARKER, ROLLUP_REBUILD_LEASE_SECONDS, SpendingRollups, split_range, to_naive_utc
+)
+
+
+def test_split_range_naive_month_span():
+    raw, days, months = split_range(datetime(2025, 1, 15, 10), datetime(2025, 3, 10))
+    assert raw == [(datetime(2025, 1, 15, 10), datetime(2025, 1, 16))]
+    assert days == [(datetime(2025, 1, 16), datetime(2025, 2, 1)), (datetime(2025, 3, 1), datetime(2025, 3, 10))]
+    assert months == [(datetime(2025, 2, 1), datetime(2025, 3, 1))]
+
+
+def test_split_range_accepts_aware_bounds():
+    start = datetime.fromisoformat("2025-01-01T00:00:00+00:00")
+    end = datetime.fromisoformat("2025-01-08T00:00:00+00:00")
+    assert split_range(start, end) == ([], [(datetime(2025, 1, 1), datetime(2025, 1, 8))], [])
+    assert split_range(start, end, use_months=False) == ([], [(datetime(2025, 1, 1), datetime(2025, 1, 8))], [])
+
+
+def test_split_range_converts_offsets_to_utc():
+    ist = timezone(timedelta(hours=5, minutes=30))
+    start = datetime(2025, 1, 2, 5, 30, tzinfo=ist)   # 2025-01-02 00:00 UTC
+    raw, days, months = split_range(start, None)
+    assert raw == []
+    assert days == [(datetime(2025, 1, 2), datetime(2025, 2, 1))]
+    assert months == [(datetime(2025, 2, 1), None)]
+
+
+def test_to_naive_utc_leaves_naive_untouched():
+    naive = datetime(2025, 1, 1, 12)
+    assert to_naive_utc(naive) is naive
+    assert to_naive_utc(datetime(2025, 1, 1, 12, tzinfo=timezone.utc)) == naive
+
+
+# ============= ROLLUPS AGAINST AN IN-MEMORY DATABASE =============
+
+USER = "user-1"
+CATEGORIES = ["Food", "Travel", "Shopping"]
+MERCHANTS = ["Swiggy", "Uber", "Amazon", "Zomato"]
+
+
+def make_transactions(count, start=datetime(2025, 1, 1), days=120, user_id=USER, seed=7):
+    rng = random.Random(seed)
+    return [
+        {
+            "user_id": user_id,
+            "date": start + timedelta(minutes=rng.randrange(days * 24 * 60)),
+            "amount": rng.randrange(50, 5000),
+            "transaction_type": rng.choice(["expense", "expense", "expense", "income"]),
+            "category": rng.choice(CATEGORIES),
+            "merchant": rng.choice(MERCHANTS),
+        }
+        for _ in range(count)
+    ]
+
+
+def raw_totals(transactions, start, end, group_field, transaction_type="expense"):
+    """What totals_by must return, computed straight from the transactions"""
+    totals = {}
+    for txn in transactions:
+        if txn["transaction_type"] != transaction_type or txn["date"] < start or (end and txn["date"] >= end):
+            continue
+        entry = totals.setdefault(txn[group_field] if group_field else None, {"total": 0, "count": 0})
+        entry["total"] += txn["amount"]
+        entry["count"] += 1
+    return totals
+
+
+def raw_daily(transactions, start, end):
+    days = {}
+    for txn in transactions:
+        if txn["transaction_type"] != "expense" or txn["date"] < start or (end and txn["date"] >= end):
+            continue
+        entry = days.setdefault(datetime(txn["date"].year, txn["date"].month, txn["date"].day), {"total": 0, "count": 0})
+        entry["total"] += txn["amount"]
+        entry["count"] += 1
+    return days
+
+
+RANGES = [
+    (datetime(2025, 1, 1), None),
+    (datetime(2025, 1, 15, 10, 30), datetime(2025, 3, 10, 18)),       # partial days and whole months
+    (datetime(2025, 2, 1), datetime(2025, 3, 1)),                     # exactly one month
+    (datetime(2025, 2, 3, 6), datetime(2025, 2, 3, 20)),              # inside one day
+    (datetime(2025, 3, 30, 12), None),
+]
+
+
+async def assert_matches_raw(rollups, transactions):
+    for start, end in RANGES:
+        for group_field in ["category", "merchant", None]:
+            totals = await rollups.totals_by(USER, start, end, group_field)
+            # mongomock (unlike MongoDB) emits a zero row when $group by null sees no documents
+            assert {k: {"total": v["total"], "count": v["count"]} for k, v in totals.items() if v["count"]} \
+                == raw_totals(transactions, start, end, group_field), (start, end, group_field)
+        assert await rollups.daily_totals(USER, start, end) == raw_daily(transactions, start, end), (start, end)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_rebuild_matches_raw_aggregation(mongo_db):
+    async def scenario():
+        rollups = SpendingRollups(mongo_db)
+        transactions = make_transactions(400)
+        await mongo_db.transactions.insert_many([dict(t) for t in transactions])
+
+        await rollups.rebuild_user(USER)
+
+        assert await rollups.current_generation(USER)
+        await assert_matches_raw(rollups, transactions)
+
+    run(scenario())
+
+
+def test_incremental_records_match_raw_aggregation(mongo_db):
+    async def scenario():
+        rollups = SpendingRollups(mongo_db)
+        transactions = make_transactions(200)
+        await mongo_db.transactions.insert_many([dict(t) for t in transactions])
+        await rollups.rebuild_user(USER)
+        generation = await rollups.current_generation(USER)
+
+        later = make_transactions(150, seed=11)
+        await mongo_db.transactions.insert_many([dict(t) for t in later])
+        await rollups.record_transactions(later)
+
+        assert await rollups.current_generation(USER) == generation
+        await assert_matches_raw(rollups, transactions + later)
+
+    run(scenario())
+
+
+def test_reads_fall_back_to_raw_before_first_build(mongo_db):
+    async def scenario():
+        rollups = SpendingRollups(mongo_db)
+        transactions = make_transactions(100)
+        await mongo_db.transactions.insert_many([dict(t) for t in transactions])
+
+        assert await rollups.current_generation(USER) is None
+        await assert_matches_raw(rollups, transactions)
+
+    run(scenario())
+
+
+def test_rebuild_keeps_only_current_and_previous_generation(mongo_db):
+    async def scenario():
+        rollups = SpendingRollups(mongo_db)
+        await mongo_db.transactions.insert_many(make_transactions(50))
+
+        generations = []
+        for _ in range(3):
+            await rollups.rebuild_user(USER)
+            generations.append(await rollups.current_generation(USER))
+
+        stored = set(await mongo_db.spending_rollups.distinct("generation", {"granularity": {"$ne": BUILT_MARKER}}))
+        assert len(set(generations)) == 3
+        assert stored == set(generations[1:])
+
+    run(scenario())
+
+
+def test_first_transactions_rebuild_in_background(mongo_db):
+    async def scenario():
+        rollups = SpendingRollups(mongo_db)
+        transactions = make_transactions(60)
+        await mongo_db.transactions.insert_many([dict(t) for t in transactions])
+
+        await rollups.record_transactions(transactions)
+
+        # The caller does not wait for the build
+        assert await rollups.current_generation(USER) is None
+        assert USER in rollups._rebuilding
+        await rollups._rebuilding[USER]
+
+        assert await rollups.current_generation(USER)
+        await assert_matches_raw(rollups, transactions)
+
+    run(scenario())
+
+
+def test_lease_is_exclusive_without_indexes(mongo_db):
+    async def scenario():
+        rollups = SpendingRollups(mongo_db)
+        # No ensure_indexes(): the marker's _id alone keeps the lease exclusive
+        acquired = await asyncio.gather(*(rollups._acquire_lease(USER, f"lease-{i}") for i in range(5)))
+
+        assert acquired.count(True) == 1
+        assert await mongo_db.spending_rollups.count_documents({"granularity": BUILT_MARKER}) == 1
+
+    run(scenario())
+
+
+def test_expired_lease_is_taken_over(mongo_db):
+    async def scenario():
+        rollups = SpendingRollups(mongo_db)
+        assert await rollups._acquire_lease(USER, "crashed")
+        assert not await rollups._acquire_lease(USER, "second")
+
+        expired = datetime.utcnow() - timedelta(seconds=ROLLUP_REBUILD_LEASE_SECONDS)
+        await mongo_db.spending_rollups.update_one({"_id": f"built:{USER}"}, {"$set": {"rebuilding_until": expired}})
+
+        assert await rollups._acquire_lease(USER, "second")
+        assert (await rollups._marker(USER))["rebuild_id"] == "second"
+
+    run(scenario())
+
+
+def test_rebuild_and_records_during_a_rebuild_mark_it_dirty(mongo_db):
+    async def scenario():
+        rollups = SpendingRollups(mongo_db)
+        transactions = make_transactions(40)
+        await mongo_db.transactions.insert_many([dict(t) for t in transactions])
+        await rollups.rebuild_user(USER)
+        generation = await rollups.current_generation(USER)
+        rollup_docs = await mongo_db.spending_rollups.count_documents({"generation": generation})
+
+        # Another worker holds the lease
+        assert await rollups._acquire_lease(USER, "other-worker")
+        await rollups.rebuild_user(USER)
+        marker = await rollups._marker(USER)
+        assert marker["dirty"] is True
+        assert marker["current_generation"] == generation
+
+        await mongo_db.spending_rollups.update_one({"_id": f"built:{USER}"}, {"$set": {"dirty": False}})
+        later = make_transactions(10, seed=3)
+        await mongo_db.transactions.insert_many([dict(t) for t in later])
+        await rollups.record_transactions(later)
+
+        # Left to the running rebuild rather than incremented into the old generation
+        assert (await rollups._marker(USER))["dirty"] is True
+        assert await mongo_db.spending_rollups.count_documents({"generation": generation}) == rollup_docs
+        assert not rollups._rebuilding
+
+    run(scenario())
+
+
+def test_legacy_markers_are_rekeyed(mongo_db):
+    async def scenario():
+        rollups = SpendingRollups(mongo_db)
+        await mongo_db.spending_rollups.insert_one(
+            {"user_id": USER, "granularity": BUILT_MARKER, "current_generation": "g1"}
+        )
+
+        await rollups.migrate_markers()
+
+        assert await rollups.current_generation(USER) == "g1"
+        assert await mongo_db.spending_rollups.count_documents({"granularity": BUILT_MARKER}) == 1
+
+    run(scenario())
@@ -0,0 +1,119 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+pytest.importorskip("emergentintegrations")
+httpx = pytest.importorskip("httpx")
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test")
+
+import server  # noqa: E402
+
+USER = "user-1"
+
+
+def seed(mongo_db, count=25):
+    """Transactions in groups of five sharing one date, so pages break inside ties"""
+    base = datetime(2025, 3, 1, 12)
+    transactions = [
+        {
+            "_id": ObjectId(),
+            "user_id": USER,
+            "date": base - timedelta(days=i // 5),
+            "amount": 100 + i,
+            "category": "Food" if i % 2 else "Travel",
+            "merchant": "Swiggy",
+            "transaction_type": "expense",
+        }
+        for i in range(count)
+    ]
+    asyncio.run(mongo_db.transactions.insert_many(transactions))
+    return sorted(transactions, key=lambda t: (t["date"], t["_id"]), reverse=True)
+
+
+@pytest.fixture
+def api(mongo_db, monkeypatch):
+    monkeypatch.setattr(server, "db", mongo_db)
+
+    def get(path, **params):
+        async def request():
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                return await client.get(f"/api{path}", params=params)
+        return asyncio.run(request())
+
+    return get
+
+
+def test_list_shape_and_offset_are_kept(api, mongo_db):
+    expected = [str(t["_id"]) for t in seed(mongo_db)]
+
+    response = api("/transactions", user_id=USER, limit=10, offset=5)
+
+    assert response.status_code == 200
+    assert isinstance(response.json(), list)
+    assert [t["_id"] for t in response.json()] == expected[5:15]
+
+
+def test_keyset_pages_cover_every_row_once_across_date_ties(api, mongo_db):
+    expected = [str(t["_id"]) for t in seed(mongo_db)]
+
+    seen, cursor = [], None
+    while True:
+        params = {"user_id": USER, "limit": 7}
+        if cursor:
+            params["cursor"] = cursor
+        page = api("/transactions/page", **params).json()
+        seen.extend(t["_id"] for t in page["transactions"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    # 7 does not divide the groups of 5 equal dates, so the _id tiebreak decides each boundary
+    assert seen == expected
+
+
+def test_last_full_page_has_no_next_cursor(api, mongo_db):
+    seed(mongo_db, count=10)
+
+    first = api("/transactions/page", user_id=USER, limit=5).json()
+    second = api("/transactions/page", user_id=USER, limit=5, cursor=first["next_cursor"]).json()
+
+    assert first["next_cursor"] is not None
+    assert len(second["transactions"]) == 5
+    assert second["next_cursor"] is None
+
+
+def test_filters_apply_to_keyset_pages(api, mongo_db):
+    seed(mongo_db)
+
+    page = api("/transactions/page", user_id=USER, limit=100, category="Food", min_amount=110).json()
+
+    assert page["transactions"]
+    assert all(t["category"] == "Food" and t["amount"] >= 110 for t in page["transactions"])
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", "e30", server.encode_transaction_cursor(
+    {"_id": ObjectId(), "date": datetime(2025, 1, 1)})[:-4]])
+def test_malformed_cursor_is_rejected(api, mongo_db, cursor):
+    seed(mongo_db, count=3)
+
+    response = api("/transactions/page", user_id=USER, cursor=cursor)
+
+    assert response.status_code == 400
+    assert "Invalid cursor" in response.json()["detail"]
+
+
+def test_cursor_round_trips_string_and_object_ids():
+    date = datetime(2025, 1, 2, 3, 4, 5)
+    object_id = ObjectId()
+
+    assert server.decode_transaction_cursor(
+        server.encode_transaction_cursor({"_id": object_id, "date": date})
+    ) == (date, object_id)
+    assert server.decode_transaction_cursor(
+        server.encode_transaction_cursor({"_id": "txn-42", "date": date})
+    ) == (date, "txn-42")